@@ -11,9 +11,302 @@
 __author__ = 'Steve Foley'
 __license__ = 'Apache 2.0'
 
+import re
+from collections import deque
+
 from mi.core.log import get_logger ; log = get_logger()
 
 from mi.core.exceptions import SampleException
+from mi.core.exceptions import NotImplementedException
+
+class IncrementalSieve(object):
+    """
+    Base class for a stateful sieve. Instead of being handed the whole
+    unmatched buffer every time data arrives, an incremental sieve is fed only
+    the newly added bytes along with their absolute offset in the stream. It
+    keeps the unmatched bytes it still needs (a partial frame) and its own
+    resume point, and returns only the frames completed by the new data.
+
+    Feeding needs max_frame_size, the length of the longest frame the sieve
+    can find. Unmatched bytes further back than that can not start a frame
+    and are dropped, so each feed rescans at most one frame's worth of old
+    data. Without a bound every feed would rescan all of the unmatched data,
+    so an unbounded sieve is not incremental and the chunkers call it like a
+    plain sieve function instead, which is a stateless scan of whatever it
+    is given.
+    """
+    def __init__(self, max_frame_size=None):
+        """
+        @param max_frame_size The length of the longest frame the sieve can
+            find, None if unbounded
+        """
+        if max_frame_size is not None and max_frame_size <= 0:
+            raise SampleException("max_frame_size must be positive, not %r" % max_frame_size)
+        self._max_frame_size = max_frame_size
+        self.reset()
+
+    @property
+    def incremental(self):
+        """
+        True if the sieve can be fed, i.e. its frames are bounded
+        """
+        return self._max_frame_size is not None
+
+    def reset(self, base_offset=0):
+        """
+        Forget any pending partial data and resume from a new offset
+        @param base_offset The absolute offset of the next byte to be fed
+        """
+        self._pending = ''
+        self._pending_offset = base_offset
+
+    def feed(self, data, base_offset):
+        """
+        Feed newly added data into the sieve.
+
+        @param data The new data, contiguous with what has been fed so far
+        @param base_offset The absolute offset of data[0] in the stream. If
+            this does not follow on from the previously fed data the sieve
+            starts over at this offset.
+        @retval A list of (start, end) tuples in absolute stream offsets for
+            each frame completed by this data, in sequential order. Sieves
+            may add more members to the tuples, such as a pattern id.
+        @throws SampleException if the sieve has no max_frame_size
+        """
+        if self._max_frame_size is None:
+            raise SampleException("%s needs a max_frame_size to be fed" %
+                                  self.__class__.__name__)
+        if base_offset != self._pending_offset + len(self._pending):
+            self.reset(base_offset)
+
+        self._pending += data
+        (result, resume_index) = self._scan(self._pending)
+        # nothing further back than the longest frame can start a new one
+        resume_index = max(resume_index, len(self._pending) - self._max_frame_size)
+
+        offset = self._pending_offset
+        self._pending = self._pending[resume_index:]
+        self._pending_offset += resume_index
+
+        return [(r[0] + offset, r[1] + offset) + r[2:] for r in result]
+
+    def _scan(self, raw_data):
+        """
+        Scan the pending data for complete frames.
+
+        @param raw_data The pending data, starting at the resume point
+        @retval A tuple of (frames, resume_index) where frames is a list of
+            (start, end) tuples relative to raw_data and resume_index is where
+            the next scan needs to start from; nothing before it can be part
+            of a frame that is not already complete.
+        """
+        raise NotImplementedException("_scan() not overridden!")
+
+    def __call__(self, raw_data):
+        """
+        Stateless scan of a whole buffer, the plain sieve function interface
+        """
+        (result, resume_index) = self._scan(raw_data)
+        return result
+
+
+class IncrementalRegexSieve(IncrementalSieve):
+    """
+    An incremental version of Chunker.regex_sieve_function. When fed, the
+    regexes are only run over the bytes past the end of the last complete
+    match and no more than max_frame_size bytes back, so a long run of
+    non-data does not get rescanned with every new packet.
+    """
+    def __init__(self, regex_list, max_frame_size=None):
+        """
+        @param regex_list a list of pre-compiled regexes that will identify some
+            flavor of a pattern in the raw data for matching.
+        @param max_frame_size The length of the longest frame any of the
+            regexes can match, None if unbounded
+        """
+        self._regex_list = regex_list
+        IncrementalSieve.__init__(self, max_frame_size)
+
+    def _scan(self, raw_data):
+        result = Chunker.regex_sieve_function(raw_data, self._regex_list)
+        result.sort()
+
+        resume_index = 0
+        if result:
+            resume_index = max([e for (s, e) in result])
+
+        return (result, resume_index)
+
+
+class RegexSetSieve(IncrementalRegexSieve):
+    """
+    A sieve that merges a list of regexes into one alternation so the data is
+    walked once no matter how many patterns there are. Frames come back as
+    ordered, non-overlapping (start, end, pattern_id) tuples; where two
+    patterns could match at the same place the one listed first wins. Since
+    the output is already ordered and free of overlaps (the sieve sets
+    ordered = True) the chunkers skip sorting and overlap checking it.
+
+    Use identify() in _got_chunk to find which pattern a chunk came from with
+    a single match instead of trying each regex in turn.
+
+    Capturing groups inside the patterns are made non-capturing in the
+    combined regex. Patterns that cannot be combined (numbered
+    backreferences, or a mix of compile flags) fall back to one scan per
+    regex with the same output.
+    """
+    ordered = True
+
+    # named group wrapped around each pattern in the combined regex
+    GROUP_PREFIX = '_sieve_'
+
+    def __init__(self, regex_list, pattern_ids=None, max_frame_size=None):
+        """
+        @param regex_list a list of pre-compiled regexes that will identify some
+            flavor of a pattern in the raw data for matching.
+        @param pattern_ids The id to report for each regex, defaults to the
+            index of the regex in regex_list
+        @param max_frame_size The length of the longest frame any of the
+            regexes can match, None if unbounded
+        """
+        if pattern_ids is None:
+            pattern_ids = range(len(regex_list))
+        if len(pattern_ids) != len(regex_list):
+            raise SampleException("Need one pattern id per regex")
+
+        self._pattern_ids = list(pattern_ids)
+        self._group_ids = {}
+        for index, pattern_id in enumerate(self._pattern_ids):
+            self._group_ids["%s%d" % (self.GROUP_PREFIX, index)] = pattern_id
+
+        self._combined = self._combine(regex_list)
+        IncrementalRegexSieve.__init__(self, regex_list, max_frame_size)
+
+    @classmethod
+    def _combine(cls, regex_list):
+        """
+        Build the single alternation regex
+        @retval The compiled regex, None if these regexes cannot be combined
+        """
+        flags = set([regex.flags for regex in regex_list])
+        if len(flags) != 1:
+            log.debug("Regex set has mixed flags, scanning each regex")
+            return None
+
+        alternatives = []
+        for index, regex in enumerate(regex_list):
+            pattern = cls._non_capturing(regex.pattern)
+            if pattern is None:
+                log.debug("Cannot combine regex %s, scanning each regex", regex.pattern)
+                return None
+            alternatives.append("(?P<%s%d>%s)" % (cls.GROUP_PREFIX, index, pattern))
+
+        try:
+            return re.compile("|".join(alternatives), flags.pop())
+        except re.error as e:
+            log.debug("Failed to combine regex set (%s), scanning each regex", e)
+            return None
+
+    @staticmethod
+    def _non_capturing(pattern):
+        """
+        Rewrite the capturing groups in a pattern as non-capturing groups so
+        the patterns can be combined without clashing group names or running
+        into the group limit.
+        @retval The rewritten pattern, None if the pattern uses backreferences
+        """
+        result = []
+        index = 0
+        in_class = False
+        length = len(pattern)
+        while index < length:
+            char = pattern[index]
+            if char == '\\':
+                if index + 1 < length and pattern[index + 1].isdigit() and \
+                        pattern[index + 1] != '0':
+                    return None
+                result.append(pattern[index:index + 2])
+                index += 2
+                continue
+
+            if in_class:
+                if char == ']':
+                    in_class = False
+            elif char == '[':
+                in_class = True
+                # a ] right after the opening bracket (or ^) is a literal
+                if pattern[index + 1:index + 2] == '^':
+                    result.append('[^')
+                    index += 2
+                else:
+                    result.append('[')
+                    index += 1
+                if pattern[index:index + 1] == ']':
+                    result.append(']')
+                    index += 1
+                continue
+            elif char == '(':
+                if pattern.startswith('(?P<', index):
+                    result.append('(?:')
+                    index = pattern.index('>', index) + 1
+                    continue
+                if pattern.startswith('(?P=', index):
+                    return None
+                if not pattern.startswith('(?', index):
+                    result.append('(?:')
+                    index += 1
+                    continue
+
+            result.append(char)
+            index += 1
+
+        return ''.join(result)
+
+    def _scan(self, raw_data):
+        if self._combined is None:
+            result = []
+            for regex, pattern_id in zip(self._regex_list, self._pattern_ids):
+                for match in regex.finditer(raw_data):
+                    result.append((match.start(), match.end(), pattern_id))
+            result.sort()
+            # keep the ordered, non-overlapping promise
+            ordered_result = []
+            previous_end = 0
+            for frame in result:
+                if frame[0] >= previous_end:
+                    ordered_result.append(frame)
+                    previous_end = frame[1]
+            result = ordered_result
+        else:
+            group_ids = self._group_ids
+            result = [(match.start(), match.end(), group_ids[match.lastgroup])
+                      for match in self._combined.finditer(raw_data)
+                      if match.end() > match.start()]
+
+        resume_index = 0
+        if result:
+            resume_index = result[-1][1]
+
+        return (result, resume_index)
+
+    def identify(self, chunk):
+        """
+        Find which pattern matches the start of a chunk
+        @param chunk A chunk of data, usually one returned by the chunker
+        @retval The pattern id of the first pattern that matches, None if no
+            pattern matches
+        """
+        if self._combined is None:
+            for regex, pattern_id in zip(self._regex_list, self._pattern_ids):
+                if regex.match(chunk):
+                    return pattern_id
+            return None
+
+        match = self._combined.match(chunk)
+        if match is None:
+            return None
+        return self._group_ids[match.lastgroup]
+
 
 class Chunker(object):
     """
@@ -38,9 +331,21 @@ class Chunker(object):
             buffer[start_index:end_index] to properly describe the data block.
             If no data is present, return and empty list. If multiple data
             blocks are found, the returned list will contain multiple tuples,
-            IN SEQUENTIAL ORDER and WITHOUT OVERLAP.
+            IN SEQUENTIAL ORDER and WITHOUT OVERLAP. This may also be an
+            IncrementalSieve (or anything with a matching feed() method),
+            in which case only newly added data is fed to it. A sieve whose
+            incremental attribute is False is called like a plain sieve.
         """
         self.sieve = data_sieve_fn
+        self._incremental_sieve = callable(getattr(data_sieve_fn, 'feed', None)) and \
+            getattr(data_sieve_fn, 'incremental', True)
+        # a sieve that promises ordered, non-overlapping output (possibly with
+        # extra tuple members such as a pattern id) is not sorted or checked
+        self._ordered_sieve = getattr(data_sieve_fn, 'ordered', False)
+        # absolute stream offset of the start of the buffer, and how far into
+        # the stream an incremental sieve has been fed
+        self._consumed = 0
+        self._fed = 0
         
         self.raw_chunk_list = []
         self.data_chunk_list = []
@@ -133,12 +438,13 @@ class Chunker(object):
         """
         log.debug("Generating data lists with start index %s", start_index)
         return_list = {'data_chunk_list':[], 'non_data_chunk_list':[]}
-        result = self.sieve(self.buffer[start_index:])
-        # assert no overlap!
-        if (self.overlaps(result)):
-            raise SampleException("Overlapping blocks in sieve list: %s" % result)
-        # sort to protect us from some sloppy sieve code
-        result.sort()
+        result = self._sieve(start_index)
+        if not self._ordered_sieve:
+            # assert no overlap!
+            if (self.overlaps(result)):
+                raise SampleException("Overlapping blocks in sieve list: %s" % result)
+            # sort to protect us from some sloppy sieve code
+            result.sort()
 
         # rebase to buffer coordinates
         return_list['data_chunk_list'] = [(s+start_index, e+start_index) for (s, e) in result]
@@ -165,6 +471,35 @@ class Chunker(object):
         log.debug("Generated return list: %s", return_list)
         return return_list    
     
+    def _sieve(self, start_index):
+        """
+        Run the sieve over the buffer past start_index. A plain sieve function
+        is handed the whole slice, an incremental sieve is only fed what has
+        been added since it was last fed.
+
+        @param start_index The buffer index to sieve from
+        @retval A list of (start, end) tuples relative to start_index
+        """
+        if not self._incremental_sieve:
+            result = self.sieve(self.buffer[start_index:])
+            if self._ordered_sieve:
+                result = [(r[0], r[1]) for r in result]
+            return result
+
+        buffer_length = len(self.buffer)
+        fed_index = self._fed - self._consumed
+        if not 0 <= fed_index <= buffer_length:
+            # the buffer was replaced underneath us, start over
+            fed_index = start_index
+
+        result = self.sieve.feed(self.buffer[fed_index:],
+                                 self._consumed + fed_index)
+        self._fed = self._consumed + buffer_length
+
+        # drop anything that started in data that has already been consumed
+        offset = self._consumed + start_index
+        return [(r[0] - offset, r[1] - offset) for r in result if r[0] >= offset]
+
     def add_timestamps(self, start_end_list):
         """
         Add timestamps to a list of (start, end) tuples that are normalized to
@@ -331,6 +666,7 @@ class Chunker(object):
         @param end_index the last index used...clean up to here
         """
         # Clean up buffer
+        self._consumed += end_index
         if isinstance(self.buffer, str):
             self.buffer = self.buffer[end_index:]
         else:
@@ -473,4 +809,277 @@ class BinaryChunker(Chunker):
     def __init__(self, data_sieve_fn):
         Chunker.__init__(self, data_sieve_fn)
         self.buffer = []
-    
\ No newline at end of file
+    
+
+
+class RingBufferChunker(Chunker):
+    """
+    A version of the chunker that keeps its data in a bytearray with a moving
+    base offset instead of rebuilding a string on every add and every fetch.
+    Chunk indexes are kept in deques in absolute stream coordinates, so
+    consuming a chunk only pops from the front of the indexes, and the sieve
+    only ever sees the unconsumed tail past the last complete match. The
+    public interface (and the buffer-relative indices it returns) matches
+    StringChunker, so it can be dropped into a driver or parser as is.
+    """
+    # Consumed bytes are only released from the front of the bytearray once
+    # there are at least this many of them and they make up more than half
+    # of the storage, which keeps the compaction cost amortized O(1) per byte
+    COMPACT_THRESHOLD = 65536
+
+    def __init__(self, data_sieve_fn):
+        self._reset()
+        Chunker.__init__(self, data_sieve_fn)
+
+    def _reset(self):
+        """
+        Clear the storage and all chunk indexes
+        """
+        self._buf = bytearray()
+        # absolute stream offset of self._buf[0]
+        self._base = 0
+        # absolute stream offset of the first unconsumed byte
+        self._head = 0
+        # absolute stream offset to resume sieving from, the end of the last
+        # complete data chunk found
+        self._scan_pos = 0
+        # absolute stream offset an incremental sieve has been fed up to
+        self._fed = 0
+        self._raw = deque()
+        self._data = deque()
+        self._nondata = deque()
+
+    def _to_relative(self, chunk_deque):
+        """
+        Convert an absolute chunk index into a buffer relative list
+        """
+        head = self._head
+        return [(s - head, e - head, t) for (s, e, t) in chunk_deque]
+
+    def _to_absolute(self, chunk_list):
+        """
+        Convert a buffer relative chunk list into an absolute chunk index
+        """
+        head = self._head
+        return deque([(s + head, e + head, t) for (s, e, t) in chunk_list])
+
+    def _get_buffer(self):
+        return str(self._buf[self._head - self._base:])
+
+    def _set_buffer(self, value):
+        self._reset()
+        if self._incremental_sieve:
+            self.sieve.reset()
+        if value:
+            self._buf.extend(value)
+
+    buffer = property(_get_buffer, _set_buffer,
+                      doc="The unconsumed data as a string (a copy)")
+
+    def _get_raw_chunk_list(self):
+        return self._to_relative(self._raw)
+
+    def _set_raw_chunk_list(self, value):
+        self._raw = self._to_absolute(value)
+
+    raw_chunk_list = property(_get_raw_chunk_list, _set_raw_chunk_list)
+
+    def _get_data_chunk_list(self):
+        return self._to_relative(self._data)
+
+    def _set_data_chunk_list(self, value):
+        self._data = self._to_absolute(value)
+
+    data_chunk_list = property(_get_data_chunk_list, _set_data_chunk_list)
+
+    def _get_nondata_chunk_list(self):
+        return self._to_relative(self._nondata)
+
+    def _set_nondata_chunk_list(self, value):
+        self._nondata = self._to_absolute(value)
+
+    nondata_chunk_list = property(_get_nondata_chunk_list,
+                                  _set_nondata_chunk_list)
+
+    def add_chunk(self, raw_data, timestamp):
+        """
+        Adds a chunk of data to the end of the buffer and sieves the
+        unconsumed tail past the last complete data chunk.
+
+        @param raw_data The bunch of raw data as a string (or a list of byte
+            values)
+        @param timestamp The time (in NTP4 float format) that the data was
+            collected at the port agent
+        """
+        assert isinstance(timestamp, float)
+        start_index = self._base + len(self._buf)
+        self._buf.extend(raw_data)
+        self._raw.append((start_index, start_index + len(raw_data), timestamp))
+
+        self._sieve_tail()
+
+    def _sieve_tail(self):
+        """
+        Run the sieve over everything past the last complete data chunk and
+        index the new data and non-data blocks found there. The trailing
+        non-data block is rebuilt each time since it may be the start of a
+        fragment that is completed later.
+        """
+        scan_pos = max(self._scan_pos, self._head)
+        end_index = self._base + len(self._buf)
+
+        # drop the open tail, remembering its timestamp if it does not move
+        tail_time = None
+        while self._nondata and self._nondata[-1][0] >= scan_pos:
+            (s, e, t) = self._nondata.pop()
+            if s == scan_pos:
+                tail_time = t
+
+        if self._incremental_sieve:
+            result = self.sieve.feed(str(self._buf[self._fed - self._base:]),
+                                     self._fed)
+            self._fed = end_index
+            result = [(r[0] - scan_pos, r[1] - scan_pos)
+                      for r in result if r[0] >= scan_pos]
+        else:
+            result = self.sieve(str(self._buf[scan_pos - self._base:]))
+            if self._ordered_sieve:
+                result = [(r[0], r[1]) for r in result]
+
+        if not self._ordered_sieve:
+            if self.overlaps(result):
+                raise SampleException("Overlapping blocks in sieve list: %s" % result)
+            result.sort()
+
+        previous_end = scan_pos
+        for (s, e) in result:
+            s += scan_pos
+            e += scan_pos
+            if s > previous_end:
+                self._nondata.append((previous_end, s,
+                                      self._timestamp_at(previous_end, scan_pos, tail_time)))
+            self._data.append((s, e, self._timestamp_at(s, scan_pos, tail_time)))
+            previous_end = e
+            self._scan_pos = e
+
+        if previous_end < end_index:
+            self._nondata.append((previous_end, end_index,
+                                  self._timestamp_at(previous_end, scan_pos, tail_time)))
+
+    def _timestamp_at(self, index, scan_pos=None, tail_time=None):
+        """
+        Look up the timestamp of the raw chunk holding an absolute index. New
+        blocks are almost always in the last few raw chunks, so search from
+        the back.
+
+        @param index The absolute index to find the timestamp for
+        @param scan_pos The absolute index the current sieve started at
+        @param tail_time The timestamp of the open tail at scan_pos, if
+            known, to avoid walking back over a long unmatched tail
+        """
+        if tail_time is not None and index == scan_pos:
+            return tail_time
+        for (s, e, t) in reversed(self._raw):
+            if s <= index:
+                return t
+        return None
+
+    def _consume(self, end_index):
+        """
+        Consume the buffer up to an absolute index, trimming all the chunk
+        indexes to match. A data chunk that is only partially consumed is
+        dropped and what is left of it becomes non-data.
+
+        @param end_index The absolute index to consume up to
+        """
+        if end_index <= self._head:
+            return
+        self._head = end_index
+
+        for chunk_deque in (self._raw, self._nondata):
+            while chunk_deque and chunk_deque[0][1] <= end_index:
+                chunk_deque.popleft()
+            if chunk_deque and chunk_deque[0][0] < end_index:
+                (s, e, t) = chunk_deque.popleft()
+                chunk_deque.appendleft((end_index, e, t))
+
+        while self._data and self._data[0][0] < end_index:
+            (s, e, t) = self._data.popleft()
+            if e > end_index:
+                self._nondata.appendleft((end_index, e, t))
+
+        consumed = self._head - self._base
+        if consumed >= self.COMPACT_THRESHOLD and consumed * 2 > len(self._buf):
+            del self._buf[:consumed]
+            self._base = self._head
+
+    def _clean_buffer(self, end_index):
+        """
+        Consume the buffer up to an index relative to the unconsumed data.
+        The chunk indexes are kept in sync here, there is no need to clean
+        them separately.
+        @param end_index the last index used...clean up to here
+        """
+        self._consume(self._head + end_index)
+
+    def _get_next(self, chunk_deque, clean):
+        """
+        Fetch the first block of a chunk index
+
+        @param chunk_deque The chunk index to fetch from
+        @param clean Consume the buffer up to the end of this block
+        @retval A tuple of (timestamp, block, start, end) with buffer relative
+            indices, (None, None, None, None) if the index is empty
+        """
+        if not chunk_deque:
+            return (None, None, None, None)
+
+        (next_start, next_end, timestamp) = chunk_deque[0]
+        next_block = str(self._buf[next_start - self._base:next_end - self._base])
+        head = self._head
+
+        if clean:
+            self._consume(next_end)
+
+        return (timestamp, next_block, next_start - head, next_end - head)
+
+    def get_next_data_with_index(self, clean=True):
+        """
+        Get the next chunk of data from the buffer. By default, it clears all
+        that comes before it. This method returns the start and end indices in
+        the resulting tuple.
+
+        @param clean If set to false, do not clear the buffer when fetching the
+            data, but simply return the data block and make no further changes.
+        @return A tuple of (timestamp, data_chunk, start_index, end_index) where timestamp is in NTP4
+            float format and data chunk is a section of buffer with indices
+            between (start, end). If no data, returns (None, None, None, None)
+        """
+        return self._get_next(self._data, clean)
+
+    def get_next_non_data_with_index(self, clean=True):
+        """
+        Get the next chunk of non-data from the buffer, clearing all that comes
+        before it. Default behavior is to clear the buffer before and including
+        this data.
+
+        @param clean Remove the buffer contents before and including this data
+        @return A tuple of (timestamp, data_chunk, next_start, next_end)
+            where timestamp is in NTP4 float format and data chunk is a
+            (start, end) tuple, (None, None) if no data
+        """
+        return self._get_next(self._nondata, clean)
+
+    def get_next_raw(self, clean=True):
+        """
+        Get the next chunk of raw characters from the buffer, clearing all
+        that comes before it. Default behavior is to clear the buffer before and including
+        this data.
+
+        @param clean Remove the buffer contents before and including this data
+        @return A tuple of (timestamp, data_chunk) where timestamp is in NTP4
+            float format and data chunk is a (start, end) tuple,
+            (None, None) if empty list
+        """
+        (time, result, start, end) = self._get_next(self._raw, clean)
+        return (time, result)
@@ -16,17 +16,121 @@ import copy
 import ntplib
 import base64
 import logging
-from warnings import warn
-try:
-    import simplejson as json
-except ImportError:
-    warn("Failed to import simplejson; particle generation will be slower.")
-    import json
+import json
 
 from mi.core.common import BaseEnum
 from mi.core.exceptions import SampleException, ReadOnlyException, NotImplementedException, InstrumentParameterException
 from mi.core.log import get_logger ; log = get_logger()
 
+class JsonEncoderType(BaseEnum):
+    """
+    JSON encoders that can be used to generate particles, fastest first
+    """
+    UJSON = "ujson"
+    SIMPLEJSON = "simplejson"
+    JSON = "json"
+
+JSON_ENCODER_PREFERENCE = [JsonEncoderType.UJSON,
+                           JsonEncoderType.SIMPLEJSON,
+                           JsonEncoderType.JSON]
+
+# Values which must decode back unchanged from an encoder before it is
+# used: tiny calibration coefficients, NTP timestamps, big and negative
+# exponents and non-ascii text.
+JSON_ENCODER_PROBE = [1.2345678901234567e-08, 6.02e-23, 3590000000.123456,
+                      0.1, -2.5e+20, 1e-300, 123456789012, u'\u00b0C', 'a"\\b']
+
+_json_encode_stdlib = json.JSONEncoder().encode
+
+def _load_json_encoder(name):
+    """
+    Build an encode function for the named JSON library
+    @param name A JsonEncoderType value
+    @retval A function taking the object to encode, or None if the library
+        (or, for simplejson, its C speedups) is not installed, or if ujson
+        would change the encoded values
+    @raise InstrumentParameterException if the encoder is unknown
+    """
+    if name == JsonEncoderType.UJSON:
+        try:
+            import ujson
+        except ImportError:
+            return None
+
+        def encode(obj):
+            try:
+                return ujson.dumps(obj, double_precision=15)
+            except (OverflowError, ValueError):
+                # NaN, infinity and huge ints, which ujson refuses
+                return _json_encode_stdlib(obj)
+
+        # double_precision counts decimal places in older ujson releases, so
+        # small values lose digits. Only use ujson if nothing is lost.
+        if json.loads(encode(JSON_ENCODER_PROBE)) != JSON_ENCODER_PROBE:
+            log.debug("ujson does not round trip particle values, not using it")
+            return None
+        return encode
+
+    if name == JsonEncoderType.SIMPLEJSON:
+        try:
+            import simplejson
+            from simplejson import _speedups
+        except ImportError:
+            # pure python simplejson is slower than the stdlib encoder
+            return None
+        return simplejson.JSONEncoder().encode
+
+    if name == JsonEncoderType.JSON:
+        return _json_encode_stdlib
+
+    raise InstrumentParameterException("Unknown JSON encoder: %s" % name)
+
+_json_encoder_name = None
+_json_encode = None
+_json_encode_sorted = json.JSONEncoder(sort_keys=True).encode
+
+def set_json_encoder(name=None):
+    """
+    Select the JSON encoder used to generate particles
+    @param name A JsonEncoderType value, or None for the fastest one installed
+    @retval The name of the encoder now in use
+    @raise InstrumentParameterException if the encoder is unknown or not
+        installed
+    """
+    global _json_encoder_name, _json_encode
+
+    names = JSON_ENCODER_PREFERENCE if name is None else [name]
+    for encoder_name in names:
+        encode = _load_json_encoder(encoder_name)
+        if encode is not None:
+            _json_encoder_name = encoder_name
+            _json_encode = encode
+            log.debug("Particles encoded with %s", encoder_name)
+            return encoder_name
+
+    raise InstrumentParameterException("JSON encoder %s not available" % name)
+
+def get_json_encoder():
+    """
+    @retval The name of the JSON encoder used to generate particles
+    """
+    return _json_encoder_name
+
+def encode_json(obj, sorted=False):
+    """
+    Encode a particle structure as JSON with the active encoder. Keys are
+    written in dict order; sorted output always goes through the stdlib
+    encoder so it is the same whichever encoder is active.
+    @param obj The structure to encode
+    @param sorted Sort the keys, useful for testing but slow
+    @retval A JSON string
+    """
+    if sorted:
+        return _json_encode_sorted(obj)
+    return _json_encode(obj)
+
+set_json_encoder()
+
 class CommonDataParticleType(BaseEnum):
     """
     This enum defines all the common particle types defined in the modules.  Currently there is only one, but by
@@ -51,6 +155,7 @@ class DataParticleKey(BaseEnum):
 
 class DataParticleValue(BaseEnum):
     JSON_DATA = "JSON_Data"
+    JSON_BATCH = "JSON_Batch"
     ENG = "eng"
     OK = "ok"
     CHECKSUM_FAILED = "checksum_failed"
@@ -75,25 +180,36 @@ class DataParticle(object):
     # data_particle_type()
     _data_particle_type = None
 
+    # Subclasses that do not define __slots__ get a __dict__ as usual, this
+    # only lets CompactDataParticle classes do without one.
+    __slots__ = ('contents', 'raw_data', '_encoding_errors', '_values', '_json_cache')
+
     def __init__(self, raw_data,
                  port_timestamp=None,
                  internal_timestamp=None,
                  preferred_timestamp=DataParticleKey.PORT_TIMESTAMP,
                  quality_flag=DataParticleValue.OK,
-                 new_sequence=None):
+                 new_sequence=None,
+                 driver_timestamp=None):
         """ Build a particle seeded with appropriate information
         
         @param raw_data The raw data used in the particle
+        @param driver_timestamp The driver timestamp (NTP4) to use, defaults
+            to now. Parsers building many particles at once can pass one
+            timestamp for the whole batch.
         """
         if new_sequence is not None and not isinstance(new_sequence, bool):
             raise TypeError("new_sequence is not a bool")
 
+        if driver_timestamp is None:
+            driver_timestamp = ntplib.system_to_ntp_time(time.time())
+
         self.contents = {
             DataParticleKey.PKT_FORMAT_ID: DataParticleValue.JSON_DATA,
             DataParticleKey.PKT_VERSION: 1,
             DataParticleKey.PORT_TIMESTAMP: port_timestamp,
             DataParticleKey.INTERNAL_TIMESTAMP: internal_timestamp,
-            DataParticleKey.DRIVER_TIMESTAMP: ntplib.system_to_ntp_time(time.time()),
+            DataParticleKey.DRIVER_TIMESTAMP: driver_timestamp,
             DataParticleKey.PREFERRED_TIMESTAMP: preferred_timestamp,
             DataParticleKey.QUALITY_FLAG: quality_flag,
         }
@@ -103,6 +219,14 @@ class DataParticle(object):
 
         self.raw_data = raw_data
 
+        # Parsed values and encoded JSON are built once and memoized, since a
+        # particle is usually generated once to check for encoding errors and
+        # again to be published. Only set_value and set_internal_timestamp
+        # change a particle after it is built, and they clear the JSON cache.
+        # The cache dict is only made when the particle is first generated.
+        self._values = None
+        self._json_cache = None
+
     def __eq__(self, arg):
         """
         Quick equality check for testing purposes. If they have the same raw
@@ -148,7 +272,7 @@ class DataParticle(object):
         #if(not self._check_timestamp(timestamp)):
         #    raise InstrumentParameterException("invalid timestamp")
 
-        self.contents[DataParticleKey.INTERNAL_TIMESTAMP] = float(timestamp)
+        self._store_internal_timestamp(float(timestamp))
 
     def set_value(self, id, value):
         """
@@ -159,10 +283,18 @@ class DataParticle(object):
         @raises ReadOnlyException If the parameter cannot be set
         """
         if (id == DataParticleKey.INTERNAL_TIMESTAMP) and (self._check_timestamp(value)):
-            self.contents[DataParticleKey.INTERNAL_TIMESTAMP] = value
+            self._store_internal_timestamp(value)
         else:
             raise ReadOnlyException("Parameter %s not able to be set to %s after object creation!" %
                                     (id, value))
+
+    def _store_internal_timestamp(self, timestamp):
+        """
+        Store a new internal timestamp and drop the JSON built with the old one
+        @param timestamp The NTP timestamp
+        """
+        self.contents[DataParticleKey.INTERNAL_TIMESTAMP] = timestamp
+        self._json_cache = None
     
     def get_value(self, id):
         """ Return a stored value
@@ -206,9 +338,9 @@ class DataParticle(object):
         if not self._check_preferred_timestamps():
             raise SampleException("Preferred timestamp not in particle!")
         
-        # build response structure
-        self._encoding_errors = []
-        values = self._build_parsed_values()
+        # build the values first, building them may set header fields
+        # like the internal timestamp or the stream name
+        values = list(self._get_parsed_values())
         result = self._build_base_structure()
         result[DataParticleKey.STREAM_NAME] = self.data_particle_type()
         result[DataParticleKey.VALUES] = values
@@ -229,9 +361,25 @@ class DataParticle(object):
            and driver timestamp
         @throws InstrumentDriverException If there is a problem with the inputs
         """
-        result = self.generate_dict()
-        json_result = json.dumps(result, sort_keys=sorted)
+        if self._json_cache is not None and sorted in self._json_cache:
+            return self._json_cache[sorted]
+
+        # only create the cache once the values are built, building them
+        # may set the internal timestamp, which drops the cache
+        json_result = encode_json(self.generate_dict(), sorted)
+        if self._json_cache is None:
+            self._json_cache = {}
+        self._json_cache[sorted] = json_result
         return json_result
+
+    def _get_parsed_values(self):
+        """
+        @retval The parsed values, built the first time they are needed
+        """
+        if self._values is None:
+            self._encoding_errors = []
+            self._values = self._build_parsed_values()
+        return self._values
         
     def _build_parsed_values(self):
         """
@@ -319,6 +467,358 @@ class DataParticle(object):
         """
         return self._encoding_errors
 
+class CompactDataParticle(DataParticle):
+    """
+    A data particle that keeps its header fields in slots instead of a
+    contents dict, for parsers that buffer thousands of particles at a time.
+    The contents dict is only built when it is asked for (generate_dict()
+    and get_value() still work as usual), and it is a copy, so header fields
+    are changed through set_value() and set_internal_timestamp() only.
+
+    Subclasses must define __slots__ (usually empty) to stay compact.
+    """
+    __slots__ = ('_port_timestamp', '_internal_timestamp', '_driver_timestamp',
+                 '_preferred_timestamp', '_quality_flag', '_new_sequence')
+
+    # shared by all particles until an encoding error is recorded
+    _NO_ENCODING_ERRORS = ()
+
+    def __init__(self, raw_data,
+                 port_timestamp=None,
+                 internal_timestamp=None,
+                 preferred_timestamp=DataParticleKey.PORT_TIMESTAMP,
+                 quality_flag=DataParticleValue.OK,
+                 new_sequence=None,
+                 driver_timestamp=None):
+        """ Build a particle seeded with appropriate information
+
+        @param raw_data The raw data used in the particle
+        @param driver_timestamp The driver timestamp (NTP4) to use, defaults
+            to now
+        """
+        if new_sequence is not None and not isinstance(new_sequence, bool):
+            raise TypeError("new_sequence is not a bool")
+
+        if driver_timestamp is None:
+            driver_timestamp = ntplib.system_to_ntp_time(time.time())
+
+        self._port_timestamp = port_timestamp
+        self._internal_timestamp = internal_timestamp
+        self._driver_timestamp = driver_timestamp
+        self._preferred_timestamp = preferred_timestamp
+        self._quality_flag = quality_flag
+        self._new_sequence = new_sequence
+        self._encoding_errors = self._NO_ENCODING_ERRORS
+
+        self.raw_data = raw_data
+        # parsed values are not kept, only the JSON once it is generated
+        self._json_cache = None
+
+    @property
+    def contents(self):
+        """
+        The header fields as a dict, built on request
+        """
+        result = {
+            DataParticleKey.PKT_FORMAT_ID: DataParticleValue.JSON_DATA,
+            DataParticleKey.PKT_VERSION: 1,
+            DataParticleKey.PORT_TIMESTAMP: self._port_timestamp,
+            DataParticleKey.INTERNAL_TIMESTAMP: self._internal_timestamp,
+            DataParticleKey.DRIVER_TIMESTAMP: self._driver_timestamp,
+            DataParticleKey.PREFERRED_TIMESTAMP: self._preferred_timestamp,
+            DataParticleKey.QUALITY_FLAG: self._quality_flag,
+        }
+        if self._new_sequence is not None:
+            result[DataParticleKey.NEW_SEQUENCE] = self._new_sequence
+        return result
+
+    def __getstate__(self):
+        # the inherited contents slot is hidden by the property, so pickle
+        # the slots holding the header fields and skip it
+        state = dict(getattr(self, '__dict__', {}))
+        for cls in type(self).__mro__:
+            for name in getattr(cls, '__slots__', ()):
+                if name != 'contents' and hasattr(self, name):
+                    state[name] = getattr(self, name)
+        return state
+
+    def __setstate__(self, state):
+        for (name, value) in state.iteritems():
+            setattr(self, name, value)
+
+    def _store_internal_timestamp(self, timestamp):
+        """
+        Store a new internal timestamp and drop the JSON built with the old one
+        @param timestamp The NTP timestamp
+        """
+        self._internal_timestamp = timestamp
+        self._json_cache = None
+
+    def _encode_value(self, name, value, encoding_function):
+        """
+        Encode a value using the encoding function, if it fails store the error in a queue
+        """
+        if self._encoding_errors is self._NO_ENCODING_ERRORS:
+            self._encoding_errors = []
+        return super(CompactDataParticle, self)._encode_value(name, value, encoding_function)
+
+    def _get_parsed_values(self):
+        """
+        @retval The parsed values, built each time since buffered particles
+            should not hold them. generate() still only builds them once.
+        """
+        self._encoding_errors = self._NO_ENCODING_ERRORS
+        return self._build_parsed_values()
+
+    def _build_base_structure(self):
+        """
+        Build the base/header information for an output structure.
+
+        @return A fresh copy of a core structure to be exported
+        """
+        result = self.contents
+        # clean out optional fields that were missing
+        if not self._port_timestamp:
+            del result[DataParticleKey.PORT_TIMESTAMP]
+        if not self._internal_timestamp:
+            del result[DataParticleKey.INTERNAL_TIMESTAMP]
+        return result
+
+    def _check_preferred_timestamps(self):
+        """
+        Check to make sure the preferred timestamp indicated in the
+        particle is actually listed
+
+        @throws SampleException When there is a problem with the preferred
+            timestamp in the sample.
+        """
+        if self._preferred_timestamp == None:
+            raise SampleException("Missing preferred timestamp, %s, in particle" %
+                                  self._preferred_timestamp)
+        return True
+
+class ParticleBatchKey(BaseEnum):
+    """
+    Keys used in the columnar message built by a ParticleBatch, on top of the
+    DataParticleKey header keys
+    """
+    COUNT = "count"
+    HEADERS = "headers"
+    VALUE_IDS = "value_ids"
+    BINARY_VALUE_IDS = "binary_value_ids"
+
+class ParticleBatch(object):
+    """
+    A batch of particles from one stream, published as a single columnar
+    message instead of one message per particle. Header fields that are the
+    same for every particle in the batch (driver timestamp, preferred
+    timestamp, etc) are sent once, header fields that vary (internal
+    timestamp, port timestamp) become per-particle lists in the headers
+    block, and each value id gets one list of values. A message looks like:
+
+    {'pkt_format_id': 'JSON_Batch', 'pkt_version': 1,
+     'stream_name': 'ctdpf_parsed', 'count': 2,
+     'driver_timestamp': 3590000000.0, 'preferred_timestamp': ...,
+     'headers': {'internal_timestamp': [3589000000.0, 3589000001.0]},
+     'value_ids': ['temperature', 'pressure'],
+     'values': [[12.1, 12.2], [1001, 1002]]}
+
+    A batch follows the particle interface (data_particle_type(),
+    generate_dict(), generate()) so it can be handed to the publish callback
+    in place of a list of particles. Consumers that need individual
+    particles use expand(), or expand_dict() on a received message.
+    """
+    def __init__(self, particles=None):
+        """
+        @param particles An optional list of particles to start the batch
+            with, all from the same stream
+        @throws SampleException if the particles are not from the same stream
+        """
+        self._stream_name = None
+        self._particles = []
+        self._json_cache = {}
+
+        for particle in particles or []:
+            self.add(particle)
+
+    @classmethod
+    def from_particles(cls, particles):
+        """
+        Split a list of particles into one batch per stream, in the order each
+        stream is first seen
+        @param particles A list of data particles
+        @retval A list of ParticleBatch objects
+        """
+        batches = []
+        by_stream = {}
+        for particle in particles:
+            stream_name = particle.data_particle_type()
+            batch = by_stream.get(stream_name)
+            if batch is None:
+                batch = by_stream[stream_name] = cls()
+                batches.append(batch)
+            batch.add(particle)
+        return batches
+
+    def add(self, particle):
+        """
+        Add a particle to the end of the batch
+        @param particle The data particle to add
+        @throws SampleException if the particle is from another stream
+        """
+        stream_name = particle.data_particle_type()
+        if self._stream_name is None:
+            self._stream_name = stream_name
+        elif stream_name != self._stream_name:
+            raise SampleException("particle stream %s does not match batch stream %s" %
+                                  (stream_name, self._stream_name))
+        self._particles.append(particle)
+        self._json_cache.clear()
+
+    def __len__(self):
+        return len(self._particles)
+
+    def __iter__(self):
+        return iter(self._particles)
+
+    def data_particle_type(self):
+        """
+        Return the stream name shared by the particles in the batch
+        @raise: NotImplementedException if the batch is empty
+        """
+        if self._stream_name is None:
+            raise NotImplementedException("empty particle batch has no stream")
+        return self._stream_name
+
+    def get_encoding_errors(self):
+        """
+        Return the encoding errors of all particles in the batch
+        """
+        errors = []
+        for particle in self._particles:
+            errors.extend(particle.get_encoding_errors())
+        return errors
+
+    def expand(self):
+        """
+        Fall back to one dictionary per particle
+        @retval A list of particle dictionaries, as generate_dict() on each
+            particle would return them
+        """
+        return [particle.generate_dict() for particle in self._particles]
+
+    def generate_dict(self):
+        """
+        Build the columnar batch dictionary
+        @retval A python dictionary holding every particle in the batch
+        @throws SampleException if a particle can not be generated
+        """
+        stream_name = self.data_particle_type()
+        particle_dicts = self.expand()
+        count = len(particle_dicts)
+
+        # collect header keys and value ids in the order they first appear
+        header_keys = []
+        value_ids = []
+        binary_value_ids = []
+        for particle_dict in particle_dicts:
+            for key in particle_dict:
+                if key not in (DataParticleKey.STREAM_NAME, DataParticleKey.VALUES) and \
+                   key not in header_keys:
+                    header_keys.append(key)
+            for value in particle_dict[DataParticleKey.VALUES]:
+                value_id = value[DataParticleKey.VALUE_ID]
+                if value_id not in value_ids:
+                    value_ids.append(value_id)
+                    if value.get(DataParticleKey.BINARY):
+                        binary_value_ids.append(value_id)
+
+        result = {
+            DataParticleKey.PKT_FORMAT_ID: DataParticleValue.JSON_BATCH,
+            DataParticleKey.PKT_VERSION: 1,
+            DataParticleKey.STREAM_NAME: stream_name,
+            ParticleBatchKey.COUNT: count,
+        }
+
+        # header fields the same in every particle are sent once
+        headers = {}
+        for key in header_keys:
+            if key in (DataParticleKey.PKT_FORMAT_ID, DataParticleKey.PKT_VERSION):
+                continue
+            column = [particle_dict.get(key) for particle_dict in particle_dicts]
+            first = column[0]
+            if all(key in particle_dict and particle_dict[key] == first
+                   for particle_dict in particle_dicts):
+                result[key] = first
+            else:
+                headers[key] = column
+        result[ParticleBatchKey.HEADERS] = headers
+
+        index = dict((value_id, i) for (i, value_id) in enumerate(value_ids))
+        columns = [[None] * count for value_id in value_ids]
+        for (row, particle_dict) in enumerate(particle_dicts):
+            for value in particle_dict[DataParticleKey.VALUES]:
+                columns[index[value[DataParticleKey.VALUE_ID]]][row] = value[DataParticleKey.VALUE]
+
+        result[ParticleBatchKey.VALUE_IDS] = value_ids
+        result[DataParticleKey.VALUES] = columns
+        if binary_value_ids:
+            result[ParticleBatchKey.BINARY_VALUE_IDS] = binary_value_ids
+        return result
+
+    def generate(self, sorted=False):
+        """
+        Generate one JSON message for the whole batch
+        @param sorted Returned sorted json dict, useful for testing
+        @return A JSON string of the columnar batch
+        """
+        json_result = self._json_cache.get(sorted)
+        if json_result is None:
+            json_result = encode_json(self.generate_dict(), sorted)
+            self._json_cache[sorted] = json_result
+        return json_result
+
+    @staticmethod
+    def expand_dict(batch_dict):
+        """
+        Expand a columnar batch dictionary (as returned by generate_dict(),
+        or decoded from generate()) back into per-particle dictionaries
+        @param batch_dict The batch dictionary
+        @retval A list of particle dictionaries
+        """
+        count = batch_dict[ParticleBatchKey.COUNT]
+        headers = batch_dict.get(ParticleBatchKey.HEADERS, {})
+        value_ids = batch_dict[ParticleBatchKey.VALUE_IDS]
+        columns = batch_dict[DataParticleKey.VALUES]
+        binary_value_ids = batch_dict.get(ParticleBatchKey.BINARY_VALUE_IDS, [])
+
+        shared = {}
+        for (key, value) in batch_dict.iteritems():
+            if key in (ParticleBatchKey.COUNT, ParticleBatchKey.HEADERS,
+                       ParticleBatchKey.VALUE_IDS, ParticleBatchKey.BINARY_VALUE_IDS,
+                       DataParticleKey.VALUES):
+                continue
+            shared[key] = value
+        shared[DataParticleKey.PKT_FORMAT_ID] = DataParticleValue.JSON_DATA
+
+        result = []
+        for row in range(count):
+            particle_dict = dict(shared)
+            for (key, column) in headers.iteritems():
+                # optional headers missing from a particle are left out again
+                if column[row] is not None:
+                    particle_dict[key] = column[row]
+            values = []
+            for (value_id, column) in zip(value_ids, columns):
+                value = {DataParticleKey.VALUE_ID: value_id,
+                         DataParticleKey.VALUE: column[row]}
+                if value_id in binary_value_ids:
+                    value[DataParticleKey.BINARY] = True
+                values.append(value)
+            particle_dict[DataParticleKey.VALUES] = values
+            result.append(particle_dict)
+        return result
+
 class RawDataParticleKey(BaseEnum):
     PAYLOAD = "raw"
     LENGTH = "length"
@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+
+"""
+@package mi.core.instrument.driver_event_queue
+@file mi/core/instrument/driver_event_queue.py
+@brief Bounded queue of the asynchronous events a driver process sends to
+    its client.
+"""
+
+__license__ = 'Apache 2.0'
+
+from collections import deque
+from threading import Condition
+
+from mi.core.common import BaseEnum
+from mi.core.instrument.instrument_driver import DriverAsyncEvent
+
+from mi.core.log import get_logger ; log = get_logger()
+
+# queued events above which droppable events are dropped
+DEFAULT_HIGH_WATER_MARK = 10000
+# most events sent in one message
+DEFAULT_BATCH_SIZE = 100
+
+
+class EventPolicy(BaseEnum):
+    """
+    What happens to an event type when the queue backs up
+    """
+    # always queued, even above the high water mark
+    KEEP = 'KEEP'
+    # above the high water mark the oldest queued event of a droppable
+    # type is dropped to make room
+    DROP = 'DROP'
+    # a queued event not yet sent is replaced by a newer one of its type
+    COALESCE = 'COALESCE'
+
+
+class DriverEventQueue(object):
+    """
+    Queue of driver events waiting to be sent. Events are appended and
+    removed in constant time, and a waiting sender is woken as soon as an
+    event is queued. Samples are dropped, oldest first, when the client
+    falls behind by more than the high water mark, and only the latest of
+    several unsent config changes is kept. State changes, errors, results
+    and other events are never dropped.
+    """
+    DEFAULT_POLICIES = {
+        DriverAsyncEvent.SAMPLE: EventPolicy.DROP,
+        DriverAsyncEvent.CONFIG_CHANGE: EventPolicy.COALESCE,
+    }
+
+    def __init__(self, high_water_mark=DEFAULT_HIGH_WATER_MARK, policies=None):
+        """
+        @param high_water_mark The number of queued events above which
+            droppable events are dropped
+        @param policies A dict of EventPolicy by event type, which updates
+            DEFAULT_POLICIES. Other event types are kept.
+        @throws ValueError if the high water mark is not positive
+        """
+        if high_water_mark <= 0:
+            raise ValueError("high water mark must be positive, not %r" % high_water_mark)
+        self.high_water_mark = high_water_mark
+        self.policies = dict(self.DEFAULT_POLICIES)
+        if policies:
+            self.policies.update(policies)
+
+        self.dropped = 0
+        self._condition = Condition()
+        # Queued events are held in one item lists so a dropped, coalesced
+        # or sent event can be emptied in place and skipped.
+        self._queue = deque()
+        self._droppable = deque()
+        self._coalesced = {}
+        self._size = 0
+        # dropped and coalesced events still in the queue
+        self._dead = 0
+        self._dropping = False
+
+    def __len__(self):
+        return self._size
+
+    def put(self, event):
+        """
+        Queue an event and wake the sender
+        @param event The event dict, or an exception. Empty events are
+            ignored, as the sender always skipped them.
+        """
+        if not event:
+            return
+        event_type = event.get('type') if isinstance(event, dict) else None
+        policy = self.policies.get(event_type, EventPolicy.KEEP)
+
+        with self._condition:
+            if policy == EventPolicy.COALESCE:
+                queued = self._coalesced.get(event_type)
+                if queued is not None and queued[0] is not None:
+                    queued[0] = None
+                    self._size -= 1
+                    self._dead += 1
+
+            elif policy == EventPolicy.DROP and self._size >= self.high_water_mark:
+                if not self._drop_oldest():
+                    self._dropped(event_type)
+                    return
+
+            if self._dead > self._size:
+                self._compact()
+
+            item = [event]
+            self._queue.append(item)
+            self._size += 1
+            if policy == EventPolicy.DROP:
+                self._droppable.append(item)
+            elif policy == EventPolicy.COALESCE:
+                self._coalesced[event_type] = item
+            self._condition.notify()
+
+    def extend(self, events):
+        """
+        Queue several events
+        @param events The list of events
+        """
+        for event in events:
+            self.put(event)
+
+    def get_batch(self, max_events=DEFAULT_BATCH_SIZE, timeout=None):
+        """
+        Take the oldest events from the queue, waiting for one if the queue
+        is empty
+        @param max_events The most events to take
+        @param timeout The longest time to wait in seconds, or None to wait
+            until an event is queued
+        @retval A list of events in the order they were queued, empty if
+            the wait timed out
+        """
+        with self._condition:
+            if not self._size:
+                self._condition.wait(timeout)
+
+            batch = []
+            while self._queue and len(batch) < max_events:
+                item = self._queue.popleft()
+                if item[0] is not None:
+                    batch.append(item[0])
+                    item[0] = None
+                else:
+                    self._dead -= 1
+            self._size -= len(batch)
+            if self._size < self.high_water_mark:
+                self._dropping = False
+
+            # forget the droppable events which have been sent
+            while self._droppable and self._droppable[0][0] is None:
+                self._droppable.popleft()
+            return batch
+
+    def _drop_oldest(self):
+        """
+        Drop the oldest queued droppable event
+        @retval True if an event was dropped, False if none are queued
+        """
+        while self._droppable:
+            item = self._droppable.popleft()
+            if item[0] is not None:
+                self._dropped(item[0].get('type'))
+                item[0] = None
+                self._size -= 1
+                self._dead += 1
+                return True
+        return False
+
+    def _dropped(self, event_type):
+        """
+        Count a dropped event, warning once each time the queue fills up
+        """
+        if not self._dropping:
+            log.warn("Driver event queue passed %d events, dropping %s events",
+                     self.high_water_mark, event_type)
+            self._dropping = True
+        self.dropped += 1
+
+    def _compact(self):
+        """
+        Remove the dropped and coalesced events from the queue, so a client
+        which has stopped reading can't grow it without bound
+        """
+        self._queue = deque(item for item in self._queue if item[0] is not None)
+        self._droppable = deque(item for item in self._droppable if item[0] is not None)
+        self._dead = 0
@@ -21,6 +21,7 @@ import time
 import traceback
 from mi.core.exceptions import InstrumentException, InstrumentCommandException
 from mi.core.instrument.instrument_driver import DriverAsyncEvent
+from mi.core.instrument.driver_event_queue import DriverEventQueue, DEFAULT_HIGH_WATER_MARK
 
 from ooi.logging import log
 
@@ -47,16 +48,19 @@ class DriverProcess(object):
         spawnargs = ['bin/python', '-c', cmd_str]
         return Popen(spawnargs, close_fds=True)
         
-    def __init__(self, driver_module, driver_class, ppid):
+    def __init__(self, driver_module, driver_class, ppid,
+                 event_high_water_mark=DEFAULT_HIGH_WATER_MARK):
         """
         @param driver_module The python module containing the driver code.
         @param driver_class The python driver class.
+        @param event_high_water_mark The number of unsent events above which
+        samples are dropped.
         """
         self.driver_module = driver_module
         self.driver_class = driver_class
         self.ppid = ppid
         self.driver = None
-        self.events = []
+        self.events = DriverEventQueue(event_high_water_mark)
         self.messaging_started = False
         
     def construct_driver(self):
@@ -145,7 +149,7 @@ class DriverProcess(object):
             return'stop_driver_process'
         elif cmd == 'test_events':
             events = kwargs['events']
-            self.events += events
+            self.events.extend(events)
             reply = 'test_events'
         elif cmd == 'process_echo':
             reply = 'ping from resource ppid:%s, resource:%s' % (str(self.ppid), str(self.driver))
@@ -187,9 +191,9 @@ class DriverProcess(object):
             
     def send_event(self, evt):
         """
-        Append an event to the list to be sent by the event threaed.
+        Queue an event to be sent by the event thread.
         """
-        self.events.append(evt)
+        self.events.put(evt)
             
     def run(self):
         """
@@ -20,9 +20,10 @@ from functools import partial
 
 from mi.core.log import get_logger ; log = get_logger()
 
-from threading import Thread
+from threading import Thread, Condition
 
 from mi.core.instrument.protocol_param_dict import ParameterDictVisibility
+from mi.core.instrument.ring_buffer import RingBuffer
 from mi.core.common import BaseEnum, InstErrorCode
 from mi.core.instrument.data_particle import RawDataParticle
 from mi.core.instrument.instrument_driver import DriverConfigKey
@@ -48,6 +49,67 @@ MAX_BUFFER_SIZE=32768
 DEFAULT_CMD_TIMEOUT=20
 DEFAULT_WRITE_DELAY=0
 RE_PATTERN = type(re.compile(""))
+# longest wait for new data before the buffers are searched again, for
+# subclasses which add to the buffers without calling add_to_buffer
+RESPONSE_POLL_INTERVAL = .1
+
+class PromptMatcher(object):
+    """
+    Find the first of a list of prompts in a RingBuffer. Prompts are tried
+    in list order like searching for each prompt in turn, but a combined
+    regex of all the prompts rejects data without any prompt in one pass,
+    and only the data added since the last search is searched.
+    """
+    _regexes = {}
+
+    def __init__(self, prompts):
+        """
+        @param prompts The list of prompts in order of preference
+        """
+        self.prompts = list(prompts)
+        key = tuple(self.prompts)
+        self._regex = self._regexes.get(key)
+        if self._regex is None:
+            self._regex = re.compile('|'.join(re.escape(prompt) for prompt in self.prompts))
+            self._regexes[key] = self._regex
+        self._longest = max([len(prompt) for prompt in self.prompts] or [0])
+        self._written = 0
+        self._resets = None
+
+    def search_buffer(self, ring):
+        """
+        Search the data added to a RingBuffer since the last search, reading
+        only the end of the buffer holding the new data
+        @param ring The RingBuffer
+        @retval A tuple of the prompt and its index in the buffer contents,
+            or None
+        """
+        new = ring.written - self._written
+        if ring.resets != self._resets or new > len(ring):
+            size = len(ring)
+        else:
+            size = min(len(ring), new + self._longest - 1)
+        self._written = ring.written
+        self._resets = ring.resets
+
+        found = self._find(ring.tail(size))
+        if found:
+            (prompt, index) = found
+            return (prompt, len(ring) - size + index)
+        return None
+
+    def _find(self, buf):
+        """
+        @retval A tuple of the first prompt in list order found in buf and
+            its index, or None
+        """
+        if not self.prompts or self._regex.search(buf) is None:
+            return None
+        for prompt in self.prompts:
+            index = buf.find(prompt)
+            if index >= 0:
+                return (prompt, index)
+        return None
 
 class InterfaceType(BaseEnum):
     """The methods of connecting to a device"""
@@ -805,11 +867,18 @@ class CommandResponseInstrumentProtocol(InstrumentProtocol):
         # Class of prompts used by device.
         self._prompts = prompts
     
+        # Signalled when data is added to the buffers, and held while the
+        # buffers are read or changed.
+        self._buffer_condition = Condition()
+        self._buffer_updates = 0
+
         # Line buffer for input from device.
+        self._line_ring = RingBuffer(self._max_buffer_size())
         self._linebuf = ''
         
         # Short buffer to look for prompts from device in command-response
         # mode.
+        self._prompt_ring = RingBuffer(self._max_buffer_size())
         self._promptbuf = ''
         
         # Lines of data awaiting further processing.
@@ -885,23 +954,27 @@ class CommandResponseInstrumentProtocol(InstrumentProtocol):
 
         log.debug('_get_response: timeout=%s, prompt_list=%s, expected_prompt=%s, response_regex=%r, promptbuf=%s',
                   timeout, prompt_list, expected_prompt, pattern, self._promptbuf)
+        matcher = PromptMatcher(prompt_list)
         while True:
+            updates = self._buffer_updates
             if response_regex:
                 match = response_regex.search(self._linebuf)
                 if match:
                     return match.groups()
             else:
-                for item in prompt_list:
-                    index = self._promptbuf.find(item)
-                    if index >= 0:
-                        result = self._promptbuf[0:index+len(item)]
+                with self._buffer_condition:
+                    found = matcher.search_buffer(self._prompt_ring)
+                    if found:
+                        (item, index) = found
+                        result = self._prompt_ring.getvalue()[0:index+len(item)]
                         return item, result
 
-            time.sleep(.1)
-
-            if time.time() > starttime + timeout:
+            remaining = starttime + timeout - time.time()
+            if remaining < 0:
                 raise InstrumentTimeoutException("in InstrumentProtocol._get_response()")
 
+            self._wait_for_data(updates, min(remaining, RESPONSE_POLL_INTERVAL))
+
     def _get_raw_response(self, timeout=10, expected_prompt=None):
         """
         Get a response from the instrument, but don't trim whitespace. Used in
@@ -924,16 +997,40 @@ class CommandResponseInstrumentProtocol(InstrumentProtocol):
             else:
                 prompt_list = expected_prompt
 
+        prompt_list = [(item, item.rstrip(strip_chars)) for item in prompt_list]
         while True:
-            for item in prompt_list:
-                if self._promptbuf.rstrip(strip_chars).endswith(item.rstrip(strip_chars)):
+            updates = self._buffer_updates
+            promptbuf = self._promptbuf.rstrip(strip_chars)
+            for (item, stripped_item) in prompt_list:
+                if promptbuf.endswith(stripped_item):
                     return (item, self._linebuf)
-                else:
-                    time.sleep(.1)
 
-            if time.time() > starttime + timeout:
+            remaining = starttime + timeout - time.time()
+            if remaining < 0:
                 raise InstrumentTimeoutException("in InstrumentProtocol._get_raw_response()")
 
+            self._wait_for_data(updates, min(remaining, RESPONSE_POLL_INTERVAL))
+
+    def _wait_for_data(self, updates, timeout):
+        """
+        Wait for data to be added to the buffers
+        @param updates The _buffer_updates count before the buffers were
+            last searched, so data added since then returns at once
+        @param timeout The longest time to wait in seconds
+        """
+        with self._buffer_condition:
+            if self._buffer_updates == updates:
+                self._buffer_condition.wait(timeout)
+
+    def _buffer_updated(self):
+        """
+        Wake the threads waiting for a response. Called after data is added
+        to the line and prompt buffers.
+        """
+        with self._buffer_condition:
+            self._buffer_updates += 1
+            self._buffer_condition.notify_all()
+
     def _do_cmd_resp(self, cmd, *args, **kwargs):
         """
         Perform a command-response on the device.
@@ -1122,27 +1219,42 @@ class CommandResponseInstrumentProtocol(InstrumentProtocol):
         buffers implemented as lifo ring buffer
         @param data: bytes to add to the buffer
         '''
-        # Update the line and prompt buffers.
-        self._linebuf += data
-        self._promptbuf += data
+        # Update the line and prompt buffers. Once a buffer is full the
+        # leading characters are dropped on the floor.
+        max_size = self._max_buffer_size()
+        with self._buffer_condition:
+            for ring in (self._line_ring, self._prompt_ring):
+                if ring.capacity != max_size:
+                    ring.resize(max_size)
+                ring.append(data)
         self._last_data_timestamp = time.time()
 
-        # If our buffer exceeds the max allowable size then drop the leading
-        # characters on the floor.
-        if(len(self._linebuf) > self._max_buffer_size()):
-            self._linebuf = self._linebuf[self._max_buffer_size()*-1:]
-
-        # If our buffer exceeds the max allowable size then drop the leading
-        # characters on the floor.
-        if(len(self._promptbuf) > self._max_buffer_size()):
-            self._promptbuf = self._linebuf[self._max_buffer_size()*-1:]
-
-        log.debug("LINE BUF: %s", self._linebuf)
-        log.debug("PROMPT BUF: %s", self._promptbuf)
+        self._buffer_updated()
 
     def _max_buffer_size(self):
         return MAX_BUFFER_SIZE
 
+    def _get_linebuf(self):
+        with self._buffer_condition:
+            return self._line_ring.getvalue()
+
+    def _set_linebuf(self, data):
+        with self._buffer_condition:
+            self._line_ring.set(data)
+
+    def _get_promptbuf(self):
+        with self._buffer_condition:
+            return self._prompt_ring.getvalue()
+
+    def _set_promptbuf(self, data):
+        with self._buffer_condition:
+            self._prompt_ring.set(data)
+
+    # The buffers read and assign as strings, so protocols can keep
+    # searching, slicing and clearing them as before.
+    _linebuf = property(_get_linebuf, _set_linebuf)
+    _promptbuf = property(_get_promptbuf, _set_promptbuf)
+
     ########################################################################
     # Wakeup helpers.
     ########################################################################            
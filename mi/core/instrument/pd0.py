@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+
+"""
+@package mi.core.instrument.pd0
+@file mi/core/instrument/pd0.py
+@brief Decoding of Teledyne RDI PD0 ensembles shared by the ADCP drivers and
+    dataset parsers
+"""
+
+__license__ = 'Apache 2.0'
+
+import struct
+from collections import namedtuple
+
+import numpy as np
+
+from mi.core.log import get_logger ; log = get_logger()
+from mi.core.common import BaseEnum
+from mi.core.exceptions import SampleException
+
+# every PD0 data type starts with a 2 byte id
+PD0_ID_SIZE = 2
+# the depth cell arrays hold one value per beam for each cell
+PD0_BEAMS = 4
+# the data type offset table follows the 6 byte header
+PD0_OFFSETS_START = 6
+
+PD0_UINT16 = struct.Struct('<H')
+
+
+class Pd0DataTypeId(BaseEnum):
+    """
+    Data type ids, as read little endian from the start of each data type
+    """
+    FIXED_LEADER = 0x0000
+    VARIABLE_LEADER = 0x0080
+    VELOCITY = 0x0100
+    CORRELATION_MAGNITUDE = 0x0200
+    ECHO_INTENSITY = 0x0300
+    PERCENT_GOOD = 0x0400
+    BOTTOM_TRACK = 0x0600
+
+
+class Pd0Record(object):
+    """
+    Layout of a fixed size PD0 record. The struct is compiled once when the
+    layout is defined, and unpacking returns a named tuple view so fields can
+    be read by name or unpacked positionally like a plain struct.unpack.
+    """
+    def __init__(self, name, fmt, fields):
+        """
+        @param name The name of the record view type
+        @param fmt The struct format of the record
+        @param fields The field names, one per value in the format
+        """
+        self.struct = struct.Struct(fmt)
+        self.view = namedtuple(name, fields)
+        if len(self.view._fields) != len(self.struct.unpack('\x00' * self.struct.size)):
+            raise ValueError("%s has %d fields for format %s" % (name, len(self.view._fields), fmt))
+        self.size = self.struct.size
+
+    def unpack(self, data, offset=0):
+        """
+        @param data The string or buffer holding the record
+        @param offset The offset of the record in data
+        @retval A named tuple of the record fields
+        @throws SampleException if data is too short to hold the record
+        """
+        try:
+            return self.view._make(self.struct.unpack_from(data, offset))
+        except struct.error as e:
+            raise SampleException("Unable to unpack %s: %s" % (self.view.__name__, e))
+
+# the header at the start of each ensemble
+PD0_HEADER = Pd0Record('Pd0Header', '<BBHBB',
+                       ('header_id', 'data_source_id', 'num_bytes', 'spare', 'num_data_types'))
+
+_offset_structs = {}
+
+def _offset_struct(num_data_types):
+    """
+    @retval The compiled struct for an offset table with this many entries
+    """
+    offset_struct = _offset_structs.get(num_data_types)
+    if offset_struct is None:
+        offset_struct = struct.Struct('<%dH' % num_data_types)
+        _offset_structs[num_data_types] = offset_struct
+    return offset_struct
+
+
+class Pd0Ensemble(object):
+    """
+    One PD0 ensemble. The header and data type offset table are parsed once
+    when the ensemble is created. The data types can then be located by
+    index and decoded with a Pd0Record layout or as a depth cell array
+    without copying the ensemble.
+    """
+    def __init__(self, raw_data, header=PD0_HEADER):
+        """
+        @param raw_data The string or buffer holding the whole ensemble
+        @param header The layout of the ensemble header, which must end with
+            the number of data types
+        @throws SampleException if the header or offset table is truncated
+        """
+        self.raw_data = raw_data
+        if len(raw_data) < PD0_OFFSETS_START:
+            raise SampleException("PD0 ensemble is too short, %d bytes" % len(raw_data))
+        # the number of bytes up to the checksum
+        self.length = PD0_UINT16.unpack_from(raw_data, 2)[0]
+        self.header = header.unpack(raw_data)
+        num_data_types = self.header[-1]
+        offset_struct = _offset_struct(num_data_types)
+        if len(raw_data) < PD0_OFFSETS_START + offset_struct.size:
+            raise SampleException("PD0 offset table for %d data types is truncated" % num_data_types)
+        self.offsets = list(offset_struct.unpack_from(raw_data, PD0_OFFSETS_START))
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def checksum(self):
+        """
+        @retval The sum of the ensemble bytes up to the checksum, modulo 65536
+        """
+        return int(np.frombuffer(self.raw_data, dtype=np.uint8, count=self.length).sum()) & 65535
+
+    def received_checksum(self):
+        """
+        @retval The checksum sent at the end of the ensemble
+        """
+        return PD0_UINT16.unpack_from(self.raw_data, self.length)[0]
+
+    def verify_checksum(self):
+        """
+        @retval The checksum of the ensemble
+        @throws SampleException if it does not match the received checksum
+        """
+        if self.length + 2 > len(self.raw_data):
+            raise SampleException("PD0 ensemble is truncated, %d of %d bytes" %
+                                  (len(self.raw_data), self.length + 2))
+        checksum = self.checksum()
+        received = self.received_checksum()
+        if checksum != received:
+            log.debug("Checksum mismatch %d != %d", checksum, received)
+            raise SampleException("Checksum mismatch")
+        return checksum
+
+    def data_type_id(self, index):
+        """
+        @param index The index of the data type in the offset table
+        @retval The Pd0DataTypeId of the data type
+        """
+        return PD0_UINT16.unpack_from(self.raw_data, self.offsets[index])[0]
+
+    def chunk(self, index, size=None, end=None):
+        """
+        Get the bytes of one data type
+        @param index The index of the data type in the offset table
+        @param size The size of the data type, if it is known
+        @param end The end of the last data type, defaults to the checksum
+        @retval The data type bytes, starting with its id
+        """
+        start = self.offsets[index]
+        if size is not None:
+            return self.raw_data[start:start + size]
+        if index + 1 < len(self.offsets):
+            return self.raw_data[start:self.offsets[index + 1]]
+        if end is None:
+            end = self.length
+        return self.raw_data[start:end]
+
+    def record(self, index, record):
+        """
+        Decode a data type with a fixed layout, such as the leaders
+        @param index The index of the data type in the offset table
+        @param record The Pd0Record layout of the data type
+        @retval A named tuple of the record fields
+        """
+        return record.unpack(self.raw_data, self.offsets[index])
+
+
+def decode_cell_array(chunk, dtype, num_cells=None):
+    """
+    Decode the depth cell array of a velocity, correlation magnitude, echo
+    intensity or percent good data type. The whole array is read with one
+    numpy call instead of unpacking it a cell at a time.
+    @param chunk The data type, starting with its 2 byte id
+    @param dtype The numpy dtype of one value, i.e. '<i2' for little endian
+        velocities or 'u1' for correlation magnitudes
+    @param num_cells The number of depth cells to decode, defaults to every
+        complete cell in the chunk
+    @retval A list of four lists, the values for each beam ordered by depth cell
+    """
+    dtype = np.dtype(dtype)
+    if num_cells is None:
+        num_cells = (len(chunk) - PD0_ID_SIZE) // (dtype.itemsize * PD0_BEAMS)
+    if num_cells <= 0:
+        return [[] for beam in range(PD0_BEAMS)]
+
+    cells = np.frombuffer(chunk, dtype=dtype, count=num_cells * PD0_BEAMS,
+                          offset=PD0_ID_SIZE).reshape(num_cells, PD0_BEAMS)
+    # tolist() converts to python ints so the particle values encode as before
+    return cells.T.tolist()
@@ -11,7 +11,9 @@ and logging.
 __author__ = 'David Everett'
 __license__ = 'Apache 2.0'
 
+import os
 import socket
+import select
 import errno
 import threading
 import time
@@ -26,6 +28,11 @@ from mi.core.log import get_logger ; log = get_logger()
 from mi.core.exceptions import InstrumentConnectionException
 
 HEADER_SIZE = 16 # BBBBHHLL = 1 + 1 + 1 + 1 + 2 + 2 + 4 + 4 = 16
+HEADER_FORMAT = struct.Struct('>BBBBHHII')
+LENGTH_FORMAT = struct.Struct('>H')
+OFFSET_LENGTH = 4
+
+RECV_BUFFER_SIZE = 65536 # size of the blocks read by a buffered listener
 
 
 OFFSET_P_CHECKSUM_LOW = 6
@@ -62,6 +69,15 @@ MAX_SEND_ATTEMPTS = 15              # Max number of times we can get EAGAIN
 class SocketClosed(Exception): pass
 
 
+def get_reactor():
+    """
+    Return the process wide PortAgentReactor (imported here, the reactor
+    module depends on this one)
+    """
+    from mi.core.instrument.port_agent_reactor import PortAgentReactor
+    return PortAgentReactor.get_reactor()
+
+
 class PortAgentPacket():
     """
     An object that encapsulates the details packets that are sent to and
@@ -93,13 +109,18 @@ class PortAgentPacket():
         self.__isValid = False
 
     def unpack_header(self, header):
+        """
+        Unpack a received header
+        @param header The header bytes, a string or any buffer (a memoryview
+        into a receive buffer is kept as is, without copying)
+        """
         self.__header = header
         #@TODO may want to switch from big endian to network order '!' instead of '>' note network order is big endian.
         # B = unsigned char size 1 bytes
         # H = unsigned short size 2 bytes
         # L = unsigned long size 4 bytes
         # d = float size8 bytes
-        variable_tuple = struct.unpack_from('>BBBBHHII', header)
+        variable_tuple = HEADER_FORMAT.unpack_from(header)
         # change offset to index.
         self.__type = variable_tuple[TYPE_INDEX]
         self.__length = int(variable_tuple[LENGTH_INDEX]) - HEADER_SIZE
@@ -193,6 +214,8 @@ class PortAgentPacket():
         #log.debug('checksum: %i.' %(checksum))
 
     def get_header(self):
+        if isinstance(self.__header, memoryview):
+            self.__header = self.__header.tobytes()
         return self.__header
 
     
@@ -204,6 +227,20 @@ class PortAgentPacket():
         self.__header = header
 
     def get_data(self):
+        """
+        Return the packet data as a string. Data received by a buffered
+        listener is a view into the receive buffer; it is copied out the
+        first time it is asked for.
+        """
+        if isinstance(self.__data, memoryview):
+            self.__data = self.__data.tobytes()
+        return self.__data
+
+    def get_data_view(self):
+        """
+        Return the packet data without copying it, a memoryview if the packet
+        came from a buffered listener
+        """
         return self.__data
 
     def get_timestamp(self):
@@ -238,13 +275,145 @@ class PortAgentPacket():
             'type': self.__type,
             'length': self.__length,
             'checksum': self.__checksum,
-            'raw': self.__data
+            'raw': self.get_data()
         }
 
     def is_valid(self):
         return self.__isValid
                     
 
+class PortAgentPacketBuffer(object):
+    """
+    A receive buffer for the port agent data socket. Large blocks are read
+    into one bytearray and as many packets as are complete are split out of
+    it with struct.unpack_from. The packets hold memoryview slices of the
+    buffer rather than copies.
+
+    The buffer is never written over once a packet has been handed out, so
+    those views stay valid for as long as a packet is kept. When it fills up
+    a new buffer is started and only the incomplete packet at the end is
+    copied over.
+    """
+    def __init__(self, size=RECV_BUFFER_SIZE):
+        """
+        @param size The size of the receive buffer, grown when a single
+        packet does not fit
+        """
+        self._size = size
+        self._new_buffer(size)
+
+    def _new_buffer(self, size, pending=None):
+        """
+        Start a new receive buffer
+        @param size The size of the new buffer
+        @param pending Received bytes not parsed yet, to carry over
+        """
+        self._buffer = bytearray(size)
+        self._view = memoryview(self._buffer)
+        self._start = 0
+        self._end = 0
+        if pending:
+            self._end = len(pending)
+            self._view[:self._end] = pending
+
+    def _packet_length(self):
+        """
+        @retval The length (header included) of the packet at the start of
+        the unparsed data, or None if the header is incomplete
+        """
+        if self._end - self._start < HEADER_SIZE:
+            return None
+        length = LENGTH_FORMAT.unpack_from(self._buffer, self._start + OFFSET_LENGTH)[0]
+        return max(length, HEADER_SIZE)
+
+    def recv_from(self, sock):
+        """
+        Read as much as the socket has (up to the free space in the buffer)
+        @param sock The socket to read from
+        @retval The number of bytes read
+        @raise SocketClosed if the socket has been closed
+        @raise socket.error from recv_into (including EWOULDBLOCK)
+        """
+        needed = self._packet_length() or HEADER_SIZE
+        if self._end == len(self._buffer) or self._start + needed > len(self._buffer):
+            self._new_buffer(max(self._size, needed),
+                             self._view[self._start:self._end])
+
+        bytesrx = sock.recv_into(self._view[self._end:], len(self._buffer) - self._end)
+        if bytesrx <= 0:
+            raise SocketClosed()
+        self._end += bytesrx
+        return bytesrx
+
+    def next_packet(self):
+        """
+        Split the next complete packet out of the buffer
+        @retval A PortAgentPacket, or None if no complete packet is buffered
+        """
+        length = self._packet_length()
+        if length is None or self._end - self._start < length:
+            return None
+
+        start = self._start
+        paPacket = PortAgentPacket()
+        paPacket.unpack_header(self._view[start:start + HEADER_SIZE])
+        paPacket.attach_data(self._view[start + HEADER_SIZE:start + length])
+        self._start = start + length
+        return paPacket
+
+class SocketPoller(object):
+    """
+    Wait for file descriptors to become readable. Uses select.poll where it
+    is available and falls back to select.select where it is not (gevent's
+    monkey patching removes select.poll, for instance).
+    """
+    def __init__(self):
+        self._fds = set()
+        self._poll = None
+        if hasattr(select, 'poll'):
+            self._poll = select.poll()
+
+    def register(self, fd):
+        """
+        Start watching a file descriptor (or object with a fileno method)
+        """
+        if not isinstance(fd, (int, long)):
+            fd = fd.fileno()
+        self._fds.add(fd)
+        if self._poll:
+            self._poll.register(fd, select.POLLIN | select.POLLPRI)
+
+    def unregister(self, fd):
+        """
+        Stop watching a file descriptor (or object with a fileno method)
+        """
+        if not isinstance(fd, (int, long)):
+            fd = fd.fileno()
+        if fd in self._fds:
+            self._fds.discard(fd)
+            if self._poll:
+                self._poll.unregister(fd)
+
+    def poll(self, timeout=None):
+        """
+        Wait for any of the registered file descriptors to become readable,
+        closed or in error
+        @param timeout Seconds to wait, None to wait forever
+        @retval A list of file descriptors ready to be read; empty on timeout
+        @raise socket.error if a file descriptor is no longer valid
+        """
+        try:
+            if self._poll:
+                if timeout is not None:
+                    timeout = max(0, int(timeout * 1000))
+                return [fd for (fd, event) in self._poll.poll(timeout)]
+            else:
+                return select.select(list(self._fds), [], [], timeout)[0]
+        except select.error as e:
+            if e.args[0] == errno.EINTR:
+                return []
+            raise socket.error(*e.args)
+
 class PortAgentClient(object):
     """
     A port agent process client class to abstract the TCP interface to the 
@@ -278,6 +447,9 @@ class PortAgentClient(object):
         self.listener_callback_error = None
         self.last_retry_time = None
         self.recovery_mutex = threading.Lock()
+        self.buffered = False
+        self.event_driven = False
+        self.use_reactor = False
         
     def _init_comms(self):
         """
@@ -286,6 +458,9 @@ class PortAgentClient(object):
         """
         
         try:
+            # a reactor listener must let go of the old socket before it is
+            # closed, its descriptor may be reused by the new one
+            self._stop_reactor_listener()
             self._destroy_connection()
             self._create_connection()
 
@@ -310,8 +485,13 @@ class PortAgentClient(object):
                                                 self.callback_raw,
                                                 self.listener_callback_error,
                                                 self.callback_error,
-                                                self.user_callback_error)
-                self.listener_thread.start()
+                                                self.user_callback_error,
+                                                self.buffered,
+                                                self.event_driven or self.use_reactor)
+                if self.use_reactor:
+                    get_reactor().add_listener(self.listener_thread)
+                else:
+                    self.listener_thread.start()
 
             ###
             # Reset recovery_attempts because we were successful, but only 
@@ -363,8 +543,19 @@ class PortAgentClient(object):
     def init_comms(self, user_callback_data = None, user_callback_raw = None,
                    listener_callback_error = None,
                    user_callback_error = None, heartbeat = 0,
-                   max_missed_heartbeats = None, start_listener = True):
-        
+                   max_missed_heartbeats = None, start_listener = True,
+                   buffered = False, event_driven = False, use_reactor = False):
+        """
+        Connect to the port agent and start listening
+        @param buffered Read from the port agent in large blocks and split
+        packets out of a reusable receive buffer, see PortAgentPacketBuffer
+        @param event_driven Wait for data with poll rather than sleeping
+        between reads, and track heartbeats in the listener thread itself
+        rather than with a timer thread. Implies buffered.
+        @param use_reactor Do not start a listener thread; have the process
+        wide PortAgentReactor read the data socket along with those of all
+        other clients using it. Implies event_driven.
+        """
         self.user_callback_data = user_callback_data        
         self.user_callback_raw = user_callback_raw
         self.listener_callback_error = listener_callback_error
@@ -372,6 +563,9 @@ class PortAgentClient(object):
         self.heartbeat = heartbeat
         self.max_missed_heartbeats = max_missed_heartbeats
         self.start_listener = start_listener 
+        self.buffered = buffered
+        self.event_driven = event_driven
+        self.use_reactor = use_reactor
 
         if  False == self._init_comms():
             error_string = ' port_agent_client private _init_comms failed.'
@@ -384,7 +578,9 @@ class PortAgentClient(object):
         with the device logger. This is called by the done function.
         """
         log.info('PortAgentClient shutting down comms.')
-        if (self.listener_thread):
+        if self.use_reactor:
+            self._stop_reactor_listener()
+        elif (self.listener_thread):
             self.listener_thread.done()
             self.listener_thread.join()
 
@@ -399,6 +595,16 @@ class PortAgentClient(object):
         """
         self.stop_comms()
 
+    def _stop_reactor_listener(self):
+        """
+        Take the current listener off the reactor, if the reactor is used.
+        Reactor listeners have no thread to join or to outlive their socket,
+        so this is done before the socket is replaced or closed.
+        """
+        if self.use_reactor and self.listener_thread:
+            self.listener_thread.done()
+            get_reactor().remove_listener(self.listener_thread)
+
     def callback_data(self, paPacket):
         """
         A packet has been received from the port agent.  The packet is 
@@ -442,7 +648,9 @@ class PortAgentClient(object):
             """        
             self.recovery_mutex.release()
             log.error("Maximum connection_level recovery attempts (%d) reached." % (self.recovery_attempts))
-            if self.listener_thread and self.listener_thread.is_alive():
+            if self.use_reactor:
+                self._stop_reactor_listener()
+            elif self.listener_thread and self.listener_thread.is_alive():
                 log.info("Stopping listener thread.") 
                 self.listener_thread.done()
             returnValue = False
@@ -594,7 +802,8 @@ class Listener(threading.Thread):
                  callback_data = None, callback_raw = None,
                  default_callback_error = None,
                  local_callback_error = None,
-                 user_callback_error = None):
+                 user_callback_error = None,
+                 buffered = False, event_driven = False):
         """
         Listener thread constructor.
         @param sock The socket to listen on.
@@ -609,9 +818,28 @@ class Listener(threading.Thread):
         @param default_callback_data A callback to handle non-network exceptions
         @param local_callback_data The local callback when error encountered.
         @param user_callback_data The user callback on error_encountered.
+        @param buffered Receive into a PortAgentPacketBuffer rather than
+        reading each packet header and body separately.
+        @param event_driven Block in poll until data arrives, the heartbeat
+        is due or done() is called, instead of sleeping on EWOULDBLOCK.
+        The heartbeat is checked against a deadline in this thread, so no
+        timer thread is started. Implies buffered.
         """
         threading.Thread.__init__(self)
         self.sock = sock
+        self.buffered = buffered or event_driven
+        self.event_driven = event_driven
+        self.packet_buffer = None
+        if self.buffered:
+            self.packet_buffer = PortAgentPacketBuffer()
+        self.poller = None
+        self.heartbeat_deadline = None
+        # the wake pipe is written by done() and closed by run() on other
+        # threads, so both hold this lock
+        self._wake_fds = None
+        self._wake_lock = threading.Lock()
+        # set by a reactor to run connection recovery off its thread
+        self.recovery_runner = None
         self.recovery_attempt = recovery_attempt
         self._done = False
         self.linebuf = ''
@@ -723,7 +951,14 @@ class Listener(threading.Thread):
         it and start it again, you have to instantiate a new one.
         I don't like this; we need to implement a tread timer that 
         stays up and can be reset and started many times.
+
+        An event driven listener only moves its heartbeat deadline; the run
+        loop calls heartbeat_timeout when the deadline passes.
         """
+        if self.event_driven:
+            self.heartbeat_deadline = time.time() + self.heartbeat
+            return
+
         if self.heartbeat_timer:
             self.heartbeat_timer.cancel()
 
@@ -738,6 +973,20 @@ class Listener(threading.Thread):
         """
         self._done = True
 
+        # wake up an event driven listener blocked in poll
+        with self._wake_lock:
+            if self._wake_fds is not None:
+                try:
+                    os.write(self._wake_fds[1], 'x')
+                except OSError:
+                    pass
+
+    def is_done(self):
+        """
+        @retval True once done() has been called or the listener has failed
+        """
+        return self._done
+
     def handle_packet(self, paPacket):
         packet_type = paPacket.get_header_type()
         
@@ -773,104 +1022,223 @@ class Listener(threading.Thread):
 
     def run(self):
         """
-        Listener thread processing loop. Block on receive from port agent.
-        Receive HEADER_SIZE bytes to receive the entire header.  From that,
-        get the length of the whole packet (including header); compute the
-        length of the remaining data and read that.  
+        Listener thread processing loop. Block on receive from port agent,
+        one packet at a time or, if buffered, a block at a time.
         """
         self.thread_name = str(threading.current_thread().name)
         log.info('PortAgentClient listener thread: %s started.', self.thread_name)
         
+        if self.event_driven:
+            with self._wake_lock:
+                self._wake_fds = os.pipe()
+            self.poller = SocketPoller()
+            self.poller.register(self.sock)
+            self.poller.register(self._wake_fds[0])
+
         if self.heartbeat:
             self.start_heartbeat_timer()
 
+        if self.event_driven:
+            receive = self._receive_polled
+        elif self.buffered:
+            receive = self._receive_buffered
+        else:
+            receive = self._receive_packet
+
         while not self._done:
+            self.process(receive)
+
+        with self._wake_lock:
+            if self._wake_fds is not None:
+                for fd in self._wake_fds:
+                    os.close(fd)
+                self._wake_fds = None
+
+        log.info('Port_agent_client thread done listening; going away.')
+
+    def process(self, receive):
+        """
+        Run one receive step, passing errors to the error callbacks. A
+        closed socket or socket error ends the listener. A reactor calls
+        this for listeners it drives instead of starting their thread.
+        @param receive The receive method to run
+        """
+        try:
+            receive()
+
+        except SocketClosed:
+            errorString = 'Listener thread: %s SocketClosed exception from port_agent socket' \
+                % (self.thread_name) 
+            log.error(errorString)
+            self._invoke_error_callback(self.recovery_attempt, errorString)
+            """
+            This next statement causes the thread to exit.  This 
+            thread is done regardless of which condition exists 
+            above; it is the job of the callbacks to restart the
+            thread
+            """
+            self._done = True
+
+        except socket.error as e:
+            errorString = 'Listener thread: %s Socket error while receiving from port agent: %r' \
+             % (self.thread_name, e)
+            log.error(errorString)
+            self._invoke_error_callback(self.recovery_attempt, errorString)
+            """
+            This next statement causes the thread to exit.  This 
+            thread is done regardless of which condition exists 
+            above; it is the job of the callbacks to restart the
+            thread
+            """
+            self._done = True
+
+        except Exception as e:
+            self.default_callback_error(e)
+
+    def _receive_packet(self):
+        """
+        Receive a single packet: read HEADER_SIZE bytes to receive the
+        entire header.  From that, get the length of the whole packet
+        (including header); compute the length of the remaining data and
+        read that.
+        """
+        log.debug('RX NEW PACKET')
+        header = bytearray(HEADER_SIZE)
+        headerview = memoryview(header)
+        bytes_left = HEADER_SIZE
+        while bytes_left and not self._done:
             try:
-                log.debug('RX NEW PACKET')
-                header = bytearray(HEADER_SIZE)
-                headerview = memoryview(header)
-                bytes_left = HEADER_SIZE
-                while bytes_left and not self._done:
-                    try:
-                        bytesrx = self.sock.recv_into(headerview[HEADER_SIZE - bytes_left:], bytes_left)
-                        log.debug('RX HEADER BYTES %d LEFT %d SOCK %r' % (
-                                                    bytesrx, bytes_left, self.sock,))
-                        if bytesrx <= 0:
-                            raise SocketClosed()
-                        bytes_left -= bytesrx
-                    except socket.error as e:
-                        if e.errno == errno.EWOULDBLOCK:
-                            time.sleep(.1)
-                        else:
-                            raise
-
-                """
-                Only do this if we've received the whole header, otherwise (ex. during shutdown)
-                we can have a completely invalid header, resulting in negative count exceptions.
-                """
-                if (bytes_left == 0):
-                    paPacket = PortAgentPacket()
-                    paPacket.unpack_header(str(header))
-                    data_size = paPacket.get_data_length()
-                    bytes_left = data_size
-                    data = bytearray(data_size)
-                    dataview = memoryview(data)
-                    log.debug('Expecting DATA BYTES %d' % data_size)
-                    
-                while bytes_left and not self._done:
-                    try:
-                        bytesrx = self.sock.recv_into(dataview[data_size - bytes_left:], bytes_left)
-                        log.debug('RX DATA BYTES %d LEFT %d SOCK %r' % (
-                                                    bytesrx, bytes_left, self.sock,))
-                        if bytesrx <= 0:
-                            raise SocketClosed()
-                        bytes_left -= bytesrx
-                    except socket.error as e:
-                        if e.errno == errno.EWOULDBLOCK:
-                            time.sleep(.1)
-                        else:
-                            raise
-
-                if not self._done:
-                    """
-                    Should have complete port agent packet.
-                    """
-                    paPacket.attach_data(str(data))
-                    log.debug("HANDLE PACKET")
-                    self.handle_packet(paPacket)
-
-            except SocketClosed:
-                errorString = 'Listener thread: %s SocketClosed exception from port_agent socket' \
-                    % (self.thread_name) 
-                log.error(errorString)
-                self._invoke_error_callback(self.recovery_attempt, errorString)
-                """
-                This next statement causes the thread to exit.  This 
-                thread is done regardless of which condition exists 
-                above; it is the job of the callbacks to restart the
-                thread
-                """
-                self._done = True
+                bytesrx = self.sock.recv_into(headerview[HEADER_SIZE - bytes_left:], bytes_left)
+                log.debug('RX HEADER BYTES %d LEFT %d SOCK %r' % (
+                                            bytesrx, bytes_left, self.sock,))
+                if bytesrx <= 0:
+                    raise SocketClosed()
+                bytes_left -= bytesrx
+            except socket.error as e:
+                if e.errno == errno.EWOULDBLOCK:
+                    time.sleep(.1)
+                else:
+                    raise
 
+        """
+        Only do this if we've received the whole header, otherwise (ex. during shutdown)
+        we can have a completely invalid header, resulting in negative count exceptions.
+        """
+        if (bytes_left == 0):
+            paPacket = PortAgentPacket()
+            paPacket.unpack_header(str(header))
+            data_size = paPacket.get_data_length()
+            bytes_left = data_size
+            data = bytearray(data_size)
+            dataview = memoryview(data)
+            log.debug('Expecting DATA BYTES %d' % data_size)
+            
+        while bytes_left and not self._done:
+            try:
+                bytesrx = self.sock.recv_into(dataview[data_size - bytes_left:], bytes_left)
+                log.debug('RX DATA BYTES %d LEFT %d SOCK %r' % (
+                                            bytesrx, bytes_left, self.sock,))
+                if bytesrx <= 0:
+                    raise SocketClosed()
+                bytes_left -= bytesrx
             except socket.error as e:
-                errorString = 'Listener thread: %s Socket error while receiving from port agent: %r' \
-                 % (self.thread_name, e)
-                log.error(errorString)
-                self._invoke_error_callback(self.recovery_attempt, errorString)
-                """
-                This next statement causes the thread to exit.  This 
-                thread is done regardless of which condition exists 
-                above; it is the job of the callbacks to restart the
-                thread
-                """
-                self._done = True
-
-            except Exception as e:
-                self.default_callback_error(e)
+                if e.errno == errno.EWOULDBLOCK:
+                    time.sleep(.1)
+                else:
+                    raise
 
-        log.info('Port_agent_client thread done listening; going away.')
+        if not self._done:
+            """
+            Should have complete port agent packet.
+            """
+            paPacket.attach_data(str(data))
+            log.debug("HANDLE PACKET")
+            self.handle_packet(paPacket)
+
+    def _receive_buffered(self):
+        """
+        Read whatever the socket has into the packet buffer and handle
+        every complete packet in it.
+        """
+        try:
+            self._read_packets()
+        except socket.error as e:
+            if e.errno == errno.EWOULDBLOCK:
+                time.sleep(.1)
+            else:
+                raise
+
+    def _receive_polled(self):
+        """
+        Wait until the socket is readable, the heartbeat deadline passes or
+        done() is called, then read and handle whatever is there.
+        """
+        timeout = None
+        if self.heartbeat_deadline:
+            timeout = self.heartbeat_deadline - time.time()
+
+        ready = self.poller.poll(timeout)
+
+        if self._done:
+            return
+
+        if not ready:
+            self.check_heartbeat()
+            return
+
+        self.receive_ready()
+
+    def receive_ready(self):
+        """
+        Read and handle whatever the socket has, once poll has reported it
+        readable
+        """
+        try:
+            self._read_packets()
+        except socket.error as e:
+            if e.errno != errno.EWOULDBLOCK:
+                raise
+
+    def check_heartbeat(self, now=None):
+        """
+        Count a missed heartbeat if the heartbeat deadline of an event
+        driven listener has passed
+        @param now The current time, defaults to time.time()
+        """
+        if now is None:
+            now = time.time()
+        if self.heartbeat_deadline and now >= self.heartbeat_deadline:
+            self.heartbeat_deadline = None
+            self.heartbeat_timeout()
+
+    def _read_packets(self):
+        """
+        Read once from the socket into the packet buffer and handle every
+        complete packet in it.
+        @raise SocketClosed, socket.error as recv_into does
+        """
+        bytesrx = self.packet_buffer.recv_from(self.sock)
+        log.debug('RX BYTES %d SOCK %r' % (bytesrx, self.sock,))
+
+        paPacket = self.packet_buffer.next_packet()
+        while paPacket and not self._done:
+            self.handle_packet(paPacket)
+            paPacket = self.packet_buffer.next_packet()
 
     def _invoke_error_callback(self, recovery_attempt, error_string = "No error string passed."):
+        """
+        Run the error callbacks, or have the recovery runner run them if
+        there is one. Recovery reconnects to the port agent, which blocks,
+        so a reactor driving many listeners runs it on another thread.
+        @param recovery_attempt: the number of this recovery attempt.
+        @param error_string: error description.
+        """
+        if self.recovery_runner is not None:
+            self.recovery_runner(self, recovery_attempt, error_string)
+        else:
+            self.run_error_callbacks(recovery_attempt, error_string)
+
+    def run_error_callbacks(self, recovery_attempt, error_string = "No error string passed."):
         """
         Invoke either the user_error_callback or the local_error_callback, depending upon the
         recovery_attempt value.  If the local_error_callback is invoked, and its return_code
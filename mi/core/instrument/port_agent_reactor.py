@@ -0,0 +1,273 @@
+#!/usr/bin/env python
+
+"""
+@package mi.core.instrument.port_agent_reactor
+@file mi/core/instrument/port_agent_reactor.py
+@brief A single thread that reads every port agent data socket in a process
+"""
+
+__license__ = 'Apache 2.0'
+
+import os
+import heapq
+import socket
+import threading
+import time
+
+from mi.core.log import get_logger ; log = get_logger()
+from mi.core.instrument.port_agent_client import SocketPoller
+
+
+class PortAgentReactor(threading.Thread):
+    """
+    Drives the Listeners of many PortAgentClients from one thread instead of
+    a listener thread and a heartbeat timer thread per client. The reactor
+    polls all data sockets at once, reads whatever is ready into each
+    listener's packet buffer and has the listener dispatch the complete
+    packets to its callbacks, with the listener's usual error handling.
+
+    Heartbeat deadlines of all listeners are kept in one timer heap, ordered
+    by deadline. A heartbeat packet only moves the listener's deadline;
+    the stale heap entry is pushed again at the new deadline when it comes
+    up, so the heap is touched once per heartbeat interval, not per packet.
+
+    The reactor thread only does non-blocking work. When a connection
+    fails or misses its heartbeats the listener is taken off the reactor
+    and its recovery, which reconnects to the port agent and may sleep and
+    retry, runs on a thread of its own. A successful recovery adds the new
+    connection's listener back to the reactor.
+
+    Clients opt in with PortAgentClient.init_comms(use_reactor=True), which
+    hands an event driven Listener to the process wide reactor returned by
+    get_reactor() rather than starting it.
+    """
+    _reactor = None
+    _reactor_lock = threading.Lock()
+
+    @classmethod
+    def get_reactor(cls):
+        """
+        Return the process wide reactor, starting it the first time
+        """
+        with cls._reactor_lock:
+            if cls._reactor is None or not cls._reactor.is_alive():
+                cls._reactor = cls()
+                cls._reactor.start()
+            return cls._reactor
+
+    def __init__(self):
+        threading.Thread.__init__(self, name='PortAgentReactor')
+        self.daemon = True
+        self._done = False
+        self._lock = threading.Lock()
+        self._changes = []
+        self._listeners = {}    # fd -> listener
+        self._fds = {}          # listener -> fd
+        self._timers = []       # heap of (heartbeat deadline, fd, listener)
+        self._recoveries = []   # (listener, recovery attempt, error string)
+        self._poller = SocketPoller()
+        # written by _wake() from other threads and closed by run(), so both
+        # hold this lock
+        self._wake_lock = threading.Lock()
+        self._wake_fds = os.pipe()
+        self._poller.register(self._wake_fds[0])
+
+    def add_listener(self, listener):
+        """
+        Start reading the listener's socket. The listener must be event
+        driven and must not be started.
+        @param listener An event driven Listener
+        """
+        if not listener.event_driven:
+            raise ValueError("reactor listeners must be event driven")
+        listener.recovery_runner = self._queue_recovery
+        with self._lock:
+            self._changes.append((listener, listener.sock.fileno()))
+        self._wake()
+
+    def remove_listener(self, listener):
+        """
+        Stop reading the listener's socket
+        @param listener A Listener previously added
+        """
+        with self._lock:
+            self._changes.append((listener, None))
+        self._wake()
+
+    def listener_count(self):
+        """
+        @retval The number of listeners being read
+        """
+        return len(self._fds)
+
+    def stop(self):
+        """
+        Stop the reactor thread; listeners still registered are left alone
+        """
+        self._done = True
+        self._wake()
+
+    def _wake(self):
+        """
+        Wake the reactor thread up from poll
+        """
+        with self._wake_lock:
+            if self._wake_fds is not None:
+                try:
+                    os.write(self._wake_fds[1], 'x')
+                except OSError:
+                    pass
+
+    def _apply_changes(self):
+        """
+        Register and unregister listeners; only done in the reactor thread
+        so the poller is never changed while it is being polled.
+        """
+        with self._lock:
+            changes = self._changes
+            self._changes = []
+
+        for (listener, fd) in changes:
+            if fd is None:
+                self._unregister(listener)
+                continue
+
+            # a stale listener whose socket was closed may still hold the
+            # descriptor number the new socket got
+            stale = self._listeners.get(fd)
+            if stale is not None:
+                self._unregister(stale)
+
+            self._listeners[fd] = listener
+            self._fds[listener] = fd
+            listener.thread_name = '%s fd %d' % (self.name, fd)
+            self._poller.register(fd)
+            if listener.heartbeat:
+                listener.start_heartbeat_timer()
+                heapq.heappush(self._timers, (listener.heartbeat_deadline, fd, listener))
+
+    def _unregister(self, listener):
+        fd = self._fds.pop(listener, None)
+        if fd is not None and self._listeners.get(fd) is listener:
+            del self._listeners[fd]
+            self._poller.unregister(fd)
+
+    def _next_timeout(self):
+        """
+        @retval Seconds until the earliest heartbeat deadline, None if no
+        listener expects heartbeats
+        """
+        if not self._timers:
+            return None
+        return max(0, self._timers[0][0] - time.time())
+
+    def _check_heartbeats(self):
+        """
+        Pop the heartbeat timers that are due and have their listeners count
+        a missed heartbeat, or push them again if the deadline has moved.
+        """
+        now = time.time()
+        while self._timers and self._timers[0][0] <= now:
+            (deadline, fd, listener) = heapq.heappop(self._timers)
+            if self._fds.get(listener) != fd or listener.is_done():
+                continue
+
+            if listener.heartbeat_deadline is not None and listener.heartbeat_deadline > now:
+                heapq.heappush(self._timers, (listener.heartbeat_deadline, fd, listener))
+                continue
+
+            try:
+                listener.check_heartbeat(now)
+            except Exception as e:
+                log.error("PortAgentReactor: heartbeat error: %r", e, exc_info=True)
+                listener.default_callback_error(e)
+
+            if listener.heartbeat_deadline is not None:
+                heapq.heappush(self._timers, (listener.heartbeat_deadline, fd, listener))
+
+    def _queue_recovery(self, listener, recovery_attempt, error_string):
+        """
+        Recovery runner for the listeners; only called in the reactor thread,
+        from the listener's error handling. The recovery is started once the
+        reactor has finished with the listener.
+        """
+        self._recoveries.append((listener, recovery_attempt, error_string))
+
+    def _start_recoveries(self):
+        """
+        Take the failed listeners off the reactor and run their error
+        callbacks on recovery threads, so reconnecting does not hold up the
+        other connections. The listener is unregistered first since
+        recovery closes its socket.
+        """
+        recoveries = self._recoveries
+        self._recoveries = []
+        for (listener, recovery_attempt, error_string) in recoveries:
+            self._unregister(listener)
+            thread = threading.Thread(target=listener.run_error_callbacks,
+                                      args=(recovery_attempt, error_string),
+                                      name='%s recovery' % listener.thread_name)
+            thread.daemon = True
+            thread.start()
+
+    def _service(self, listener):
+        """
+        Read a ready socket and dispatch its packets
+        """
+        listener.process(listener.receive_ready)
+        if listener.is_done():
+            self._unregister(listener)
+
+    def _service_bad_fds(self):
+        """
+        select reports a closed descriptor for the whole set; find the
+        listeners it belongs to and let their reads fail
+        """
+        for (fd, listener) in self._listeners.items():
+            if listener.is_done():
+                self._unregister(listener)
+                continue
+            try:
+                os.fstat(fd)
+            except OSError:
+                self._service(listener)
+                self._unregister(listener)
+
+    def run(self):
+        log.info('PortAgentReactor started.')
+        while not self._done:
+            try:
+                self._apply_changes()
+                try:
+                    ready = self._poller.poll(self._next_timeout())
+                except socket.error as e:
+                    log.error("PortAgentReactor: poll error: %r", e)
+                    self._service_bad_fds()
+                    self._start_recoveries()
+                    continue
+
+                wake_fd = self._wake_fds[0]
+                for fd in ready:
+                    if fd == wake_fd:
+                        os.read(fd, 4096)
+                        continue
+                    listener = self._listeners.get(fd)
+                    if listener is not None and not listener.is_done():
+                        self._service(listener)
+
+                self._check_heartbeats()
+
+                for listener in [l for l in self._fds if l.is_done()]:
+                    self._unregister(listener)
+
+                self._start_recoveries()
+
+            except Exception as e:
+                # keep the other instruments going
+                log.error("PortAgentReactor: unexpected error: %r", e, exc_info=True)
+
+        with self._wake_lock:
+            for fd in self._wake_fds:
+                os.close(fd)
+            self._wake_fds = None
+        log.info('PortAgentReactor done.')
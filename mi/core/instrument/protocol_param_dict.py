@@ -12,6 +12,8 @@ __author__ = 'Edward Hunter'
 __license__ = 'Apache 2.0'
 
 import re
+import sre_parse
+import sre_constants
 import ntplib
 import time
 import yaml
@@ -27,6 +29,108 @@ from mi.core.log import get_logger ; log = get_logger()
 EGG_PATH = "resource"
 DEFAULT_FILENAME = "strings.yml"
 
+def required_literal(regex):
+    """
+    Find a string which any match of a regex must contain, so input
+    without it can be skipped with a substring test instead of a search.
+    Only literals outside of branches, character sets and optional repeats
+    are considered.
+    @param regex The compiled regex
+    @retval The longest required literal, or None if there is none or the
+        regex ignores case
+    """
+    if regex.flags & re.IGNORECASE:
+        return None
+    try:
+        parsed = sre_parse.parse(regex.pattern, regex.flags)
+    except (sre_constants.error, TypeError):
+        return None
+
+    literals = []
+    def walk(items):
+        run = []
+        for (op, av) in items:
+            if op == sre_constants.LITERAL and av < 256:
+                run.append(chr(av))
+                continue
+            literals.append(''.join(run))
+            run = []
+            if op == sre_constants.SUBPATTERN:
+                walk(av[-1])
+            elif op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT) and av[0] >= 1:
+                walk(av[2])
+        literals.append(''.join(run))
+    walk(parsed)
+
+    literal = max(literals, key=len)
+    return literal or None
+
+class ParameterIndex(object):
+    """
+    Index of dictionary parameters by the literal each regex requires. One
+    regex scan of the input finds every literal in it, so only the
+    parameters whose literal is present are searched with their own regex.
+    Parameters without a required literal are always searched.
+    """
+    def __init__(self, params):
+        """
+        @param params A list of (name, parameter) tuples in dictionary order
+        """
+        self.names = []
+        self._order = {}
+        self._always = []
+        self._by_literal = {}
+        for (name, val) in params:
+            self._order[name] = len(self.names)
+            self.names.append(name)
+            literal = val.literal() if isinstance(val, RegexParameter) else None
+            if literal:
+                self._by_literal.setdefault(literal, []).append(name)
+            else:
+                self._always.append(name)
+
+        # The scan finds the longest literal at each position and skips
+        # past it. Any literal inside a found literal is present too, and a
+        # literal starting inside one and running past its end is tested on
+        # its own.
+        literals = sorted(self._by_literal, key=len, reverse=True)
+        self._implied = {}
+        self._overlapping = {}
+        for literal in literals:
+            self._implied[literal] = [other for other in literals if other in literal]
+            self._overlapping[literal] = [other for other in literals if other not in literal and
+                                          any(other.startswith(literal[start:])
+                                              for start in range(1, len(literal)))]
+        self._scanner = None
+        if literals:
+            self._scanner = re.compile('|'.join(re.escape(literal) for literal in literals))
+
+    def candidates(self, text):
+        """
+        @param text The input string
+        @retval The names of the parameters which could match the text, in
+            dictionary order
+        """
+        if self._scanner is None:
+            return list(self._always)
+        found = set(self._scanner.findall(text))
+        if not found:
+            return list(self._always)
+
+        present = set()
+        for literal in found:
+            present.update(self._implied[literal])
+        for literal in found:
+            for other in self._overlapping[literal]:
+                if other not in present and other in text:
+                    present.add(other)
+
+        names = list(self._always)
+        for literal in present:
+            names.extend(self._by_literal[literal])
+        names.sort(key=self._order.get)
+        return names
+
 class ParameterDictType(BaseEnum):
     BOOL = "bool"
     INT = "int"
@@ -284,9 +388,23 @@ class RegexParameter(Parameter):
             self.regex = re.compile(pattern)
         else:
             self.regex = re.compile(pattern, regex_flags)
+        self._literal_regex = None
+        self._literal = None
             
         self.f_getval = f_getval
 
+    def literal(self):
+        """
+        Get a string which any match of the regex must contain. Subclasses
+        which override update must still only update on a match, since the
+        dictionary skips input without this string.
+        @retval The required string, or None
+        """
+        if self._literal_regex is not self.regex:
+            self._literal = required_literal(self.regex)
+            self._literal_regex = self.regex
+        return self._literal
+
     def update(self, input):
         """
         Attempt to update a parameter value. If the input string matches the
@@ -389,11 +507,14 @@ class ProtocolParameterDict(InstrumentDict):
     Protocol parameter dictionary. Manages, matches and formats device
     parameters.
     """
+    _index = None
+
     def __init__(self):
         """
         Constructor.        
         """
         self._param_dict = {}
+        self._index = None
         
     def add(self,
             name,
@@ -480,6 +601,7 @@ class ProtocolParameterDict(InstrumentDict):
                              value_description=value_description)
 
         self._param_dict[name] = val
+        self._index = None
 
     def add_parameter(self, parameter):
         """
@@ -494,6 +616,7 @@ class ProtocolParameterDict(InstrumentDict):
             raise InstrumentParameterException(
                 "Invalid Parameter added! Attempting to add: %s" % parameter)
         self._param_dict[parameter.name] = parameter
+        self._index = None
         
     def get(self, name, timestamp=None):
         """
@@ -663,6 +786,44 @@ class ProtocolParameterDict(InstrumentDict):
 
         return self._param_dict[name].description.submenu_write
 
+    def _get_index(self):
+        """
+        @retval The ParameterIndex of the parameters, built again when
+            parameters have been added
+        """
+        if self._index is None or len(self._index.names) != len(self._param_dict):
+            self._index = ParameterIndex(self._param_dict.items())
+        return self._index
+
+    def _candidates(self, input, names=None):
+        """
+        Find the parameters which could be updated from the input, skipping
+        the regex parameters whose required literal is not in the input.
+        @param input The input to update from
+        @param names The parameter names to consider, defaults to all of them
+        @retval A list of (name, parameter) tuples in the order of names, or
+            dictionary order
+        @raise KeyError on invalid parameter name
+        """
+        try:
+            text = input if isinstance(input, str) else str(input)
+        except Exception:
+            # let the parameters raise as they would have
+            hits = None
+        else:
+            hits = self._get_index().candidates(text)
+
+        if names is None:
+            if hits is None:
+                return self._param_dict.items()
+            return [(name, self._param_dict[name]) for name in hits]
+
+        items = [(name, self._param_dict[name]) for name in names]
+        if hits is None:
+            return items
+        hits = set(hits)
+        return [(name, val) for (name, val) in items if name in hits]
+
     # RAU Added
     def multi_match_update(self, input):
         """
@@ -673,7 +834,7 @@ class ProtocolParameterDict(InstrumentDict):
         """
         hit_count = 0
         multi_mode = False
-        for (name, val) in self._param_dict.iteritems():
+        for (name, val) in self._candidates(input):
             if multi_mode == True and val.description.multi_match == False:
                 continue
             if val.update(input):
@@ -694,7 +855,7 @@ class ProtocolParameterDict(InstrumentDict):
         @retval A dict with the names and values that were updated
         """
         result = {}
-        for (name, val) in self._param_dict.iteritems():
+        for (name, val) in self._candidates(input):
             update_result = val.update(input)
             if update_result:
                 result[name] = update_result 
@@ -722,13 +883,12 @@ class ProtocolParameterDict(InstrumentDict):
         elif(target_params and isinstance(target_params, list)):
             params = target_params
         elif(target_params == None):
-            params = self._param_dict.keys()
+            params = None
         else:
             raise InstrumentParameterException("invalid target_params, must be name or list")
 
-        for name in params:
+        for (name, val) in self._candidates(input, params):
             log.trace("update param dict name: %s", name)
-            val = self._param_dict[name]
             if val.update(input):
                 found = True
         return found
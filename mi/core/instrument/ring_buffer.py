@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+
+"""
+@package mi.core.instrument.ring_buffer
+@file mi/core/instrument/ring_buffer.py
+@brief A fixed capacity byte buffer which keeps the most recent data, used
+    for the line and prompt buffers of the command response protocols.
+"""
+
+__license__ = 'Apache 2.0'
+
+
+class RingBuffer(object):
+    """
+    Keep the last capacity bytes added. Adding data costs the length of the
+    data instead of copying the whole buffer, and the most recent bytes can
+    be read without reading the rest of the buffer.
+
+    written counts every byte ever added and resets counts each time the
+    buffer is cleared, so a reader can tell which data is new since it last
+    looked.
+
+    The buffer is not thread safe, callers sharing one between threads must
+    lock around it.
+    """
+    def __init__(self, capacity):
+        """
+        @param capacity The most bytes kept
+        @throws ValueError if the capacity is not positive
+        """
+        if capacity <= 0:
+            raise ValueError("ring buffer capacity must be positive, not %r" % capacity)
+        self._data = bytearray(capacity)
+        self._capacity = capacity
+        # index the next byte is written to
+        self._end = 0
+        self._length = 0
+        self.written = 0
+        self.resets = 0
+
+    @property
+    def capacity(self):
+        return self._capacity
+
+    def __len__(self):
+        return self._length
+
+    def __str__(self):
+        return self.getvalue()
+
+    def append(self, data):
+        """
+        Add data to the end of the buffer, dropping the oldest bytes when
+        the buffer is full
+        @param data The string to add, unicode is added utf-8 encoded
+        """
+        if isinstance(data, unicode):
+            data = data.encode('utf-8')
+        size = len(data)
+        if not size:
+            return
+        self.written += size
+
+        capacity = self._capacity
+        if size >= capacity:
+            self._data[:] = data[size - capacity:]
+            self._end = 0
+            self._length = capacity
+            return
+
+        end = self._end
+        first = min(size, capacity - end)
+        self._data[end:end + first] = data[:first]
+        if first < size:
+            self._data[:size - first] = data[first:]
+        self._end = (end + size) % capacity
+        self._length = min(capacity, self._length + size)
+
+    def tail(self, size):
+        """
+        @param size The number of bytes to get
+        @retval The last size bytes of the buffer as a string, or all of it
+            when it holds fewer bytes
+        """
+        size = min(size, self._length)
+        if size <= 0:
+            return ''
+        start = (self._end - size) % self._capacity
+        if start + size <= self._capacity:
+            return str(self._data[start:start + size])
+        return str(self._data[start:]) + str(self._data[:self._end])
+
+    def getvalue(self):
+        """
+        @retval The whole buffer as a string
+        """
+        return self.tail(self._length)
+
+    def clear(self):
+        """
+        Drop the contents of the buffer
+        """
+        self._end = 0
+        self._length = 0
+        self.resets += 1
+
+    def set(self, data):
+        """
+        Replace the contents of the buffer
+        @param data The new contents, only the last capacity bytes are kept
+        """
+        self.clear()
+        self.append(data)
+
+    def resize(self, capacity):
+        """
+        Change the capacity, keeping the most recent bytes which fit
+        @param capacity The most bytes kept
+        @throws ValueError if the capacity is not positive
+        """
+        if capacity <= 0:
+            raise ValueError("ring buffer capacity must be positive, not %r" % capacity)
+        data = self.tail(capacity)
+        self._data = bytearray(capacity)
+        self._capacity = capacity
+        self._end = 0
+        self._length = 0
+        written = self.written
+        self.append(data)
+        self.written = written
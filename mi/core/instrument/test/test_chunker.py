@@ -20,6 +20,9 @@ from ooi.logging import log
 
 from mi.core.exceptions import SampleException
 from mi.core.instrument.chunker import StringChunker
+from mi.core.instrument.chunker import RingBufferChunker
+from mi.core.instrument.chunker import IncrementalRegexSieve
+from mi.core.instrument.chunker import RegexSetSieve
 
 @attr('UNIT', group='mi')
 class UnitTestStringChunker(MiUnitTestCase):
@@ -331,6 +334,234 @@ class UnitTestStringChunker(MiUnitTestCase):
         self.assertRaises(SampleException,
                           self._chunker.add_chunk, "foobar", self.TIMESTAMP_1)
 
+@attr('UNIT', group='mi')
+class UnitTestRingBufferChunker(UnitTestStringChunker):
+    """
+    Run the string chunker tests against the ring buffer chunker, plus a few
+    that exercise the moving base offset.
+    """
+    def setUp(self):
+        """ Setup a chunker for use in tests """
+        self._chunker = RingBufferChunker(UnitTestStringChunker.sieve_function)
+
+    def test_compaction(self):
+        """
+        Push enough data through to force the storage to be compacted and
+        verify the indices and data stay consistent
+        """
+        self._chunker.COMPACT_THRESHOLD = 100
+        for i in range(50):
+            self._chunker.add_chunk("Foo" + self.SAMPLE_1, self.TIMESTAMP_1)
+            self._chunker.add_chunk(self.FRAGMENT_1, self.TIMESTAMP_2)
+            self._chunker.add_chunk(self.FRAGMENT_2, self.TIMESTAMP_3)
+
+            (time, result, start, end) = self._chunker.get_next_data_with_index()
+            self.assertEquals(result, self.SAMPLE_1)
+            self.assertEquals(time, self.TIMESTAMP_1)
+            self.assertEquals((start, end), (3, 34))
+
+            (time, result, start, end) = self._chunker.get_next_data_with_index()
+            self.assertEquals(result, self.FRAGMENT_SAMPLE)
+            self.assertEquals(time, self.TIMESTAMP_2)
+            self.assertEquals((start, end), (0, 31))
+
+            self.assertEquals(self._chunker.buffer, "")
+
+        self.assertTrue(len(self._chunker._buf) < 200)
+
+    def test_unconsumed_data(self):
+        """
+        Data left in the chunker is not rescanned, only the tail past the
+        last match is handed to the sieve
+        """
+        sieved = []
+        def tracking_sieve(data):
+            sieved.append(data)
+            return UnitTestStringChunker.sieve_function(data)
+
+        self._chunker = RingBufferChunker(tracking_sieve)
+        self._chunker.add_chunk(self.MULTI_SAMPLE_1, self.TIMESTAMP_1)
+        self._chunker.add_chunk(self.FRAGMENT_1, self.TIMESTAMP_2)
+        self._chunker.add_chunk(self.FRAGMENT_2, self.TIMESTAMP_3)
+
+        self.assertEquals(sieved[1], self.FRAGMENT_1)
+        self.assertEquals(sieved[2], self.FRAGMENT_SAMPLE)
+        self.assertEquals(len(self._chunker.data_chunk_list), 3)
+        self.assertEquals(self._chunker.buffer,
+                          self.MULTI_SAMPLE_1 + self.FRAGMENT_SAMPLE)
+
+@attr('UNIT', group='mi')
+class UnitTestIncrementalSieve(MiUnitTestCase):
+    """
+    Test the stateful sieve interface and the chunkers use of it
+    """
+    SAMPLE_1 = UnitTestStringChunker.SAMPLE_1
+    SAMPLE_2 = UnitTestStringChunker.SAMPLE_2
+    FRAGMENT_1 = UnitTestStringChunker.FRAGMENT_1
+    FRAGMENT_2 = UnitTestStringChunker.FRAGMENT_2
+    FRAGMENT_SAMPLE = UnitTestStringChunker.FRAGMENT_SAMPLE
+
+    TIMESTAMP_1 = UnitTestStringChunker.TIMESTAMP_1
+    TIMESTAMP_2 = UnitTestStringChunker.TIMESTAMP_2
+
+    PATTERN = r'SATPAR(?P<sernum>\d{4}),(?P<timer>\d{1,7}.\d\d),(?P<counts>\d{10}),(?P<checksum>\d{1,3})'
+
+    def setUp(self):
+        self._sieve = IncrementalRegexSieve([re.compile(self.PATTERN)],
+                                            max_frame_size=len(self.SAMPLE_1))
+
+    def test_feed(self):
+        """
+        Frames come back once, in absolute offsets, as they are completed
+        """
+        self.assertEquals(self._sieve.feed("Foo" + self.SAMPLE_1, 0), [(3, 34)])
+        self.assertEquals(self._sieve.feed(self.FRAGMENT_1, 34), [])
+        self.assertEquals(self._sieve.feed(self.FRAGMENT_2, 51), [(34, 65)])
+        self.assertEquals(self._sieve.feed("Bar", 65), [])
+        self.assertEquals(self._sieve._pending, "Bar")
+
+        # a gap in the offsets starts over
+        self.assertEquals(self._sieve.feed(self.SAMPLE_2, 100), [(100, 131)])
+
+    def test_stateless_call(self):
+        """
+        The sieve still works as a plain sieve function
+        """
+        self.assertEquals(self._sieve("Foo" + self.SAMPLE_1), [(3, 34)])
+        self.assertEquals(self._sieve._pending, "")
+
+    def test_max_frame_size(self):
+        """
+        Non-data too far back to start a frame is not kept around
+        """
+        for i in range(100):
+            self._sieve.feed("x" * 10, i * 10)
+            self.assertTrue(len(self._sieve._pending) <= len(self.SAMPLE_1))
+        self.assertEquals(self._sieve.feed(self.SAMPLE_1[:5], 1000), [])
+        self.assertEquals(self._sieve.feed(self.SAMPLE_1[5:], 1005), [(1000, 1031)])
+
+    def test_unbounded(self):
+        """
+        A sieve without a frame size bound is not fed, the chunkers call it
+        like a plain sieve function
+        """
+        sieve = IncrementalRegexSieve([re.compile(self.PATTERN)])
+        self.assertFalse(sieve.incremental)
+        self.assertRaises(SampleException, sieve.feed, self.SAMPLE_1, 0)
+        self.assertRaises(SampleException, IncrementalRegexSieve,
+                          [re.compile(self.PATTERN)], 0)
+
+        chunker = StringChunker(sieve)
+        self.assertFalse(chunker._incremental_sieve)
+        chunker.add_chunk("Foo" + self.SAMPLE_1[:5], self.TIMESTAMP_1)
+        chunker.add_chunk(self.SAMPLE_1[5:], self.TIMESTAMP_2)
+        (time, result) = chunker.get_next_data()
+        self.assertEquals(result, self.SAMPLE_1)
+
+    def _check_chunker(self, chunker):
+        chunker.add_chunk("Foo" + self.SAMPLE_1, self.TIMESTAMP_1)
+        chunker.add_chunk(self.FRAGMENT_1, self.TIMESTAMP_2)
+        (time, result) = chunker.get_next_data()
+        self.assertEquals(result, self.SAMPLE_1)
+        self.assertEquals(time, self.TIMESTAMP_1)
+        (time, result) = chunker.get_next_data()
+        self.assertEquals(result, None)
+
+        chunker.add_chunk(self.FRAGMENT_2, self.TIMESTAMP_1)
+        chunker.add_chunk("Bar", self.TIMESTAMP_1)
+        (time, result, start, end) = chunker.get_next_data_with_index()
+        self.assertEquals(result, self.FRAGMENT_SAMPLE)
+        self.assertEquals(time, self.TIMESTAMP_2)
+        self.assertEquals((start, end), (0, 31))
+        (time, result) = chunker.get_next_non_data()
+        self.assertEquals(result, "Bar")
+
+        # consumed data is never handed back as a frame
+        chunker.add_chunk(self.FRAGMENT_1, self.TIMESTAMP_1)
+        chunker.clean_all_chunks()
+        chunker.add_chunk(self.FRAGMENT_2 + self.SAMPLE_2, self.TIMESTAMP_2)
+        (time, result) = chunker.get_next_data()
+        self.assertEquals(result, self.SAMPLE_2)
+
+    def test_string_chunker(self):
+        self._check_chunker(StringChunker(self._sieve))
+
+    def test_ring_buffer_chunker(self):
+        self._check_chunker(RingBufferChunker(self._sieve))
+
+@attr('UNIT', group='mi')
+class UnitTestRegexSetSieve(MiUnitTestCase):
+    """
+    Test the single pass multi-regex sieve
+    """
+    SAMPLE_1 = UnitTestStringChunker.SAMPLE_1
+    TIMESTAMP_1 = UnitTestStringChunker.TIMESTAMP_1
+
+    STATUS = "<Status>ok</Status>"
+
+    def setUp(self):
+        self._regex_list = [re.compile(UnitTestIncrementalSieve.PATTERN),
+                            re.compile(r"<Status>(.*?)</Status>")]
+        self._sieve = RegexSetSieve(self._regex_list, ['sample', 'status'],
+                                    max_frame_size=64)
+
+    def test_non_capturing(self):
+        self.assertEquals(RegexSetSieve._non_capturing(r"(?P<a>\d+)-(x|y)[(]\("),
+                          r"(?:\d+)-(?:x|y)[(]\(")
+        self.assertEquals(RegexSetSieve._non_capturing(r"[]()](?:a)(?=b)"),
+                          r"[]()](?:a)(?=b)")
+        self.assertEquals(RegexSetSieve._non_capturing(r"(a)\1"), None)
+        self.assertEquals(RegexSetSieve._non_capturing(r"(?P<a>a)(?P=a)"), None)
+
+    def test_sieve(self):
+        """
+        One pass, ordered output tagged with the pattern id, earlier patterns
+        win where two match at the same place
+        """
+        sieve = RegexSetSieve(self._regex_list + [re.compile(r"<Status>")],
+                              ['sample', 'status', 'tag'])
+        data = "Foo%sBar%s%s<Status>" % (self.STATUS, self.SAMPLE_1, self.STATUS)
+        self.assertTrue(sieve._combined is not None)
+        self.assertEquals(sieve(data),
+                          [(3, 22, 'status'), (25, 56, 'sample'),
+                           (56, 75, 'status'), (75, 83, 'tag')])
+
+        self.assertEquals(sieve.identify(self.SAMPLE_1), 'sample')
+        self.assertEquals(sieve.identify(self.STATUS), 'status')
+        self.assertEquals(sieve.identify("<Status>"), 'tag')
+        self.assertEquals(sieve.identify("Foo"), None)
+
+    def test_fallback(self):
+        """
+        Patterns that cannot be combined still give the same output
+        """
+        regex_list = self._regex_list + [re.compile(r"(Z)\1")]
+        sieve = RegexSetSieve(regex_list)
+        self.assertEquals(sieve._combined, None)
+
+        data = "ZZ%s%s" % (self.STATUS, self.SAMPLE_1)
+        self.assertEquals(sieve(data), [(0, 2, 2), (2, 21, 1), (21, 52, 0)])
+        self.assertEquals(sieve.identify(self.STATUS), 1)
+        self.assertEquals(sieve.identify("ZZ"), 2)
+
+    def test_feed(self):
+        self.assertEquals(self._sieve.feed(self.STATUS[:10], 0), [])
+        self.assertEquals(self._sieve.feed(self.STATUS[10:], 10), [(0, 19, 'status')])
+
+    def test_chunker(self):
+        """
+        The chunkers take the tagged, ordered output as is
+        """
+        for chunker in [StringChunker(self._sieve), RingBufferChunker(self._sieve)]:
+            self._sieve.reset()
+            chunker.add_chunk("Foo" + self.STATUS[:10], self.TIMESTAMP_1)
+            chunker.add_chunk(self.STATUS[10:] + self.SAMPLE_1, self.TIMESTAMP_1)
+            (time, result) = chunker.get_next_data()
+            self.assertEquals(result, self.STATUS)
+            (time, result) = chunker.get_next_data()
+            self.assertEquals(result, self.SAMPLE_1)
+            self.assertEquals(self._sieve.identify(result), 'sample')
+
 @unittest.skip("Write this when a binary chunker is needed")
 @attr('UNIT', group='mi')
 class UnitTestBinaryChunker(MiUnitTestCase):
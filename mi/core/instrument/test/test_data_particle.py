@@ -11,7 +11,9 @@ __author__ = 'Steve Foley'
 __license__ = 'Apache 2.0'
 
 
+import sys
 import json
+import types
 import base64
 import time
 import ntplib
@@ -23,6 +25,10 @@ from mi.core.log import get_logger ; log = get_logger()
 from mi.core.exceptions import SampleException, ReadOnlyException, NotImplementedException, InstrumentParameterException
 from mi.core.instrument.data_particle import DataParticle, DataParticleKey, DataParticleValue
 from mi.core.instrument.data_particle import RawDataParticle, CommonDataParticleType
+from mi.core.instrument.data_particle import CompactDataParticle
+from mi.core.instrument.data_particle import ParticleBatch, ParticleBatchKey
+from mi.core.instrument.data_particle import JsonEncoderType, JSON_ENCODER_PREFERENCE
+from mi.core.instrument.data_particle import set_json_encoder, get_json_encoder, encode_json
 from mi.core.instrument.port_agent_client import PortAgentPacket
 
 TEST_PARTICLE_VERSION = 1
@@ -55,6 +61,22 @@ class TestUnitDataParticle(MiUnitTestCase):
                        DataParticleKey.VALUE: "305.16"}]
             return result
 
+    class CompactTestDataParticle(CompactDataParticle):
+        """
+        The same test particle as a compact particle
+        """
+        __slots__ = ()
+        _data_particle_type = TEST_PARTICLE_TYPE
+
+        def _build_parsed_values(self):
+            result = [{DataParticleKey.VALUE_ID: "temp",
+                       DataParticleKey.VALUE: "23.45"},
+                      {DataParticleKey.VALUE_ID: "cond",
+                       DataParticleKey.VALUE: "15.9"},
+                      {DataParticleKey.VALUE_ID: "depth",
+                       DataParticleKey.VALUE: "305.16"}]
+            return result
+
     class BadDataParticle(DataParticle):
          """
          Define a data particle that doesn't initialize _data_particle_type.
@@ -272,6 +294,212 @@ class TestUnitDataParticle(MiUnitTestCase):
         self.assertRaises(NotImplementedException, test_particle.get_value,
                           "bad_key")
 
+    def test_generate_cached(self):
+        """
+        Test that a particle is only parsed and encoded once, and that changing
+        the internal timestamp is reflected in the next generate
+        """
+        calls = []
+        class CountingDataParticle(self.TestDataParticle):
+            def _build_parsed_values(self):
+                calls.append(1)
+                return super(CountingDataParticle, self)._build_parsed_values()
+
+        test_particle = CountingDataParticle(self.sample_raw_data,
+            preferred_timestamp=DataParticleKey.PORT_TIMESTAMP,
+            internal_timestamp=self.sample_internal_timestamp)
+
+        first = test_particle.generate()
+        self.assertIs(test_particle.generate(), first)
+        test_particle.generate_dict()
+        self.assertEquals(len(calls), 1)
+
+        new_time = self.sample_internal_timestamp + 200
+        test_particle.set_value(DataParticleKey.INTERNAL_TIMESTAMP, new_time)
+        decoded = json.loads(test_particle.generate())
+        self.assertEquals(decoded[DataParticleKey.INTERNAL_TIMESTAMP], new_time)
+
+        test_particle.set_internal_timestamp(self.sample_internal_timestamp)
+        decoded = json.loads(test_particle.generate())
+        self.assertEquals(decoded[DataParticleKey.INTERNAL_TIMESTAMP],
+                          self.sample_internal_timestamp)
+        self.assertEquals(len(calls), 1)
+
+        # the returned dict can be modified without touching the cache
+        result = test_particle.generate_dict()
+        result[DataParticleKey.VALUES].pop()
+        self.assertEquals(len(test_particle.generate_dict()[DataParticleKey.VALUES]), 3)
+
+    def test_compact_generate(self):
+        """
+        Test that a compact particle generates the same particle as a regular
+        one, without a per-instance dict
+        """
+        particle = self.CompactTestDataParticle(self.sample_raw_data,
+                                    port_timestamp=self.sample_port_timestamp,
+                                    quality_flag=DataParticleValue.INVALID,
+                                    preferred_timestamp=DataParticleKey.DRIVER_TIMESTAMP,
+                                    driver_timestamp=self.sample_driver_timestamp)
+        self.assertFalse(hasattr(particle, '__dict__'))
+        self.assertIsNone(particle._json_cache)
+
+        self.sample_parsed_particle[DataParticleKey.DRIVER_TIMESTAMP] = self.sample_driver_timestamp
+        standard = json.dumps(self.sample_parsed_particle, sort_keys=True)
+        self.assertEqual(particle.generate(sorted=True), standard)
+        self.assertEqual(particle.get_encoding_errors(), ())
+        # only the JSON is kept, not the parsed values
+        self.assertFalse(hasattr(particle, '_values'))
+        self.assertEqual(particle._json_cache.keys(), [True])
+
+        self.assertIsNone(particle.get_value(DataParticleKey.INTERNAL_TIMESTAMP))
+        particle.set_internal_timestamp(self.sample_internal_timestamp)
+        self.assertEquals(particle.get_value(DataParticleKey.INTERNAL_TIMESTAMP),
+                          self.sample_internal_timestamp)
+        decoded = json.loads(particle.generate())
+        self.assertEquals(decoded[DataParticleKey.INTERNAL_TIMESTAMP],
+                          self.sample_internal_timestamp)
+
+        self.assertRaises(ReadOnlyException, particle.set_value,
+                          DataParticleKey.PKT_VERSION, 2)
+
+        particle = self.CompactTestDataParticle(self.sample_raw_data, new_sequence=True)
+        self.assertTrue(particle.generate_dict()[DataParticleKey.NEW_SEQUENCE])
+
+    def test_values_set_header(self):
+        """
+        Test header fields set while the values are built, as driver
+        particles do with their internal timestamp and stream name, are in
+        the first particle generated
+        """
+        for base in (self.TestDataParticle, self.CompactTestDataParticle):
+            class HeaderSettingParticle(base):
+                __slots__ = ()
+                _data_particle_type = None
+                def _build_parsed_values(self):
+                    self.set_internal_timestamp(unix_time=1000.0)
+                    self.__class__._data_particle_type = 'set_while_building'
+                    return super(HeaderSettingParticle, self)._build_parsed_values()
+
+            particle = HeaderSettingParticle(self.sample_raw_data,
+                                             port_timestamp=self.sample_port_timestamp,
+                                             preferred_timestamp=DataParticleKey.INTERNAL_TIMESTAMP)
+            decoded = json.loads(particle.generate())
+            self.assertEquals(decoded[DataParticleKey.STREAM_NAME], 'set_while_building')
+            self.assertEquals(decoded[DataParticleKey.INTERNAL_TIMESTAMP],
+                              ntplib.system_to_ntp_time(1000.0))
+            self.assertEquals(len(decoded[DataParticleKey.VALUES]), 3)
+            self.assertEquals(particle._json_cache.keys(), [False])
+
+    def test_json_encoder(self):
+        """
+        Test selecting the JSON encoder used to generate particles
+        """
+        active = get_json_encoder()
+        self.assertTrue(JsonEncoderType.has(active))
+        try:
+            self.assertEqual(set_json_encoder(JsonEncoderType.JSON), JsonEncoderType.JSON)
+            self.assertEqual(get_json_encoder(), JsonEncoderType.JSON)
+            self.assertEqual(json.loads(self.parsed_test_particle.generate()),
+                             self.parsed_test_particle.generate_dict())
+
+            with self.assertRaises(InstrumentParameterException):
+                set_json_encoder("bogus")
+            self.assertEqual(get_json_encoder(), JsonEncoderType.JSON)
+
+            # the fastest installed encoder, stdlib json at worst
+            self.assertIn(set_json_encoder(), JSON_ENCODER_PREFERENCE)
+            self.assertEqual(encode_json({'b': 1, 'a': 2}, sorted=True), '{"a": 2, "b": 1}')
+        finally:
+            set_json_encoder(active)
+
+    def test_ujson_encoder(self):
+        """
+        Test ujson is only used when it writes the same values as the stdlib
+        encoder, and that values it refuses fall back to the stdlib encoder
+        """
+        def exact_dumps(obj, double_precision=10):
+            if obj != obj or obj in (float('inf'), float('-inf')):
+                raise OverflowError("Invalid Nan value when encoding double")
+            if isinstance(obj, list):
+                return "[%s]" % ",".join([exact_dumps(v, double_precision) for v in obj])
+            return json.dumps(obj)
+
+        def decimal_places_dumps(obj, double_precision=10):
+            # older ujson releases count decimal places, not digits
+            if isinstance(obj, list):
+                return "[%s]" % ",".join([decimal_places_dumps(v, double_precision) for v in obj])
+            if isinstance(obj, float):
+                return json.dumps(round(obj, double_precision))
+            return json.dumps(obj)
+
+        ujson = types.ModuleType('ujson')
+        active = get_json_encoder()
+        saved = sys.modules.get('ujson')
+        sys.modules['ujson'] = ujson
+        try:
+            ujson.dumps = exact_dumps
+            self.assertEqual(set_json_encoder(), JsonEncoderType.UJSON)
+            self.assertEqual(encode_json([1.5, 2e-9]), "[1.5,2e-09]")
+            self.assertEqual(encode_json([float('nan')]), json.dumps([float('nan')]))
+            self.assertEqual(json.loads(self.parsed_test_particle.generate()),
+                             self.parsed_test_particle.generate_dict())
+
+            ujson.dumps = decimal_places_dumps
+            self.assertIn(set_json_encoder(), [JsonEncoderType.SIMPLEJSON,
+                                               JsonEncoderType.JSON])
+            with self.assertRaises(InstrumentParameterException):
+                set_json_encoder(JsonEncoderType.UJSON)
+        finally:
+            if saved is None:
+                del sys.modules['ujson']
+            else:
+                sys.modules['ujson'] = saved
+            set_json_encoder(active)
+
+    def test_particle_batch(self):
+        """
+        Test that a batch of particles generates one columnar message with
+        shared headers sent once, and that it expands back to the same
+        per-particle dicts
+        """
+        particles = []
+        for i in range(3):
+            particles.append(self.CompactTestDataParticle(self.sample_raw_data,
+                                    internal_timestamp=self.sample_internal_timestamp + i,
+                                    preferred_timestamp=DataParticleKey.INTERNAL_TIMESTAMP,
+                                    driver_timestamp=self.sample_driver_timestamp))
+        particles.append(self.raw_test_particle)
+
+        batches = ParticleBatch.from_particles(particles)
+        self.assertEqual(len(batches), 2)
+        batch = batches[0]
+        self.assertEqual(len(batch), 3)
+        self.assertEqual(batch.data_particle_type(), TEST_PARTICLE_TYPE)
+        self.assertEqual(batch.get_encoding_errors(), [])
+
+        result = json.loads(batch.generate())
+        self.assertEqual(result[DataParticleKey.PKT_FORMAT_ID], DataParticleValue.JSON_BATCH)
+        self.assertEqual(result[ParticleBatchKey.COUNT], 3)
+        self.assertEqual(result[DataParticleKey.DRIVER_TIMESTAMP], self.sample_driver_timestamp)
+        self.assertEqual(result[ParticleBatchKey.HEADERS],
+                         {DataParticleKey.INTERNAL_TIMESTAMP:
+                          [self.sample_internal_timestamp + i for i in range(3)]})
+        self.assertEqual(result[ParticleBatchKey.VALUE_IDS], ["temp", "cond", "depth"])
+        self.assertEqual(result[DataParticleKey.VALUES][0], ["23.45"] * 3)
+
+        self.assertEqual(ParticleBatch.expand_dict(result),
+                         json.loads(json.dumps(batch.expand())))
+
+        # binary flags and optional headers survive the round trip
+        raw_batch = batches[1]
+        self.assertEqual(ParticleBatch.expand_dict(raw_batch.generate_dict()),
+                         raw_batch.expand())
+
+        with self.assertRaises(SampleException):
+            batch.add(self.raw_test_particle)
+        with self.assertRaises(NotImplementedException):
+            ParticleBatch().generate()
+
     def test_data_particle_type(self):
         """
         Test that the Data particle will raise an exception if the data particle type
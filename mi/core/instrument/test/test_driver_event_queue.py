@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+
+"""
+@package mi.core.instrument.test.test_driver_event_queue
+@file mi/core/instrument/test/test_driver_event_queue.py
+@brief Unit tests for the driver process event queue
+"""
+
+__license__ = 'Apache 2.0'
+
+import time
+import threading
+
+from nose.plugins.attrib import attr
+from mi.core.unit_test import MiUnitTestCase
+
+from mi.core.exceptions import InstrumentException
+from mi.core.instrument.instrument_driver import DriverAsyncEvent
+from mi.core.instrument.driver_event_queue import DriverEventQueue, EventPolicy
+
+def event(type, value=None):
+    return {'type': type, 'value': value, 'time': time.time()}
+
+def values(batch):
+    return [(evt['type'], evt['value']) for evt in batch]
+
+SAMPLE = DriverAsyncEvent.SAMPLE
+STATE = DriverAsyncEvent.STATE_CHANGE
+CONFIG = DriverAsyncEvent.CONFIG_CHANGE
+
+@attr('UNIT', group='mi')
+class TestDriverEventQueue(MiUnitTestCase):
+    """
+    Test the queue order, batching and backpressure policies
+    """
+    def test_batches(self):
+        """
+        Test events come out in order, in batches of at most max_events
+        """
+        queue = DriverEventQueue()
+        error = InstrumentException('bad')
+        queue.extend([event(SAMPLE, i) for i in range(5)])
+        queue.put(error)
+        queue.put(None)
+        queue.put({})
+        self.assertEqual(len(queue), 6)
+
+        self.assertEqual(values(queue.get_batch(4)), [(SAMPLE, i) for i in range(4)])
+        batch = queue.get_batch(4)
+        self.assertEqual(values(batch[:1]), [(SAMPLE, 4)])
+        self.assertIs(batch[1], error)
+        self.assertEqual(len(queue), 0)
+        self.assertEqual(queue.get_batch(4, timeout=.01), [])
+
+    def test_drop_samples(self):
+        """
+        Test the oldest samples are dropped above the high water mark and
+        other events are kept
+        """
+        queue = DriverEventQueue(high_water_mark=3)
+        queue.put(event(SAMPLE, 1))
+        queue.put(event(STATE, 'A'))
+        queue.put(event(SAMPLE, 2))
+        queue.put(event(SAMPLE, 3))
+        queue.put(event(STATE, 'B'))
+        queue.put(event(SAMPLE, 4))
+        self.assertEqual(queue.dropped, 2)
+        self.assertEqual(values(queue.get_batch(10)),
+                         [(STATE, 'A'), (SAMPLE, 3), (STATE, 'B'), (SAMPLE, 4)])
+
+        # a sample is dropped when only kept events are queued
+        queue.extend([event(STATE, i) for i in range(3)])
+        queue.put(event(SAMPLE, 5))
+        self.assertEqual(queue.dropped, 3)
+        self.assertEqual(values(queue.get_batch(10)), [(STATE, 0), (STATE, 1), (STATE, 2)])
+
+        # sent samples are not dropped again
+        queue.put(event(SAMPLE, 6))
+        self.assertEqual(values(queue.get_batch(10)), [(SAMPLE, 6)])
+        queue.extend([event(SAMPLE, i) for i in range(7, 11)])
+        self.assertEqual(values(queue.get_batch(10)), [(SAMPLE, 8), (SAMPLE, 9), (SAMPLE, 10)])
+
+    def test_coalesce(self):
+        """
+        Test only the latest unsent config change is kept
+        """
+        queue = DriverEventQueue(policies={STATE: EventPolicy.COALESCE})
+        queue.put(event(CONFIG, 1))
+        queue.put(event(SAMPLE, 1))
+        queue.put(event(CONFIG, 2))
+        queue.put(event(STATE, 'A'))
+        queue.put(event(STATE, 'B'))
+        self.assertEqual(len(queue), 3)
+        self.assertEqual(values(queue.get_batch(2)), [(SAMPLE, 1), (CONFIG, 2)])
+
+        # a sent config change is not replaced
+        queue.put(event(CONFIG, 3))
+        self.assertEqual(values(queue.get_batch(10)), [(STATE, 'B'), (CONFIG, 3)])
+
+        self.assertRaises(ValueError, DriverEventQueue, 0)
+
+    def test_bounded(self):
+        """
+        Test the queue stays bounded when nothing is read
+        """
+        queue = DriverEventQueue(high_water_mark=100)
+        for i in range(10000):
+            queue.put(event(SAMPLE, i))
+            queue.put(event(CONFIG, i))
+        self.assertEqual(len(queue), 100)
+        self.assertTrue(len(queue._queue) <= 2 * 100 + 1)
+        self.assertEqual(queue.dropped, 9901)
+        batch = queue.get_batch(1000)
+        self.assertEqual(values(batch[:2]), [(SAMPLE, 9901), (SAMPLE, 9902)])
+        self.assertEqual(values(batch[-2:]), [(SAMPLE, 9999), (CONFIG, 9999)])
+
+    def test_wakeup(self):
+        """
+        Test a waiting sender gets an event as soon as it is queued
+        """
+        queue = DriverEventQueue()
+        def put():
+            time.sleep(.2)
+            queue.put(event(STATE, 'A'))
+        thread = threading.Thread(target=put)
+        thread.start()
+        start = time.time()
+        batch = queue.get_batch(10, timeout=5)
+        thread.join()
+        self.assertEqual(values(batch), [(STATE, 'A')])
+        self.assertTrue(time.time() - start < 1)
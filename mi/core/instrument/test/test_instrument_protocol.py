@@ -14,6 +14,7 @@ import re
 import time
 import ntplib
 import datetime
+import threading
 from mock import Mock
 from nose.plugins.attrib import attr
 from mi.core.log import get_logger ; log = get_logger()
@@ -22,6 +23,9 @@ from mi.core.instrument.instrument_driver import DriverParameter
 from mi.core.instrument.instrument_protocol import InstrumentProtocol
 from mi.core.instrument.instrument_protocol import MenuInstrumentProtocol
 from mi.core.instrument.instrument_protocol import CommandResponseInstrumentProtocol
+from mi.core.instrument.instrument_protocol import PromptMatcher
+from mi.core.instrument.instrument_protocol import MAX_BUFFER_SIZE
+from mi.core.instrument.ring_buffer import RingBuffer
 from mi.core.instrument.protocol_param_dict import ParameterDictVisibility
 from mi.core.instrument.instrument_driver import ConfigMetadataKey
 from mi.instrument.satlantic.par_ser_600m.driver import SAMPLE_REGEX
@@ -608,6 +612,65 @@ class TestUnitCommandInstrumentProtocol(MiUnitTestCase):
                           self.protocol._do_cmd_resp,
                           self.TestEvent.TEST, expected_prompt=">", response_regex=regex1)
 
+    def test_response_wakeup(self):
+        """
+        Test a waiting _get_response returns as soon as the prompt arrives,
+        including a prompt split across two additions to the buffer.
+        """
+        def send(*chunks):
+            for chunk in chunks:
+                time.sleep(.3)
+                self.protocol.add_to_buffer(chunk)
+
+        self.protocol._promptbuf = ''
+        self.protocol._linebuf = ''
+        thread = threading.Thread(target=send, args=("response -", "->"))
+        thread.start()
+        result = self.protocol._get_response(timeout=5, expected_prompt="-->")
+        # the old 0.1s sleep between searches could return up to 0.1s late
+        received = time.time()
+        thread.join()
+        self.assertEqual(result, ("-->", "response -->"))
+        self.assertTrue(time.time() - received < .05)
+
+        # the raw response checks every prompt at each wakeup
+        self.protocol._promptbuf = ''
+        self.protocol._linebuf = ''
+        thread = threading.Thread(target=send, args=("raw > ",))
+        thread.start()
+        start = time.time()
+        result = self.protocol._get_raw_response(timeout=5, expected_prompt=["#", ">"])
+        thread.join()
+        self.assertEqual(result, (">", "raw > "))
+        self.assertTrue(time.time() - start < .4)
+
+    def test_prompt_matcher(self):
+        """
+        Test only new data is searched, in prompt order, and the buffer is
+        searched again after it is replaced.
+        """
+        ring = RingBuffer(MAX_BUFFER_SIZE)
+        matcher = PromptMatcher(["-->", ">"])
+        ring.append("abc")
+        self.assertEqual(matcher.search_buffer(ring), None)
+        ring.append(" -")
+        self.assertEqual(matcher.search_buffer(ring), None)
+        ring.append("->")
+        self.assertEqual(matcher.search_buffer(ring), ("-->", 4))
+        ring.set("x > y -->")
+        self.assertEqual(matcher.search_buffer(ring), ("-->", 6))
+
+        ring = RingBuffer(MAX_BUFFER_SIZE)
+        matcher = PromptMatcher(["-->", ">"])
+        ring.append("a > b")
+        self.assertEqual(matcher.search_buffer(ring), (">", 2))
+        # the old data is not searched again
+        ring.append(" c")
+        self.assertEqual(matcher.search_buffer(ring), None)
+        ring.set("a > b c")
+        self.assertEqual(matcher.search_buffer(ring), (">", 2))
+        self.assertEqual(PromptMatcher([]).search_buffer(ring), None)
+
 
 @attr('UNIT', group='mi')
 class TestUnitMenuInstrumentProtocol(MiUnitTestCase):
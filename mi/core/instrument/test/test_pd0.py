@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+
+"""
+@package mi.core.instrument.test.test_pd0
+@file mi/core/instrument/test/test_pd0.py
+@brief Unit tests for the PD0 ensemble decoding
+"""
+
+__license__ = 'Apache 2.0'
+
+import struct
+
+from nose.plugins.attrib import attr
+from mi.core.unit_test import MiUnitTestCase
+
+from mi.core.exceptions import SampleException
+from mi.core.instrument.pd0 import Pd0Record, Pd0Ensemble, Pd0DataTypeId, PD0_HEADER
+from mi.core.instrument.pd0 import decode_cell_array
+
+def build_ensemble(data_types):
+    """
+    Build a PD0 ensemble with a valid checksum from a list of data types
+    """
+    num_types = len(data_types)
+    offsets = []
+    position = 6 + 2 * num_types
+    for data_type in data_types:
+        offsets.append(position)
+        position += len(data_type)
+    body = struct.pack('<BBHBB', 0x7f, 0x7f, position, 0, num_types) + \
+        struct.pack('<%dH' % num_types, *offsets) + ''.join(data_types)
+    return body + struct.pack('<H', sum(bytearray(body)) & 65535)
+
+@attr('UNIT', group='mi')
+class UnitTestPd0(MiUnitTestCase):
+    """
+    Compare the numpy cell array decoding against unpacking cell by cell
+    """
+    @staticmethod
+    def unpack_cells(chunk, cell_format, num_cells):
+        beams = [[], [], [], []]
+        cell_size = struct.calcsize(cell_format)
+        for cell in range(num_cells):
+            values = struct.unpack(cell_format, chunk[2 + cell * cell_size:2 + (cell + 1) * cell_size])
+            for beam in range(4):
+                beams[beam].append(values[beam])
+        return beams
+
+    def test_velocity(self):
+        """
+        Test signed little endian and unsigned big endian 2 byte values
+        """
+        values = [0, 1, -1, 32767, -32768, -12345, 2000, -2000] * 5
+        chunk = '\x00\x01' + struct.pack('<%dh' % len(values), *values)
+
+        beams = decode_cell_array(chunk, '<i2')
+        self.assertEqual(beams, self.unpack_cells(chunk, '<hhhh', 10))
+        self.assertEqual(beams[1][:2], [1, -12345])
+        self.assertTrue(all(type(value) is int for value in beams[3]))
+
+        self.assertEqual(decode_cell_array(chunk, '>u2', 9),
+                         self.unpack_cells(chunk, '!HHHH', 9))
+
+    def test_bytes(self):
+        """
+        Test the 1 byte correlation, echo intensity and percent good values
+        """
+        chunk = '\x00\x02' + ''.join(chr(i % 256) for i in range(4 * 30))
+        self.assertEqual(decode_cell_array(chunk, 'u1'), self.unpack_cells(chunk, '<BBBB', 30))
+
+    def test_partial(self):
+        """
+        Test an incomplete trailing cell is ignored, and empty arrays
+        """
+        chunk = '\x00\x03' + ''.join(chr(i) for i in range(10))
+        self.assertEqual(decode_cell_array(chunk, 'u1'), [[0, 4], [1, 5], [2, 6], [3, 7]])
+        self.assertEqual(decode_cell_array(chunk, 'u1', 0), [[], [], [], []])
+        self.assertEqual(decode_cell_array('\x00\x03', '<i2'), [[], [], [], []])
+        self.assertEqual(decode_cell_array('\x00\x03', '>u2', -1), [[], [], [], []])
+
+
+@attr('UNIT', group='mi')
+class UnitTestPd0Ensemble(MiUnitTestCase):
+    """
+    Test the ensemble header, offset table and record layouts
+    """
+    def setUp(self):
+        self.record = Pd0Record('TestLeader', '<HhB', ('leader_id', 'value', 'flag'))
+        self.data_types = [struct.pack('<HhB', Pd0DataTypeId.VARIABLE_LEADER, -5, 3),
+                           struct.pack('<H8h', Pd0DataTypeId.VELOCITY, *range(8))]
+        self.raw_data = build_ensemble(self.data_types)
+
+    def test_record(self):
+        """
+        Test unpacking a record into a named view
+        """
+        view = self.record.unpack(struct.pack('<xHhB', 128, -5, 3), 1)
+        self.assertEqual(view.leader_id, 128)
+        self.assertEqual(view.value, -5)
+        self.assertEqual(view.flag, 3)
+        (leader_id, value, flag) = view
+        self.assertEqual(leader_id, 128)
+        self.assertEqual(self.record.size, 5)
+
+        self.assertRaises(SampleException, self.record.unpack, '\x00\x00')
+        self.assertRaises(ValueError, Pd0Record, 'Bad', '<HH', ('one',))
+
+    def test_ensemble(self):
+        """
+        Test locating and decoding the data types in an ensemble
+        """
+        ensemble = Pd0Ensemble(self.raw_data)
+        self.assertEqual(ensemble.header.header_id, 0x7f)
+        self.assertEqual(ensemble.header.num_data_types, 2)
+        self.assertEqual(ensemble.length, len(self.raw_data) - 2)
+        self.assertEqual(ensemble.offsets, [10, 15])
+        self.assertEqual(len(ensemble), 2)
+        self.assertEqual(ensemble.verify_checksum(), sum(bytearray(self.raw_data[:-2])) & 65535)
+
+        self.assertEqual(ensemble.data_type_id(0), Pd0DataTypeId.VARIABLE_LEADER)
+        self.assertEqual(ensemble.data_type_id(1), Pd0DataTypeId.VELOCITY)
+        self.assertEqual(ensemble.record(0, self.record).value, -5)
+        self.assertEqual(ensemble.chunk(0), self.data_types[0])
+        self.assertEqual(ensemble.chunk(1), self.data_types[1])
+        self.assertEqual(ensemble.chunk(1, size=6), self.data_types[1][:6])
+        self.assertEqual(ensemble.chunk(1, end=ensemble.length - 2), self.data_types[1][:-2])
+        self.assertEqual(decode_cell_array(ensemble.chunk(1), '<i2'),
+                         [[0, 4], [1, 5], [2, 6], [3, 7]])
+
+        # header byte order can be overridden
+        header = Pd0Record('BigEndianHeader', '!BBHBB', PD0_HEADER.view._fields)
+        self.assertEqual(Pd0Ensemble(self.raw_data, header).header.num_bytes,
+                         struct.unpack('>H', self.raw_data[2:4])[0])
+
+    def test_bad_ensemble(self):
+        """
+        Test bad checksums and truncated ensembles are rejected
+        """
+        bad_checksum = self.raw_data[:-1] + chr((ord(self.raw_data[-1]) + 1) % 256)
+        self.assertRaises(SampleException, Pd0Ensemble(bad_checksum).verify_checksum)
+        self.assertRaises(SampleException, Pd0Ensemble(self.raw_data[:-3]).verify_checksum)
+        self.assertRaises(SampleException, Pd0Ensemble, self.raw_data[:7])
+        self.assertRaises(SampleException, Pd0Ensemble, self.raw_data[:4])
@@ -18,6 +18,7 @@ import logging
 import unittest
 import re
 import time
+import socket
 import datetime
 import array
 import struct
@@ -40,6 +41,7 @@ from mi.idk.unit_test import InstrumentDriverIntegrationTestCase
 
 from mi.core.instrument.port_agent_client import PortAgentClient, PortAgentPacket, Listener
 from mi.core.instrument.port_agent_client import HEADER_SIZE
+from mi.core.instrument.port_agent_client import PortAgentPacketBuffer, SocketClosed
 from mi.core.instrument.instrument_driver import DriverConnectionState
 from mi.core.instrument.instrument_driver import DriverProtocolState
 
@@ -250,6 +252,44 @@ class PAClientUnitTestCase(InstrumentDriverUnitTestCase):
         self.assertTrue(self.errorCallbackCalled)
         self.assertFalse(self.listenerCallbackCalled)
 
+    def test_event_driven_listener(self):
+        """
+        Run an event driven Listener over a socket pair: packets are handled
+        as they arrive, missed heartbeats are detected without a timer thread
+        and done() wakes the listener up right away.
+        """
+        self.resetTestVars()
+        (sender, receiver) = socket.socketpair()
+        receiver.setblocking(0)
+        test_heartbeat = 1
+        test_max_missed_heartbeats = 2
+        paListener = Listener(receiver, 1, None, test_heartbeat, test_max_missed_heartbeats,
+                              self.myGotData, self.myGotRaw, self.myGotListenerError, None, self.myGotError,
+                              event_driven=True)
+        paListener.start()
+
+        data = "event driven"
+        sender.sendall(struct.pack('>BBBBHHII', 0xa3, 0x9d, 0x7a, PortAgentPacket.DATA_FROM_INSTRUMENT,
+                                   len(data) + HEADER_SIZE, 0, 0, 0) + data)
+        gevent.sleep(.5)
+        self.assertTrue(self.rawCallbackCalled)
+        self.assertTrue(self.dataCallbackCalled)
+        self.assertIsNone(paListener.heartbeat_timer)
+        self.assertFalse(self.errorCallbackCalled)
+
+        gevent.sleep((test_max_missed_heartbeats * paListener.heartbeat) + 1)
+        self.assertTrue(self.errorCallbackCalled)
+        self.assertFalse(self.listenerCallbackCalled)
+
+        paListener.done()
+        paListener.join(1)
+        self.assertFalse(paListener.is_alive())
+        # the wake pipe is closed, and a late done() does not write to it
+        self.assertIsNone(paListener._wake_fds)
+        paListener.done()
+        sender.close()
+        receiver.close()
+
     def test_set_heartbeat(self):
         """
         Test the set_heart_beat function; make sure it returns False when 
@@ -420,6 +460,38 @@ class PAClientTestPortAgentPacket(MiUnitTest):
         #self.assertEqual(got_timestamp, 1105890970.110589)
         self.assertEqual(self.pap.get_header_recv_checksum(), 3729) 
 
+    def test_packet_buffer(self):
+        """
+        Test splitting packets out of a receive buffer, with packets split
+        across reads and larger than the buffer
+        """
+        def build_packet(data):
+            return struct.pack('>BBBBHHII', 0xa3, 0x9d, 0x7a, PortAgentPacket.DATA_FROM_INSTRUMENT,
+                               len(data) + HEADER_SIZE, 0, 0, 0) + data
+
+        expected = ['sample %d' % i for i in range(20)] + ['x' * 200]
+        stream = ''.join([build_packet(data) for data in expected])
+
+        (sender, receiver) = socket.socketpair()
+        packet_buffer = PortAgentPacketBuffer(64)
+        packets = []
+        for index in range(0, len(stream), 37):
+            sender.sendall(stream[index:index + 37])
+            packet_buffer.recv_from(receiver)
+            packet = packet_buffer.next_packet()
+            while packet:
+                packets.append(packet)
+                packet = packet_buffer.next_packet()
+
+        self.assertIsInstance(packets[0].get_data_view(), memoryview)
+        self.assertEqual([packet.get_data() for packet in packets], expected)
+        self.assertEqual(packets[0].get_header_type(), PortAgentPacket.DATA_FROM_INSTRUMENT)
+        self.assertEqual(packets[-1].get_data_length(), 200)
+
+        sender.close()
+        self.assertRaises(SocketClosed, packet_buffer.recv_from, receiver)
+        receiver.close()
+
 @attr('INT', group='mi')
 class PAClientIntTestCase(InstrumentDriverTestCase):
     def initialize(cls, *args, **kwargs):
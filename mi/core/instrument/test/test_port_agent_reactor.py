@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+
+"""
+@package mi.core.instrument.test.test_port_agent_reactor
+@file mi/core/instrument/test/test_port_agent_reactor.py
+@brief Unit tests for the shared port agent reactor
+"""
+
+__license__ = 'Apache 2.0'
+
+import time
+import socket
+import struct
+import threading
+
+from nose.plugins.attrib import attr
+from mi.core.unit_test import MiUnitTestCase
+
+from mi.core.instrument.port_agent_client import Listener, PortAgentPacket, HEADER_SIZE
+from mi.core.instrument.port_agent_reactor import PortAgentReactor
+
+def build_packet(data, packet_type=PortAgentPacket.DATA_FROM_INSTRUMENT):
+    return struct.pack('>BBBBHHII', 0xa3, 0x9d, 0x7a, packet_type,
+                       len(data) + HEADER_SIZE, 0, 0, 0) + data
+
+@attr('UNIT', group='mi')
+class UnitTestPortAgentReactor(MiUnitTestCase):
+    """
+    Drive several listeners over socket pairs from one reactor
+    """
+    def setUp(self):
+        self.reactor = PortAgentReactor()
+        self.reactor.start()
+        self.data = {}
+        self.errors = []
+        self.pairs = []
+
+    def tearDown(self):
+        self.reactor.stop()
+        self.reactor.join(1)
+        for (sender, receiver, listener) in self.pairs:
+            sender.close()
+            receiver.close()
+
+    def add_listener(self, index, heartbeat=0, recovery_attempt=1, recover=None):
+        (sender, receiver) = socket.socketpair()
+        receiver.setblocking(0)
+        self.data.setdefault(index, [])
+        listener = Listener(receiver, recovery_attempt, None, heartbeat, 2,
+                            lambda packet: self.data[index].append(packet.get_data()),
+                            lambda packet: None, None, recover, self.errors.append,
+                            event_driven=True)
+        self.reactor.add_listener(listener)
+        self.pairs.append((sender, receiver, listener))
+        return (sender, listener)
+
+    def test_dispatch(self):
+        """
+        Test that packets from every connection reach their own listener,
+        and that closed or removed connections are dropped
+        """
+        for index in range(5):
+            self.add_listener(index)
+
+        for (index, (sender, receiver, listener)) in enumerate(self.pairs):
+            sender.sendall(build_packet('sample %d' % index) + build_packet('x' * index))
+        time.sleep(.2)
+
+        for index in range(5):
+            self.assertEqual(self.data[index], ['sample %d' % index, 'x' * index])
+        self.assertEqual(self.reactor.listener_count(), 5)
+
+        self.pairs[1][0].close()
+        time.sleep(.2)
+        self.assertEqual(len(self.errors), 1)
+        self.assertTrue(self.pairs[1][2].is_done())
+        self.assertEqual(self.reactor.listener_count(), 4)
+
+        self.reactor.remove_listener(self.pairs[2][2])
+        time.sleep(.2)
+        self.assertEqual(self.reactor.listener_count(), 3)
+
+    def test_heartbeat(self):
+        """
+        Test that heartbeats keep a connection alive and missing ones are
+        reported, without a timer thread
+        """
+        (sender, listener) = self.add_listener(0, heartbeat=1)
+        self.assertIsNone(listener.heartbeat_timer)
+
+        for count in range(3):
+            time.sleep(1)
+            sender.sendall(build_packet('', PortAgentPacket.HEARTBEAT))
+        self.assertEqual(self.errors, [])
+
+        time.sleep((2 * listener.heartbeat) + 1)
+        self.assertEqual(len(self.errors), 1)
+        self.assertIsNone(listener.heartbeat_timer)
+
+    def test_recovery(self):
+        """
+        Test that a slow recovery runs off the reactor thread, so the other
+        connections keep getting data and heartbeats, and that the
+        recovered connection is read again
+        """
+        recovering = threading.Event()
+        recovered = []
+        def recover(error_string):
+            recovered.append(threading.current_thread().name)
+            recovering.wait(5)
+            # reconnect the way PortAgentClient._init_comms does
+            (sender, listener) = self.add_listener(0)
+            sender.sendall(build_packet('reconnected'))
+            return True
+
+        (sender, failing) = self.add_listener(0, recovery_attempt=0, recover=recover)
+        (other, listener) = self.add_listener(1, heartbeat=1)
+        time.sleep(.2)
+
+        sender.close()
+        for count in range(3):
+            time.sleep(1)
+            other.sendall(build_packet('sample %d' % count) +
+                          build_packet('', PortAgentPacket.HEARTBEAT))
+        time.sleep(.2)
+        self.assertEqual(len(recovered), 1)
+        self.assertNotEqual(recovered[0], self.reactor.name)
+        self.assertEqual(self.data[1], ['sample 0', 'sample 1', 'sample 2'])
+        self.assertEqual(self.errors, [])
+        self.assertTrue(failing.is_done())
+        self.assertEqual(self.reactor.listener_count(), 1)
+
+        recovering.set()
+        time.sleep(.2)
+        self.assertEqual(self.data[0], ['reconnected'])
+        self.assertEqual(self.reactor.listener_count(), 2)
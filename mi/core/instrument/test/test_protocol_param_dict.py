@@ -12,6 +12,7 @@ __license__ = 'Apache 2.0'
 
 import json
 import re
+import random
 
 from ooi.logging import log
 from nose.plugins.attrib import attr
@@ -23,6 +24,7 @@ from mi.core.instrument.protocol_param_dict import ParameterDictVisibility
 from mi.core.instrument.protocol_param_dict import ParameterDictType
 from mi.core.instrument.protocol_param_dict import ParameterDictKey
 from mi.core.instrument.protocol_param_dict import Parameter, FunctionParameter, RegexParameter
+from mi.core.instrument.protocol_param_dict import ParameterIndex, required_literal
 
 @attr('UNIT', group='mi')
 class TestUnitProtocolParameterDict(TestUnitStringsDict):
@@ -619,6 +621,70 @@ bar=200, baz=300
                           regex_flags="bad flag",
                           value=12)
             
+    def test_required_literal(self):
+        """
+        Test finding the literal every match of a regex contains
+        """
+        self.assertEqual(required_literal(re.compile(r'.*foo=(\d+).*')), 'foo=')
+        self.assertEqual(required_literal(re.compile(r'(do not )?output salinity')), 'output salinity')
+        self.assertEqual(required_literal(re.compile(r'(\d+) samples(, free)?')), ' samples')
+        self.assertEqual(required_literal(re.compile(r'(?:ab)+c')), 'ab')
+        self.assertEqual(required_literal(re.compile(r'(?P<name>vbatt) = (\d)')), 'vbatt')
+        self.assertEqual(required_literal(re.compile(r'\xa5\x00(.{4})', re.DOTALL)), '\xa5\x00')
+        self.assertEqual(required_literal(re.compile(r'sample \s+ (\d)  # count', re.X)), 'sample')
+        self.assertEqual(required_literal(re.compile(r'foo|bar')), None)
+        self.assertEqual(required_literal(re.compile(r'[abc]x?')), None)
+        self.assertEqual(required_literal(re.compile(r'foo', re.IGNORECASE)), None)
+        self.assertEqual(required_literal(re.compile(r'(?i)foo')), None)
+
+    def test_parameter_index(self):
+        """
+        Test the index never skips a parameter whose regex matches, including
+        literals which are prefixes of, inside of or overlap other literals
+        """
+        patterns = [r'ab(\d)', r'abc(\d)', r'b(\d)', r'bcd=(\d)', r'cde(\d)', r'd(\d)?e',
+                    r'(\d)=e', r'x|y', r'.*(\d\d)']
+        params = []
+        for (i, pattern) in enumerate(patterns):
+            params.append(('p%d' % i, RegexParameter('p%d' % i, pattern, lambda match: match.group(0),
+                                                      str)))
+        params.append(('f', FunctionParameter('f', lambda input: input, str)))
+        index = ParameterIndex(params)
+
+        rand = random.Random(4)
+        for i in range(2000):
+            text = ''.join(rand.choice('abcde=1x') for j in range(rand.randint(0, 12)))
+            candidates = index.candidates(text)
+            # in parameter order
+            self.assertEqual(candidates, sorted(candidates, key=lambda name: index.names.index(name)))
+            for (name, val) in params:
+                if isinstance(val, RegexParameter) and val.regex.search(text):
+                    self.assertIn(name, candidates, '%s skipped for %r' % (name, text))
+            self.assertIn('f', candidates)
+
+        self.assertEqual(index.candidates('zzz'), ['p7', 'p8', 'f'])
+
+    def test_indexed_update(self):
+        """
+        Test updates through the index match updating every parameter, and
+        the index follows parameters added later
+        """
+        self.param_dict.add("total", r'total (\d+) of (\d+)',
+                            lambda match : int(match.group(2)),
+                            lambda x : str(x))
+        self.assertEqual(self.param_dict.update_many("total 5 of 8\nfoo=1"), {"total": True, "foo": True})
+        self.assertEqual(self.param_dict.get("total"), 8)
+        self.assertFalse(self.param_dict.update("nothing here"))
+        self.assertFalse(self.param_dict.update("foo=1", target_params=["bar"]))
+
+        self.param_dict.add("late", r'late=(\d+)',
+                            lambda match : int(match.group(1)),
+                            lambda x : str(x))
+        self.assertTrue(self.param_dict.update("late=4", target_params="late"))
+        self.assertEqual(self.param_dict.get("late"), 4)
+        self.assertEqual(self.param_dict.multi_match_update("late=5"), 1)
+        self.assertEqual(self.param_dict.get("late"), 5)
+
     def test_format_current(self):
         self.param_dict.add("test_format", r'.*foo=(\d+).*',
                              lambda match : int(match.group(1)),
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+
+"""
+@package mi.core.instrument.test.test_ring_buffer
+@file mi/core/instrument/test/test_ring_buffer.py
+@brief Unit tests for the protocol ring buffer
+"""
+
+__license__ = 'Apache 2.0'
+
+from nose.plugins.attrib import attr
+from mi.core.unit_test import MiUnitTestCase
+
+from mi.core.instrument.ring_buffer import RingBuffer
+from mi.core.instrument.instrument_protocol import PromptMatcher
+
+@attr('UNIT', group='mi')
+class TestRingBuffer(MiUnitTestCase):
+    """
+    Compare the ring buffer against appending to a string and trimming it
+    """
+    def test_append(self):
+        """
+        Test appends of every size against a trimmed string
+        """
+        ring = RingBuffer(7)
+        expected = ''
+        for size in [0, 1, 3, 6, 2, 7, 1, 9, 4, 5, 0, 8]:
+            data = ''.join(chr(ord('a') + (len(expected) + i) % 26) for i in range(size))
+            ring.append(data)
+            expected = (expected + data)[-7:]
+            self.assertEqual(ring.getvalue(), expected)
+            self.assertEqual(str(ring), expected)
+            self.assertEqual(len(ring), len(expected))
+            for size in range(9):
+                self.assertEqual(ring.tail(size), expected[len(expected) - min(size, len(expected)):])
+        self.assertEqual(ring.written, 46)
+
+    def test_clear(self):
+        """
+        Test clearing, replacing and resizing the contents
+        """
+        ring = RingBuffer(5)
+        ring.append('abc')
+        ring.clear()
+        self.assertEqual(ring.getvalue(), '')
+        self.assertEqual(ring.resets, 1)
+
+        ring.set('abcdefg')
+        self.assertEqual(ring.getvalue(), 'cdefg')
+        self.assertEqual(ring.resets, 2)
+        self.assertEqual(ring.written, 10)
+
+        ring.append('hi')
+        ring.resize(3)
+        self.assertEqual(ring.getvalue(), 'ghi')
+        ring.resize(6)
+        ring.append('jkl')
+        self.assertEqual(ring.getvalue(), 'ghijkl')
+        self.assertEqual(ring.written, 15)
+        ring.append(u'm')
+        self.assertEqual(ring.getvalue(), 'hijklm')
+
+        self.assertRaises(ValueError, RingBuffer, 0)
+        self.assertRaises(ValueError, ring.resize, -1)
+
+    def test_prompt_matcher(self):
+        """
+        Test only the new data in the ring is searched for prompts
+        """
+        ring = RingBuffer(8)
+        matcher = PromptMatcher(['-->', '>'])
+        ring.append('abc -')
+        self.assertEqual(matcher.search_buffer(ring), None)
+        ring.append('-> d')
+        # the prompt is split across the appends and the ring has wrapped
+        self.assertEqual(matcher.search_buffer(ring), ('-->', 3))
+
+        ring.append('>')
+        self.assertEqual(matcher.search_buffer(ring), ('>', 7))
+        # the old '>' at the start of the ring is not searched again
+        ring.append('efgh')
+        self.assertEqual(ring.getvalue(), '> d>efgh')
+        self.assertEqual(matcher.search_buffer(ring), ('>', 3))
+        ring.append('ijk')
+        self.assertEqual(matcher.search_buffer(ring), None)
+
+        # the whole buffer is searched after it is replaced
+        ring.set('> f')
+        self.assertEqual(matcher.search_buffer(ring), ('>', 0))
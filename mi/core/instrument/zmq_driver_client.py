@@ -87,8 +87,12 @@ class ZmqDriverClient(DriverClient):
                 try:
                     evt = sock.recv_pyobj(flags=zmq.NOBLOCK)
                     log.debug('got event: %s' % str(evt))
-                    if driver_client.evt_callback:
-                        driver_client.evt_callback(evt)
+                    # several events queued together arrive as a list
+                    if not isinstance(evt, list):
+                        evt = [evt]
+                    for e in evt:
+                        if driver_client.evt_callback:
+                            driver_client.evt_callback(e)
                 except zmq.ZMQError:
                     time.sleep(.5)
                 #cur_time = time.time()
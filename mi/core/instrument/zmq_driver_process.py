@@ -31,9 +31,15 @@ from ooi.exception import ApplicationException
 from mi.core.exceptions import InstrumentException, UnexpectedError
 
 import mi.core.instrument.driver_process as driver_process
+from mi.core.instrument.driver_event_queue import DEFAULT_HIGH_WATER_MARK
 from mi.core.log import get_logger
 log = get_logger()
 
+# most events published in one message
+EVENT_BATCH_SIZE = 100
+# longest wait for an event before checking for shutdown
+EVENT_WAIT_TIMEOUT = .5
+
 def _encode_exception(reply):
     if isinstance(reply, InstrumentException):
         # InstrumentExceptions have corresponding IonException error code built-in
@@ -52,7 +58,8 @@ class ZmqDriverProcess(driver_process.DriverProcess):
     """
     
     @classmethod
-    def launch_process(cls, driver_module, driver_class, workdir='/tmp/', ppid=None):
+    def launch_process(cls, driver_module, driver_class, workdir='/tmp/', ppid=None,
+                       event_high_water_mark=DEFAULT_HIGH_WATER_MARK):
         """
         Class method constructor to launch ZmqDriverProcess as a
         separate OS process. Creates command string for this
@@ -62,6 +69,8 @@ class ZmqDriverProcess(driver_process.DriverProcess):
         @param workdir The work directory when temporary port files are written.
         @param ppid ID of the parent process, used to self destruct when
         parent dies in test cases.
+        @param event_high_water_mark The number of unsent events above which
+        samples are dropped.
         @retval Tuple containing (Popen object for the process, cmd port,
             evt_port)
         """
@@ -72,9 +81,10 @@ class ZmqDriverProcess(driver_process.DriverProcess):
         cmd_port_fname = workdir + cmd_port_fname
         evt_port_fname = 'dvr_evt_port_%s.txt' % tag
         evt_port_fname = workdir + evt_port_fname
-        cmd_str = 'from %s import %s; dp = %s("%s", "%s", "%s", "%s", %s);dp.run()' \
+        cmd_str = 'from %s import %s; dp = %s("%s", "%s", "%s", "%s", %s, %d);dp.run()' \
             % (__name__, cls.__name__, cls.__name__, driver_module,
-               driver_class, cmd_port_fname, evt_port_fname, str(ppid))
+               driver_class, cmd_port_fname, evt_port_fname, str(ppid),
+               event_high_water_mark)
                 
         # Call base class launch method.
         dvr_proc = driver_process.DriverProcess.launch_process(cmd_str)
@@ -101,7 +111,8 @@ class ZmqDriverProcess(driver_process.DriverProcess):
 
         return (dvr_proc, dvr_cmd_port, dvr_evt_port)
         
-    def __init__(self, driver_module, driver_class, cmd_port_fname, evt_port_fname, ppid):
+    def __init__(self, driver_module, driver_class, cmd_port_fname, evt_port_fname, ppid,
+                 event_high_water_mark=DEFAULT_HIGH_WATER_MARK):
         """
         Zmq driver process constructor.
         @param driver_module The python module containing the driver code.
@@ -110,8 +121,11 @@ class ZmqDriverProcess(driver_process.DriverProcess):
         @param evt_port_fname Filename for temp evt port file.
         @param ppid ID of the parent process, used to self destruct when
         parent dies in test cases.        
+        @param event_high_water_mark The number of unsent events above which
+        samples are dropped.
         """
-        driver_process.DriverProcess.__init__(self, driver_module, driver_class, ppid)
+        driver_process.DriverProcess.__init__(self, driver_module, driver_class, ppid,
+                                              event_high_water_mark)
         self.cmd_port = None
         self.cmd_port_fname = cmd_port_fname
         self.evt_port = None
@@ -171,7 +185,9 @@ class ZmqDriverProcess(driver_process.DriverProcess):
         def send_evt_msg(zmq_driver_process):
             """
             Await events on the driver process event queue and publish them
-            on a ZMQ PUB socket to the driver process client.
+            on a ZMQ PUB socket to the driver process client. Events are
+            sent as soon as they are queued. When several are waiting they
+            are published together as a list in one message.
             """
             context = zmq.Context()
             sock = context.socket(zmq.PUB)
@@ -181,22 +197,21 @@ class ZmqDriverProcess(driver_process.DriverProcess):
 
             zmq_driver_process.stop_evt_thread = False
             while not zmq_driver_process.stop_evt_thread:
-                try:
-                    evt = zmq_driver_process.events.pop(0)
-                    #log.trace('Event thread sending event %s',evt)
-                    while evt:
-                        try:
-                            if isinstance(evt, Exception):
-                                evt = _encode_exception(evt)
-                            sock.send_pyobj(evt, flags=zmq.NOBLOCK)
-                            evt = None
-                            log.trace('Event sent!')
-                        except zmq.ZMQError:
-                            time.sleep(.1)
-                            if zmq_driver_process.stop_evt_thread:
-                                break
-                except IndexError:
-                    time.sleep(.1)
+                batch = zmq_driver_process.events.get_batch(EVENT_BATCH_SIZE, EVENT_WAIT_TIMEOUT)
+                if not batch:
+                    continue
+                batch = [_encode_exception(evt) if isinstance(evt, Exception) else evt
+                         for evt in batch]
+                msg = batch[0] if len(batch) == 1 else batch
+                while True:
+                    try:
+                        sock.send_pyobj(msg, flags=zmq.NOBLOCK)
+                        log.trace('Sent %d events', len(batch))
+                        break
+                    except zmq.ZMQError:
+                        time.sleep(.1)
+                        if zmq_driver_process.stop_evt_thread:
+                            break
 
             sock.close()
             context.term()
@@ -1,8 +1,18 @@
 """
 polling utilities -- general polling for condition, polling for file to appear in a directory
 """
+# Needed because we import the time module below.  With out this '.' is search first
+# and we import mi.core.time.
+from __future__ import absolute_import
+
 import os
 import glob
+import fnmatch
+import time
+import errno
+import struct
+import ctypes
+import ctypes.util
 from threading import Thread
 from gevent.event import Event
 from ooi.logging import log
@@ -110,3 +120,189 @@ class BlockingDirectoryIterator(object):
             self._values.put(file)
     def _on_exception(self, exception):
         self._values.put(exception)
+
+class InotifyWatch(object):
+    """
+    Watch a directory for changes with the linux inotify API, through ctypes
+    so no extra package is needed. Use create(), which returns None where
+    inotify is not available.
+    """
+    IN_MODIFY = 0x00000002
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_MOVE_SELF = 0x00000800
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_NONBLOCK = os.O_NONBLOCK
+    IN_CLOEXEC = 0o2000000
+
+    WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | \
+                 IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+    # events after which the changed names are unknown
+    RESCAN_MASK = IN_Q_OVERFLOW | IN_IGNORED | IN_DELETE_SELF | IN_MOVE_SELF
+
+    EVENT_HEADER = struct.Struct('iIII')
+    READ_SIZE = 65536
+
+    _libc = None
+
+    def __init__(self, libc, fd, directory):
+        self._libc = libc
+        self._fd = fd
+        self._wd = libc.inotify_add_watch(fd, directory, self.WATCH_MASK)
+        if self._wd < 0:
+            error = ctypes.get_errno()
+            os.close(fd)
+            raise OSError(error, os.strerror(error), directory)
+
+    @classmethod
+    def create(cls, directory):
+        """
+        @param directory The directory to watch
+        @retval An InotifyWatch, or None if inotify is not available
+        """
+        try:
+            if cls._libc is None:
+                cls._libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+            libc = cls._libc
+            fd = libc.inotify_init1(cls.IN_NONBLOCK | cls.IN_CLOEXEC)
+            if fd < 0:
+                error = ctypes.get_errno()
+                raise OSError(error, os.strerror(error))
+            return cls(libc, fd, directory)
+        except (OSError, AttributeError) as e:
+            log.debug("inotify not available for %s: %s", directory, e)
+            return None
+
+    def read_events(self):
+        """
+        Read the pending events without blocking
+        @retval A tuple of the set of changed names and True if the changed
+            names are unknown, i.e. the event queue overflowed
+        """
+        names = set()
+        rescan = False
+        while True:
+            try:
+                data = os.read(self._fd, self.READ_SIZE)
+            except OSError as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    break
+                raise
+            if not data:
+                break
+            offset = 0
+            while offset < len(data):
+                (wd, mask, cookie, length) = self.EVENT_HEADER.unpack_from(data, offset)
+                offset += self.EVENT_HEADER.size
+                if mask & self.RESCAN_MASK:
+                    rescan = True
+                if length:
+                    names.add(data[offset:offset + length].rstrip('\0'))
+                offset += length
+        return (names, rescan)
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+class DirectoryIndex(object):
+    """
+    Index of the files in a directory matching a wildcard, keyed by their
+    (inode, size, mtime), so a poll only looks at the files which changed
+    instead of every file in the directory. With inotify only the files
+    named in its events are stat'ed, otherwise every poll lists the
+    directory and stats the files. A full scan is still done every
+    rescan_interval seconds with inotify, because it misses changes made
+    by other hosts on network file systems.
+    """
+    def __init__(self, directory, wildcard, use_inotify=True, rescan_interval=60):
+        """
+        @param directory The directory to index
+        @param wildcard The glob pattern of the file names to index
+        @param use_inotify Use inotify to find changed files where it is available
+        @param rescan_interval Seconds between full scans when using inotify
+        """
+        self._directory = directory
+        self._wildcard = wildcard
+        self._use_inotify = use_inotify
+        self._rescan_interval = rescan_interval
+        self._watch = None
+        self._last_scan = None
+        # file name -> (inode, size, mtime)
+        self.stats = {}
+
+    def changes(self):
+        """
+        Find the files which were added or changed since the last call, the
+        first call finds every file
+        @retval A list of the names of the new or changed files
+        """
+        if not os.path.isdir(self._directory):
+            self.close()
+            self.stats = {}
+            return []
+
+        if self._watch is not None and time.time() - self._last_scan < self._rescan_interval:
+            (names, rescan) = self._watch.read_events()
+            if not rescan:
+                return self._update(fnmatch.filter(names, self._wildcard), False)
+            # the watch may have gone with the directory, start a new one
+            self.close()
+
+        if self._watch is not None:
+            # throw away the events the full scan covers
+            self._watch.read_events()
+        elif self._use_inotify:
+            # start watching before scanning so no change is missed
+            self._watch = InotifyWatch.create(self._directory)
+            if self._watch is None:
+                log.info("Polling %s without inotify", self._directory)
+                self._use_inotify = False
+
+        self._last_scan = time.time()
+        return self._update(glob.glob1(self._directory, self._wildcard), True)
+
+    def _update(self, names, full_scan):
+        """
+        Stat the files and update the index
+        @param names The names to check
+        @param full_scan True if names are all the files in the directory
+        @retval A sorted list of the names of the new or changed files
+        """
+        if full_scan:
+            for name in set(self.stats).difference(names):
+                del self.stats[name]
+
+        changed = []
+        for name in names:
+            if name.startswith('.') and not self._wildcard.startswith('.'):
+                # glob skips hidden files
+                continue
+            try:
+                s = os.stat(os.path.join(self._directory, name))
+            except OSError:
+                # removed
+                self.stats.pop(name, None)
+                continue
+            signature = (s.st_ino, s.st_size, s.st_mtime)
+            if self.stats.get(name) != signature:
+                self.stats[name] = signature
+                changed.append(name)
+        changed.sort()
+        return changed
+
+    def close(self):
+        """
+        Stop watching the directory
+        """
+        if self._watch is not None:
+            self._watch.close()
+            self._watch = None
+
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+
+"""
+@package mi.core.test.test_poller
+@file mi/core/test/test_poller.py
+@brief Unit tests for the directory index used by the pollers
+"""
+
+__license__ = 'Apache 2.0'
+
+import os
+import shutil
+import tempfile
+
+from nose.plugins.attrib import attr
+from mi.core.unit_test import MiUnitTest
+
+from mi.core.poller import DirectoryIndex, InotifyWatch
+
+@attr('UNIT', group='mi')
+class TestDirectoryIndex(MiUnitTest):
+    """
+    Test finding the changed files in a directory
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, True)
+
+    def write_file(self, name, data='data', mtime=None):
+        path = os.path.join(self.directory, name)
+        with open(path, 'a') as handle:
+            handle.write(data)
+        if mtime is not None:
+            os.utime(path, (mtime, mtime))
+
+    def check_changes(self, index):
+        for name in ['b.txt', 'a.txt', 'c.dat', '.hidden.txt']:
+            self.write_file(name)
+        self.assertEqual(index.changes(), ['a.txt', 'b.txt'])
+        self.assertEqual(sorted(index.stats), ['a.txt', 'b.txt'])
+        self.assertEqual(index.changes(), [])
+
+        # appended and new files are found, not the unchanged ones
+        self.write_file('b.txt', 'more', 1000)
+        self.write_file('d.txt')
+        self.assertEqual(index.changes(), ['b.txt', 'd.txt'])
+        self.assertEqual(index.stats['b.txt'][1:], (8, 1000))
+
+        # a touched file is found again
+        self.write_file('a.txt', '', 2000)
+        os.remove(os.path.join(self.directory, 'd.txt'))
+        self.assertEqual(index.changes(), ['a.txt'])
+        self.assertEqual(sorted(index.stats), ['a.txt', 'b.txt'])
+        self.assertEqual(index.changes(), [])
+
+        # a missing directory has no files
+        shutil.rmtree(self.directory)
+        self.assertEqual(index.changes(), [])
+        self.assertEqual(index.stats, {})
+        os.mkdir(self.directory)
+        self.write_file('e.txt')
+        self.assertEqual(index.changes(), ['e.txt'])
+        index.close()
+
+    def test_polling(self):
+        """
+        Test the index stats every file when not using inotify
+        """
+        self.check_changes(DirectoryIndex(self.directory, '*.txt', use_inotify=False))
+
+    def test_inotify(self):
+        """
+        Test the index only stats the files in the inotify events
+        """
+        watch = InotifyWatch.create(self.directory)
+        if watch is None:
+            self.skipTest("inotify is not available")
+        watch.close()
+
+        index = DirectoryIndex(self.directory, '*.txt')
+        self.check_changes(index)
+
+        # between full scans only the files in events are checked
+        index.changes()
+        self.write_file('e.txt', 'more')
+        index.stats.clear()
+        self.assertEqual(index.changes(), ['e.txt'])
+        index._rescan_interval = 0
+        self.assertEqual(index.changes(), [])
+        self.assertEqual(sorted(index.stats), ['e.txt'])
+        index.close()
@@ -11,11 +11,17 @@ __author__ = 'Steve Foley'
 __license__ = 'Apache 2.0'
 
 import os
+import errno
+import fcntl
+import struct
 import gevent
 import shutil
 import hashlib
 import copy
+import cPickle
 import traceback
+import multiprocessing
+from collections import deque
 
 from mi.core.log import get_logger ; log = get_logger()
 from mi.core.exceptions import InstrumentParameterException
@@ -58,6 +64,7 @@ class DriverParameter(BaseEnum):
     RECORDS_PER_SECOND = 'records_per_second'
     PUBLISHER_POLLING_INTERVAL = 'publisher_polling_interval'
     BATCHED_PARTICLE_COUNT = 'batched_particle_count'
+    INGEST_PROCESSES = 'ingest_processes'
 
 class HarvesterType(BaseEnum):
     SINGLE_DIRECTORY = 'single_directory'
@@ -114,6 +121,10 @@ class DataSetDriverConfigKeys(BaseEnum):
     CLASS = "class"
     URI = "uri"
     CLASS_ARGS = "class_args"
+    BATCH_PUBLISH = "batch_publish"
+    BLOCK_SIZE = "block_size"
+    MAX_BUFFER_SIZE = "max_buffer_size"
+    MMAP = "mmap"
 
 class DataSetDriver(object):
     """
@@ -139,11 +150,17 @@ class DataSetDriver(object):
             'frequency': 1,
             'file_mod_wait_time': 30,
         },
-        'parser': {}
+        'parser': {
+            'batch_publish'
+            'block_size'
+            'max_buffer_size'
+            'mmap'
+        }
         'driver': {
             'records_per_second'
             'harvester_polling_interval'
             'batched_particle_count'
+            'ingest_processes'
         }
     }
     """
@@ -162,6 +179,7 @@ class DataSetDriver(object):
         self._polling_interval = None
         self._generate_particle_count = None
         self._particle_count_per_second = None
+        self._ingest_processes = None
         self._resource_id = None
 
         self._param_dict = ProtocolParameterDict()
@@ -277,7 +295,8 @@ class DataSetDriver(object):
 
         log.trace("set_resource: iterate through params: %s", params)
         for (key, val) in params.iteritems():
-            if key in [DriverParameter.BATCHED_PARTICLE_COUNT, DriverParameter.RECORDS_PER_SECOND]:
+            if key in [DriverParameter.BATCHED_PARTICLE_COUNT, DriverParameter.RECORDS_PER_SECOND,
+                       DriverParameter.INGEST_PROCESSES]:
                 if not isinstance(val, int): raise InstrumentParameterException("%s must be an integer" % key)
             if key in [DriverParameter.PUBLISHER_POLLING_INTERVAL]:
                 if not isinstance(val, (int, float)): raise InstrumentParameterException("%s must be an float" % key)
@@ -291,8 +310,9 @@ class DataSetDriver(object):
         self._generate_particle_count = self._param_dict.get(DriverParameter.BATCHED_PARTICLE_COUNT)
         self._particle_count_per_second = self._param_dict.get(DriverParameter.RECORDS_PER_SECOND)
         self._polling_interval = self._param_dict.get(DriverParameter.PUBLISHER_POLLING_INTERVAL)
-        log.trace("Driver Parameters: %s, %s, %s", self._polling_interval, self._particle_count_per_second,
-                  self._generate_particle_count)
+        self._ingest_processes = self._param_dict.get(DriverParameter.INGEST_PROCESSES)
+        log.trace("Driver Parameters: %s, %s, %s, %s", self._polling_interval, self._particle_count_per_second,
+                  self._generate_particle_count, self._ingest_processes)
 
 
     def get_resource(self, *args, **kwargs):
@@ -367,7 +387,7 @@ class DataSetDriver(object):
 
     def _build_param_dict(self):
         """
-        Setup three common driver parameters
+        Setup four common driver parameters
         """
         self._param_dict.add_parameter(
             Parameter(
@@ -402,6 +422,17 @@ class DataSetDriver(object):
                 description="Number of particles to batch before sending to the agent")
         )
 
+        self._param_dict.add_parameter(
+            Parameter(
+                DriverParameter.INGEST_PROCESSES,
+                int,
+                value=1,
+                type=ParameterDictType.INT,
+                visibility=ParameterDictVisibility.IMMUTABLE,
+                display_name="Ingest Processes",
+                description="Number of processes parsing queued files in parallel, 1 parses them in the driver")
+        )
+
         config = self._config.get(DataSourceConfigKey.DRIVER, {})
         log.debug("set_resource on startup with: %s", config)
         self.set_resource(config)
@@ -466,6 +497,181 @@ class DataSetDriver(object):
         self._event_callback(event_type="ResourceAgentIOEvent", source_type="new file", stats=stats)
 
 
+# the number of files handed to each ingest process ahead of the file
+# being published
+INGEST_FILES_PER_PROCESS = 2
+# seconds to sleep when no ingest process has sent anything
+INGEST_POLL_INTERVAL = 0.01
+# bytes to read from an ingest process pipe at a time
+INGEST_READ_SIZE = 65536
+# each batch of events is sent as its pickled length and the pickle
+INGEST_FRAME_HEADER = struct.Struct('>I')
+
+class IngestEvent(BaseEnum):
+    """
+    What a parser did while parsing a file in an ingest process, recorded so
+    the driver can replay it in order
+    """
+    DATA = 'data'
+    STATE = 'state'
+    BATCH = 'batch'
+    SAMPLE_EXCEPTION = 'sample_exception'
+    SAMPLE_ERROR = 'sample_error'
+    ERROR = 'error'
+    # the whole file has been sent
+    END = 'end'
+    # a batch could not be sent, the driver parses the rest of the file
+    FALLBACK = 'fallback'
+
+def _portable_exception(exception):
+    """
+    MI exceptions don't survive a pickle round trip because their args don't
+    match their constructors, so send the class, args and attributes instead
+    @param exception The exception to send
+    @retval A tuple to rebuild the exception from with _restore_exception
+    """
+    return (exception.__class__, exception.args, exception.__dict__)
+
+def _restore_exception(portable):
+    """
+    @param portable The tuple from _portable_exception
+    @retval The rebuilt exception
+    """
+    (exception_class, args, attributes) = portable
+    exception = exception_class.__new__(exception_class)
+    exception.args = args
+    exception.__dict__.update(attributes)
+    return exception
+
+class _UnpicklableBatch(Exception):
+    """
+    A batch of events from an ingest process could not be pickled
+    """
+
+def _ingest_file(driver, file_name, count, fd):
+    """
+    Parse a file in an ingest process forked from the driver. The driver's
+    callbacks are replaced to record what the parser publishes, and the
+    events are written to the pipe a batch of records at a time.
+    @param driver The forked copy of the SimpleDataSetDriver
+    @param file_name name of the file to parse
+    @param count The number of records to get at a time
+    @param fd The write end of the pipe to the driver
+    """
+    events = []
+
+    def send():
+        try:
+            data = cPickle.dumps(events, cPickle.HIGHEST_PROTOCOL)
+        except Exception as e:
+            raise _UnpicklableBatch(str(e))
+        data = INGEST_FRAME_HEADER.pack(len(data)) + data
+        while data:
+            data = data[os.write(fd, data):]
+        del events[:]
+
+    driver._data_callback = lambda particles: events.append((IngestEvent.DATA, particles))
+    driver._save_parser_state = lambda state, file_ingested: \
+        events.append((IngestEvent.STATE, state, file_ingested))
+    driver._sample_exception_callback = lambda exception: \
+        events.append((IngestEvent.SAMPLE_EXCEPTION, _portable_exception(exception)))
+
+    try:
+        try:
+            path = os.path.join(driver._harvester_config.get(DataSetDriverConfigKeys.DIRECTORY), file_name)
+            with open(path) as handle:
+                parser = driver._build_parser(driver._driver_state[file_name][DriverStateKey.PARSER_STATE], handle)
+                while parser.get_records(count):
+                    events.append((IngestEvent.BATCH,))
+                    send()
+        except _UnpicklableBatch:
+            raise
+        except SampleException as e:
+            events.append((IngestEvent.SAMPLE_ERROR, _portable_exception(e)))
+        except Exception as e:
+            events.append((IngestEvent.ERROR, _portable_exception(e), traceback.format_exc()))
+
+        events.append((IngestEvent.END,))
+        send()
+    except _UnpicklableBatch as e:
+        log.warn("Failed to send events parsed from %s: %s", file_name, e)
+        del events[:]
+        events.append((IngestEvent.FALLBACK,))
+        send()
+    finally:
+        os.close(fd)
+
+class _IngestWorker(object):
+    """
+    An ingest process parsing one file, and the non blocking read end of the
+    pipe it sends the batches of events on. Reading the pipe from the driver's
+    greenlet never blocks the hub.
+    """
+    def __init__(self, driver, file_name, count):
+        """
+        Fork the ingest process
+        @param driver The SimpleDataSetDriver parsing the file
+        @param file_name name of the file to parse
+        @param count The number of records to get at a time
+        """
+        self.file_name = file_name
+        self.batches = deque()
+        self.closed = False
+        self._buffer = bytearray()
+
+        (self._fd, write_fd) = os.pipe()
+        try:
+            self._process = multiprocessing.Process(target=_ingest_file, args=(driver, file_name, count, write_fd))
+            self._process.daemon = True
+            self._process.start()
+        finally:
+            # only the ingest process writes, so the pipe reads EOF when it exits
+            os.close(write_fd)
+        flags = fcntl.fcntl(self._fd, fcntl.F_GETFL)
+        fcntl.fcntl(self._fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+
+    def read(self):
+        """
+        Read whatever the ingest process has sent so far and queue the
+        complete batches
+        @retval True if anything was read
+        """
+        got_data = False
+        while not self.closed:
+            try:
+                data = os.read(self._fd, INGEST_READ_SIZE)
+            except OSError as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    break
+                raise
+            if not data:
+                self.closed = True
+                break
+            got_data = True
+            self._buffer.extend(data)
+
+        header_size = INGEST_FRAME_HEADER.size
+        while len(self._buffer) >= header_size:
+            (size,) = INGEST_FRAME_HEADER.unpack_from(buffer(self._buffer))
+            if len(self._buffer) < header_size + size:
+                break
+            self.batches.append(cPickle.loads(str(self._buffer[header_size:header_size + size])))
+            del self._buffer[:header_size + size]
+
+        return got_data
+
+    def stop(self):
+        """
+        Stop the ingest process if it is still running and close the pipe
+        """
+        if self._process.is_alive():
+            self._process.terminate()
+        self._process.join()
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+        self.closed = True
+
 class SimpleDataSetDriver(DataSetDriver):
     """
     Simple data set driver handles cases where we are watching a single directory and pushing the
@@ -478,6 +684,7 @@ class SimpleDataSetDriver(DataSetDriver):
         super(SimpleDataSetDriver, self).__init__(config, memento, data_callback, state_callback, event_callback, exception_callback)
         self._harvester = None
         self._driver_state = None
+        self._ingest_workers = deque()
 
         self._init_state(memento)
 
@@ -514,6 +721,10 @@ class SimpleDataSetDriver(DataSetDriver):
         else:
             log.debug("poller not running. no need to shutdown")
 
+        if self._ingest_workers:
+            log.debug("Stopping ingest processes")
+            self._stop_ingest_workers()
+
     ####
     ##    Helpers
     ####
@@ -558,7 +769,10 @@ class SimpleDataSetDriver(DataSetDriver):
         log.trace("Checking for new files in queue, count: %d", count)
         if(count > 0):
             log.debug("New file detected, resource_id: %s, array addr: %s", self._resource_id, id(self._new_file_queue))
-            self._got_file(self._new_file_queue.pop(0))
+            if count > 1 and self._ingests_in_parallel():
+                self._got_files_in_parallel()
+            else:
+                self._got_file(self._new_file_queue.pop(0))
 
     def _stage_input_file(self, path):
         """
@@ -619,13 +833,7 @@ class SimpleDataSetDriver(DataSetDriver):
             # Removed this for the time being to get new driver code out.  May bring this back in the future
             #self._stage_input_file(os.path.join(directory, file_name))
 
-            count = 1
-            delay = None
-
-            if self._generate_particle_count:
-                # Calculate the delay between grabbing records to publish.
-                delay = float(1) / float(self._particle_count_per_second) * float(self._generate_particle_count)
-                count = self._generate_particle_count
+            (count, delay) = self._record_batch()
 
             self._file_in_process = file_name
 
@@ -634,20 +842,155 @@ class SimpleDataSetDriver(DataSetDriver):
             path = os.path.join(directory, file_name)
 
             self._raise_new_file_event(path)
-            log.debug("Open new data source file: %s", path)
-            handle = open(path)
+            self._parse_file(path, file_name, count, delay)
 
-            # the file directory is initialized in the harvester, so it will exist by this point
-            parser = self._build_parser(self._driver_state[file_name][DriverStateKey.PARSER_STATE], handle)
+        except SampleException as e:
+            # need to mark the bad file as ingested so we don't re-ingest it
+            self._save_parser_state_after_error()
+            self._sample_exception_callback(e)
 
-            while(True):
-                result = parser.get_records(count)
-                if result:
-                    log.trace("Record parsed: %r delay: %f", result, delay)
-                    if delay:
-                        gevent.sleep(delay)
-                else:
-                    break
+        finally:
+            self._file_in_process = None
+
+    def _parse_file(self, path, file_name, count, delay):
+        """
+        Parse a file from its saved parser state, publishing a batch of records
+        at a time
+        @param path The path of the file
+        @param file_name name of the file
+        @param count The number of records to get at a time
+        @param delay The delay between batches of records
+        """
+        log.debug("Open new data source file: %s", path)
+        handle = open(path)
+
+        # the file directory is initialized in the harvester, so it will exist by this point
+        parser = self._build_parser(self._driver_state[file_name][DriverStateKey.PARSER_STATE], handle)
+
+        while(True):
+            result = parser.get_records(count)
+            if result:
+                log.trace("Record parsed: %r delay: %f", result, delay)
+                if delay:
+                    gevent.sleep(delay)
+            else:
+                break
+
+    def _record_batch(self):
+        """
+        @retval A tuple of the number of records to get at a time and the
+            delay between getting them
+        """
+        count = 1
+        delay = None
+
+        if self._generate_particle_count:
+            # Calculate the delay between grabbing records to publish.
+            delay = float(1) / float(self._particle_count_per_second) * float(self._generate_particle_count)
+            count = self._generate_particle_count
+
+        return (count, delay)
+
+    def _ingests_in_parallel(self):
+        """
+        Ingest processes build the parser with _build_parser(parser_state,
+        infile). A driver overriding _got_file parses its files some other way,
+        so it always parses them one at a time in the driver.
+        @retval True if queued files are parsed in ingest processes
+        """
+        return self._ingest_processes > 1 and \
+            self.__class__._got_file.__func__ is SimpleDataSetDriver._got_file.__func__
+
+    def _got_files_in_parallel(self):
+        """
+        Parse the queued files in ingest processes. A few files per process
+        are parsed ahead, and each process streams its file's events back a
+        batch of records at a time. The batches are replayed in queue order as
+        they arrive, so particles, parser state and events are published just
+        as if the files were parsed one after another in the driver.
+        """
+        (count, delay) = self._record_batch()
+
+        try:
+            while self._new_file_queue:
+                # the workers are always parsing the first files in the queue
+                while len(self._ingest_workers) < len(self._new_file_queue) and \
+                        len(self._ingest_workers) < INGEST_FILES_PER_PROCESS * self._ingest_processes:
+                    file_name = self._new_file_queue[len(self._ingest_workers)]
+                    self._ingest_workers.append(_IngestWorker(self, file_name, count))
+
+                self._new_file_queue.pop(0)
+                self._replay_file(self._ingest_workers[0], count, delay)
+                self._ingest_workers.popleft().stop()
+        finally:
+            self._stop_ingest_workers()
+
+    def _stop_ingest_workers(self):
+        """
+        Stop the ingest processes parsing files ahead
+        """
+        while self._ingest_workers:
+            self._ingest_workers.popleft().stop()
+
+    def _next_ingest_batch(self, worker):
+        """
+        Wait for the next batch of events from an ingest process. Every
+        process is read while waiting, so none of them blocks on a full pipe.
+        @param worker The _IngestWorker to wait for
+        @retval A list of events, or None if the process exited before sending
+            the whole file
+        """
+        while not worker.batches:
+            if worker.closed:
+                return None
+
+            got_data = False
+            for each in self._ingest_workers:
+                got_data = each.read() or got_data
+
+            if not got_data:
+                gevent.sleep(INGEST_POLL_INTERVAL)
+
+        return worker.batches.popleft()
+
+    def _replay_file(self, worker, count, delay):
+        """
+        Publish the events of a file as its ingest process sends them
+        @param worker The _IngestWorker parsing the file
+        @param count The number of records to get at a time
+        @param delay The delay between batches of records
+        """
+        file_name = worker.file_name
+        path = os.path.join(self._harvester_config.get(DataSetDriverConfigKeys.DIRECTORY), file_name)
+        try:
+            self._file_in_process = file_name
+            self._raise_new_file_event(path)
+
+            while True:
+                events = self._next_ingest_batch(worker) or [(IngestEvent.FALLBACK,)]
+                for event in events:
+                    event_type = event[0]
+                    if event_type == IngestEvent.DATA:
+                        self._data_callback(event[1])
+                    elif event_type == IngestEvent.STATE:
+                        self._save_parser_state(event[1], event[2])
+                    elif event_type == IngestEvent.BATCH:
+                        if delay:
+                            gevent.sleep(delay)
+                    elif event_type == IngestEvent.SAMPLE_EXCEPTION:
+                        self._sample_exception_callback(_restore_exception(event[1]))
+                    elif event_type == IngestEvent.SAMPLE_ERROR:
+                        raise _restore_exception(event[1])
+                    elif event_type == IngestEvent.ERROR:
+                        log.error("Ingest process failed to parse %s: %s", file_name, event[2])
+                        raise _restore_exception(event[1])
+                    elif event_type == IngestEvent.END:
+                        return
+                    elif event_type == IngestEvent.FALLBACK:
+                        # resume from the parser state replayed so far
+                        log.warn("Failed to parse %s in an ingest process, parsing the rest in the driver", file_name)
+                        self._parse_file(path, file_name, count, delay)
+                        return
 
         except SampleException as e:
             # need to mark the bad file as ingested so we don't re-ingest it
@@ -11,15 +11,48 @@ out of files and feed them into the system.
 __author__ = 'Steve Foley'
 __license__ = 'Apache 2.0'
 
+import mmap
 import time
 import ntplib
 
 from mi.core.log import get_logger ; log = get_logger()
 from mi.core.instrument.chunker import StringChunker
-from mi.core.instrument.data_particle import DataParticleKey
+from mi.core.instrument.data_particle import DataParticleKey, ParticleBatch
 from mi.core.exceptions import SampleException, RecoverableSampleException, SampleEncodingException
 from mi.core.exceptions import NotImplementedException, UnexpectedDataException
 
+# bounds of the automatically tuned block size used by BufferLoadingParser,
+# the first block of a file is read with the minimum size
+MIN_BLOCK_SIZE = 1024
+MAX_BLOCK_SIZE = 4 * 1024 * 1024
+# the tuned block size aims to hold about this many records. The chunker
+# re-indexes what is left of its buffer for every record taken out of it,
+# so much larger blocks cost more than the reads they save.
+RECORDS_PER_BLOCK = 32
+# default cap on the unparsed data the chunker may hold before reads shrink
+MAX_BUFFER_SIZE = 16 * 1024 * 1024
+
+def auto_block_size(bytes_read, records_read, block_size, record_size=None):
+    """
+    Tune the block size from the average size of the records parsed so far.
+    Until a record has been parsed the block size doubles with every block,
+    so files with very long records do not need many reads per record.
+    @param bytes_read The number of bytes read so far
+    @param records_read The number of records parsed from them
+    @param block_size The size of the last block read
+    @param record_size The size of a fixed length record, if the file has
+        them, the block size is rounded down to a whole number of records
+    @retval The block size in bytes
+    """
+    if records_read:
+        size = bytes_read * RECORDS_PER_BLOCK // records_read
+    else:
+        size = block_size * 2
+    size = min(max(size, MIN_BLOCK_SIZE), MAX_BLOCK_SIZE)
+    if record_size:
+        size = max(size - size % record_size, record_size)
+    return size
+
 class Parser(object):
     """ abstract class to show API needed for plugin poller objects """
 
@@ -56,6 +89,10 @@ class Parser(object):
         # this back to true
         self._new_sequence = False
 
+        # publish particles as one ParticleBatch per stream rather than a
+        # list of individual particles
+        self._batch_publish = config.get("batch_publish", False)
+
         #build class from module and class name, then set the state
         if config.get("particle_module"):
             self._particle_module = __import__(config.get("particle_module"), fromlist = [config.get("particle_class")])
@@ -91,15 +128,20 @@ class Parser(object):
     
     def _publish_sample(self, samples):
         """
-        Publish the samples with the given publishing callback.
+        Publish the samples with the given publishing callback. If batch
+        publishing is configured the callback gets a list of ParticleBatch
+        objects, one per stream, instead of the particles themselves.
         @param samples The list of data particle to publish up to the system
         """
         if isinstance(samples, list):
+            if self._batch_publish:
+                samples = ParticleBatch.from_particles(samples)
             self._publish_callback(samples)
         else:
             self._publish_callback([samples])
         
-    def _extract_sample(self, particle_class, regex, raw_data, timestamp):
+    def _extract_sample(self, particle_class, regex, raw_data, timestamp,
+                        driver_timestamp=None):
         """
         Extract sample from a response line if present and publish
         parsed particle
@@ -110,19 +152,29 @@ class Parser(object):
         @param regex The regular expression that matches a data sample if regex
                      is none then process every line
         @param raw_data data to input into this particle.
+        @param driver_timestamp A driver timestamp shared by a batch of
+            particles, if None the particle stamps itself
         @retval return a raw particle if a sample was found, else None
         """
         particle = None
 
         try:
             if regex is None or regex.match(raw_data):
-                particle = particle_class(raw_data, internal_timestamp=timestamp,
-                                          preferred_timestamp=DataParticleKey.INTERNAL_TIMESTAMP,
-                                          new_sequence=self._new_sequence)
+                if driver_timestamp is None:
+                    particle = particle_class(raw_data, internal_timestamp=timestamp,
+                                              preferred_timestamp=DataParticleKey.INTERNAL_TIMESTAMP,
+                                              new_sequence=self._new_sequence)
+                else:
+                    particle = particle_class(raw_data, internal_timestamp=timestamp,
+                                              preferred_timestamp=DataParticleKey.INTERNAL_TIMESTAMP,
+                                              new_sequence=self._new_sequence,
+                                              driver_timestamp=driver_timestamp)
                 if self._new_sequence:
                     self._new_sequence = False
 
-                # need to actually parse the particle fields to find out of there are errors
+                # need to actually parse the particle fields to find out of there are errors,
+                # the JSON is kept for when the particle is published so the values are
+                # only built once, even by particles that don't keep them
                 particle.generate()
                 encoding_errors = particle.get_encoding_errors()
                 if encoding_errors:
@@ -144,7 +196,26 @@ class BufferLoadingParser(Parser):
     records from this buffer as they are requested. Parsers dont have
     to operate this way, but it can keep memory in check and smooth out
     stream inputs if they dont all come at once.
+
+    Blocks are read with the 'block_size' from the parser config, or a
+    size tuned to the records found in the file so far. The 'mmap' parser
+    config reads the blocks from a memory map of the file instead of the
+    file handle, and 'max_buffer_size' caps how much unparsed data the
+    chunker may hold; a file with more than that between records is not
+    parsed.
     """
+    # parsers of files with fixed length records may set this so the
+    # tuned block size holds a whole number of records
+    _record_size = None
+
+    # read settings, class defaults for subclasses which skip __init__
+    _block_size = None
+    _tuned_block_size = MIN_BLOCK_SIZE
+    _bytes_read = 0
+    _records_read = 0
+    _max_buffer_size = MAX_BUFFER_SIZE
+    _use_mmap = False
+    _mmap = None
 
     def __init__(self, config, stream_handle, state, sieve_fn,
                  state_callback, publish_callback, exception_callback = None):
@@ -174,6 +245,11 @@ class BufferLoadingParser(Parser):
                                                   publish_callback,
                                                   exception_callback)
 
+        # a configured block size is used as is, otherwise it is tuned as records are parsed
+        self._block_size = config.get("block_size")
+        self._max_buffer_size = config.get("max_buffer_size", MAX_BUFFER_SIZE)
+        self._use_mmap = config.get("mmap", False)
+
     def get_records(self, num_records):
         """
         Go ahead and execute the data parsing loop up to a point. This involves
@@ -248,23 +324,98 @@ class BufferLoadingParser(Parser):
         while self.get_block():
             result = self.parse_chunks()
             self._record_buffer.extend(result)
+            self._records_read += len(result)
 
-    def get_block(self, size=1024):
+    def get_block(self, size=None):
         """
         Get a block of characters for processing
-        @param size The size of the block to try to read
+        @param size The size of the block to try to read, defaults to the
+            configured or tuned block size
         @retval The length of data retreived
         @throws EOFError when the end of the file is reached
+        @throws SampleException when the chunker already holds the maximum
+            buffer size of unparsed data
         """
+        if size is None:
+            size = self._next_block_size()
+        if size <= 0:
+            raise SampleException("No record found in %d bytes of data, the max_buffer_size" %
+                                  len(self._chunker.buffer))
+
         # read in some more data
-        data = self._stream_handle.read(size)
+        data = self._read_block(size)
         if data:
+            self._bytes_read += len(data)
             self._chunker.add_chunk(data, ntplib.system_to_ntp_time(time.time()))
             return len(data)
         else: # EOF
             self.file_complete = True
+            self._close_mmap()
             raise EOFError
 
+    def _next_block_size(self):
+        """
+        @retval The size of the next block to read. This is the configured
+            block size, or one tuned to the records parsed so far, reduced so
+            the chunker does not hold more than the maximum buffer size of
+            unparsed data, 0 once it does.
+        """
+        size = self._block_size
+        if not size:
+            size = auto_block_size(self._bytes_read, self._records_read,
+                                   self._tuned_block_size, self._record_size)
+            if self._bytes_read:
+                self._tuned_block_size = size
+            else:
+                # nothing read yet, start small
+                size = self._tuned_block_size
+
+        room = self._max_buffer_size - len(self._chunker.buffer)
+        if room < size:
+            log.debug("Chunker holds %d unparsed bytes, reducing block size", len(self._chunker.buffer))
+            return max(room, 0)
+        return size
+
+    def _read_block(self, size):
+        """
+        Read a block from the file handle or its memory map. Reads from the
+        memory map move the file handle position too, so parsers can still
+        use tell() and seek() on the file handle. The map does not grow with
+        the file, so past its end the file handle is read and the file is
+        mapped again on the next read.
+        @param size The maximum number of bytes to read
+        @retval The data read, an empty string at the end of the file
+        """
+        if self._use_mmap and self._mmap is None:
+            try:
+                self._mmap = mmap.mmap(self._stream_handle.fileno(), 0, access=mmap.ACCESS_READ)
+            except (AttributeError, ValueError, EnvironmentError) as e:
+                # not a real file, or an empty one, read from the file handle
+                log.debug("Unable to memory map the file, reading it instead: %s", e)
+                self._use_mmap = False
+
+        if self._mmap is None:
+            return self._stream_handle.read(size)
+
+        position = self._stream_handle.tell()
+        if position >= len(self._mmap):
+            # data may have been added to the file since it was mapped
+            self._close_mmap()
+            return self._stream_handle.read(size)
+
+        data = self._mmap[position:position + size]
+        self._stream_handle.seek(position + len(data))
+        return data
+
+    def _close_mmap(self):
+        """
+        Release the memory map of the file, if there is one. It is mapped
+        again if the parser is asked to read after the end of the file.
+        """
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
     def parse_chunks(self):
         """
         Parse out any pending data chunks in the chunker. If
@@ -13,7 +13,6 @@ __author__ = 'Christopher Mueller, Jonathan Newbrough, Steve Foley'
 __license__ = 'Apache 2.0'
 
 import os
-import glob
 import hashlib
 import time
 import re
@@ -22,7 +21,7 @@ from threading import Thread
 from gevent.event import Event
 
 from mi.core.log import get_logger ; log = get_logger()
-from mi.core.poller import DirectoryPoller, ConditionPoller
+from mi.core.poller import DirectoryPoller, ConditionPoller, DirectoryIndex
 from mi.core.common import BaseEnum
 from mi.dataset.dataset_driver import DriverStateKey
 
@@ -51,6 +50,20 @@ class Harvester(object):
 # used to determine if we should do integer sorting of the files
 NUMBER_UNDERSCORE_MATCHER = re.compile(r'_\d')
 
+# bytes read at a time when computing checksums
+CHECKSUM_BLOCK_SIZE = 1024 * 1024
+
+def file_checksum(path):
+    """
+    @param path The path of the file
+    @retval The hex md5 checksum of the file, read a block at a time
+    """
+    md5 = hashlib.md5()
+    with open(path, 'rb') as filehandle:
+        for block in iter(lambda: filehandle.read(CHECKSUM_BLOCK_SIZE), ''):
+            md5.update(block)
+    return md5.hexdigest()
+
 class SingleDirectoryPoller(ConditionPoller):
     """
     Monitor a single directory to see if new files have appeared or if files have changed.
@@ -74,24 +87,39 @@ class SingleDirectoryPoller(ConditionPoller):
         log.debug("Start directory poller path: %s, pattern: %s", directory, wildcard)
         self._found_file_state = memento
         # driver state is not a new instance of memento, it is the same here as in the driver
+        self._directory = directory
         self._path = directory + '/' + wildcard
         log.debug("Starting harvester with directory pattern: %s", self._path)
 
-        # this queue holds the names of the files that have been sent to the driver.  Each time the harvester
-        # restarts, the queue is emptied so all files that have not been ingested can be added and sent again,
+        # only files which changed since the last poll are looked at, plus the files which were too
+        # recently modified to be looked at then
+        self._index = DirectoryIndex(directory, wildcard)
+        self._waiting_files = set()
+
+        # this holds the names of the files that have been sent to the driver.  Each time the harvester
+        # restarts, it is emptied so all files that have not been ingested can be added and sent again,
         # but this keeps the harvester from sending the same files over and over to not be put in the driver queue
-        self.sent_to_driver_queue = []
+        self.sent_to_driver_queue = set()
         super(SingleDirectoryPoller,self).__init__(self._check_for_files, callback,
                                                    exception_callback, interval)
 
+    def run(self):
+        try:
+            super(SingleDirectoryPoller, self).run()
+        finally:
+            self._index.close()
+
     def _check_for_files(self):
         """
         Find any new or modified files and update the harvester state
         """
-        filenames = []
+        # the index finds the files changed since the last poll, files which were modified too
+        # recently to check then are still waiting
+        self._waiting_files.update(self._index.changes())
+        file_stats = self._index.stats
+        self._waiting_files.intersection_update(file_stats)
 
-        if os.path.exists(os.path.dirname(self._path)):
-            filenames = glob.glob(self._path)
+        filenames = [os.path.join(self._directory, file_name) for file_name in self._waiting_files]
 
         # if there are underscores in the filename, sort by ascii rather than 
         if len(filenames) > 0:
@@ -102,22 +130,22 @@ class SingleDirectoryPoller(ConditionPoller):
 
         new_files = []
         modified_state = {}
-        # loop over all files in the directory and compare their state to that in the harvester state dictionary
+        now = time.time()
+        # loop over the changed files and compare their state to that in the harvester state dictionary
         for i_file in filenames:
-            mod_time = os.path.getmtime(i_file)
+            file_name = os.path.basename(i_file)
+            (inode, file_size, mod_time) = file_stats[file_name]
             # check if the file has not been modified in the last X seconds
-            if (mod_time + self.file_mod_wait) < time.time():
-                file_name = os.path.basename(i_file)
+            if (mod_time + self.file_mod_wait) < now:
+                self._waiting_files.discard(file_name)
                 # find if this file already exists in the found files
                 if file_name in self._found_file_state and self._found_file_state[file_name][DriverStateKey.INGESTED]:
                     # this file has been ingested (file size and date will only be available for ingested files)
-                    file_size = os.path.getsize(i_file)
                     if self._found_file_state[file_name][DriverStateKey.FILE_SIZE] != file_size or \
                     self._found_file_state[file_name][DriverStateKey.FILE_MOD_DATE] != mod_time:
                        # this file has been ingested, but the file size and times don't match, confirm that
                        # the checksum is different
-                        with open(i_file, 'rb') as filehandle:
-                            md5_checksum = hashlib.md5(filehandle.read()).hexdigest()
+                        md5_checksum = file_checksum(i_file)
                         if self._found_file_state[file_name][DriverStateKey.FILE_CHECKSUM] != md5_checksum:
                             # ingested file has been modified!
                             if DriverStateKey.MODIFIED_STATE in self._found_file_state[file_name]:
@@ -128,14 +156,14 @@ class SingleDirectoryPoller(ConditionPoller):
                                 old_state[DriverStateKey.FILE_CHECKSUM] != md5_checksum:
                                     # this file has changed since its previous modification, update the
                                     # modified state
-                                    modified_state[filename] = {
+                                    modified_state[file_name] = {
                                         DriverStateKey.FILE_SIZE: file_size,
                                         DriverStateKey.FILE_MOD_DATE: mod_time,
                                         DriverStateKey.FILE_CHECKSUM: md5_checksum,
                                     }
                             else:
                                 # this is the first time this file has been modified
-                                modified_state[filename] = {
+                                modified_state[file_name] = {
                                     DriverStateKey.FILE_SIZE: file_size,
                                     DriverStateKey.FILE_MOD_DATE: mod_time,
                                     DriverStateKey.FILE_CHECKSUM: md5_checksum,
@@ -145,7 +173,7 @@ class SingleDirectoryPoller(ConditionPoller):
                     # duplicates are not sent
                     if file_name not in self.sent_to_driver_queue:
                         # only send this file once
-                        self.sent_to_driver_queue.append(file_name)
+                        self.sent_to_driver_queue.add(file_name)
                         new_files.append(file_name)
 
         log.debug('found new files: %r, modified_files: %r', new_files, modified_state)
@@ -161,23 +189,10 @@ class SingleDirectoryPoller(ConditionPoller):
         if not filenames or len(filenames) < 2:
             return filenames
 
-        # this assumes all files have the same extension
-        file_extension = filenames[0].split('.')
-        split_names = ()
-        for fn in filenames:
-            split_name = self.ascii_to_int_list(fn)
-            # append this split up name as a tuple
-            split_names = split_names + (split_name, ) 
-        # now sort all the int formatted names
-        sorted_tuple = sorted(split_names)
-        # put the filenames back to string format
-        sorted_filenames = []
-        
-        for fn in sorted_tuple:
-            # Retrieve original name from end of sorted component list
-            sorted_filenames.append(fn[len(fn) - 1])
-
-        return sorted_filenames
+        # sort the int formatted names
+        split_names = sorted(self.ascii_to_int_list(fn) for fn in filenames)
+        # Retrieve original name from end of sorted component list
+        return [split_name[-1] for split_name in split_names]
 
     @staticmethod
     def ascii_to_int_list(filename):
@@ -288,8 +303,7 @@ class SingleFilePoller(ConditionPoller):
                     if self._found_file_state[DriverStateKey.FILE_SIZE] != file_size or \
                         self._found_file_state[DriverStateKey.FILE_MOD_DATE] != mod_time:
                         # size or time is different, confirm with checksum
-                        with open(self._path, 'rb') as filehandle:
-                            md5_checksum = hashlib.md5(filehandle.read()).hexdigest()
+                        md5_checksum = file_checksum(self._path)
                         if self._found_file_state[DriverStateKey.FILE_CHECKSUM] != md5_checksum:
                             # file is different, update the state
                             self._found_file_state[DriverStateKey.FILE_SIZE] = file_size
@@ -305,8 +319,7 @@ class SingleFilePoller(ConditionPoller):
                             }
                 else:
                     # no driver state yet, first time opening this file
-                    with open(self._path, 'rb') as filehandle:
-                        md5_checksum = hashlib.md5(filehandle.read()).hexdigest()
+                    md5_checksum = file_checksum(self._path)
 
                     self._found_file_state[DriverStateKey.FILE_SIZE] = file_size
                     self._found_file_state[DriverStateKey.FILE_MOD_DATE] = mod_time
@@ -21,6 +21,7 @@ from mi.core.exceptions import SampleException
 from mi.core.common import BaseEnum
 from mi.core.instrument.chunker import BinaryChunker
 from mi.dataset.dataset_parser import BufferLoadingParser
+from mi.dataset.parser.fixed_record_common import record_indices, find_aligned_match
 
 HEADER_REGEX = b'(\x00\x01\x00{7,7}\x01\x00\x01\x00{4,4})([\x00-\xff]{8,8})'
 HEADER_MATCHER = re.compile(HEADER_REGEX)
@@ -79,18 +80,24 @@ class WfpEFileParser(BufferLoadingParser):
         raw_data_len = len(raw_data)
 
         while data_index < raw_data_len:
-            # check if this is a status or data sample message
-            if STATUS_START_MATCHER.match(raw_data[data_index:data_index+4]):
+            # check if this is a status or data sample message, records up to the
+            # next status message are all data samples
+            status_index = find_aligned_match(raw_data, STATUS_START_MATCHER, SAMPLE_BYTES, data_index)
+            if status_index == data_index:
                 return_list.append((data_index, data_index + STATUS_BYTES))
                 data_index += STATUS_BYTES
             else:
-                return_list.append((data_index, data_index + SAMPLE_BYTES))
-                data_index += SAMPLE_BYTES
+                if status_index < 0:
+                    num_samples = max((raw_data_len - data_index) / SAMPLE_BYTES, 1)
+                else:
+                    num_samples = (status_index - data_index) / SAMPLE_BYTES
+                return_list.extend(record_indices(data_index, num_samples, SAMPLE_BYTES))
+                data_index += num_samples * SAMPLE_BYTES
 
             remain_bytes = raw_data_len - data_index
             # if the remaining bytes are less than the data sample bytes, all we might have left is a status sample, if we don't we're done
             if remain_bytes < STATUS_BYTES or (remain_bytes < SAMPLE_BYTES and remain_bytes >= STATUS_BYTES and \
-            not STATUS_START_MATCHER.match(raw_data[data_index:data_index+4])):
+            not STATUS_START_MATCHER.match(raw_data, data_index)):
                 break
         log.debug("returning sieve list %s", return_list)
         return return_list
@@ -32,6 +32,7 @@ from mi.core.common import BaseEnum
 from mi.core.exceptions import SampleException, DatasetParserException
 from mi.core.instrument.chunker import StringChunker
 from mi.core.instrument.data_particle import DataParticle, DataParticleKey
+from mi.core.instrument.pd0 import Pd0Record, Pd0Ensemble, Pd0DataTypeId, decode_cell_array
 from mi.dataset.dataset_parser import BufferLoadingParser
 
 # start the logger
@@ -54,6 +55,50 @@ ADCPA_PD0_PARSED_REGEX = (
 )
 ADCPA_PD0_PARSED_MATCHER = re.compile(ADCPA_PD0_PARSED_REGEX, re.DOTALL)
 
+# Layouts of the fixed size data types in the ADCPA ensembles
+ADCPA_FIXED_LEADER = Pd0Record('AdcpaFixedLeader', '<HBBHBBBBHHHBBBBHBBBBhhBBHHBBBBHQHBBI',
+    ('fixed_leader_id', 'firmware_version', 'firmware_revision', 'sysconfig_frequency',
+     'data_flag', 'lag_length', 'num_beams', 'num_cells', 'pings_per_ensemble',
+     'depth_cell_length', 'blank_after_transmit', 'signal_processing_mode',
+     'low_corr_threshold', 'num_code_repetitions', 'percent_good_min', 'error_vel_threshold',
+     'time_per_ping_minutes', 'time_per_ping_seconds', 'time_per_ping_hundredths',
+     'coord_transform_type', 'heading_alignment', 'heading_bias', 'sensor_source',
+     'sensor_available', 'bin_1_distance', 'transmit_pulse_length', 'reference_layer_start',
+     'reference_layer_stop', 'false_target_threshold', 'spare1', 'transmit_lag_distance',
+     'spare2', 'system_bandwidth', 'spare3', 'spare4', 'serial_number'))
+
+ADCPA_VARIABLE_LEADER = Pd0Record('AdcpaVariableLeader', '<HHBBBBBBBBBBHHHhhHhBBBBBBBBBBBBBBBBBBHIII',
+    ('variable_leader_id', 'ensemble_number', 'rtc_year', 'rtc_month', 'rtc_day', 'rtc_hour',
+     'rtc_minute', 'rtc_second', 'rtc_hundredths', 'ensemble_number_increment',
+     'error_bit_field', 'reserved_error_bit_field', 'speed_of_sound', 'transducer_depth',
+     'heading', 'pitch', 'roll', 'salinity', 'temperature', 'mpt_minutes',
+     'mpt_seconds_component', 'mpt_hundredths_component', 'heading_stdev', 'pitch_stdev',
+     'roll_stdev', 'adc_transmit_current', 'adc_transmit_voltage', 'adc_ambient_temp',
+     'adc_pressure_plus', 'adc_pressure_minus', 'adc_attitude_temp', 'adc_attitude',
+     'adc_contamination_sensor', 'error_status_word_1', 'error_status_word_2',
+     'error_status_word_3', 'error_status_word_4', 'spare1', 'pressure', 'pressure_variance',
+     'spare2'))
+
+ADCPA_BOTTOM_TRACK = Pd0Record('AdcpaBottomTrack', '<HHHBBBBHLHHHHhhhhBBBBBBBBBBBBHHHhhhhBBBBBBBBBBBBHBBBBBBBBB',
+    ('bottom_track_id', 'bt_pings_per_ensemble', 'bt_delay_before_reacquire',
+     'bt_corr_magnitude_min', 'bt_eval_magnitude_min', 'bt_percent_good_min', 'bt_mode',
+     'bt_error_velocity_max', 'reserved', 'beam1_bt_range_lsb', 'beam2_bt_range_lsb',
+     'beam3_bt_range_lsb', 'beam4_bt_range_lsb', 'eastward_bt_velocity',
+     'northward_bt_velocity', 'upward_bt_velocity', 'error_bt_velocity',
+     'beam1_bt_correlation', 'beam2_bt_correlation', 'beam3_bt_correlation',
+     'beam4_bt_correlation', 'beam1_eval_amp', 'beam2_eval_amp', 'beam3_eval_amp',
+     'beam4_eval_amp', 'beam1_bt_percent_good', 'beam2_bt_percent_good',
+     'beam3_bt_percent_good', 'beam4_bt_percent_good', 'ref_layer_min', 'ref_layer_near',
+     'ref_layer_far', 'beam1_ref_layer_velocity', 'beam2_ref_layer_velocity',
+     'beam3_ref_layer_velocity', 'beam4_ref_layer_velocity', 'beam1_ref_correlation',
+     'beam2_ref_correlation', 'beam3_ref_correlation', 'beam4_ref_correlation',
+     'beam1_ref_intensity', 'beam2_ref_intensity', 'beam3_ref_intensity',
+     'beam4_ref_intensity', 'beam1_ref_percent_good', 'beam2_ref_percent_good',
+     'beam3_ref_percent_good', 'beam4_ref_percent_good', 'bt_max_depth',
+     'beam1_rssi_amplitude', 'beam2_rssi_amplitude', 'beam3_rssi_amplitude',
+     'beam4_rssi_amplitude', 'bt_gain', 'beam1_bt_range_msb', 'beam2_bt_range_msb',
+     'beam3_bt_range_msb', 'beam4_bt_range_msb'))
+
 
 ###############################################################################
 # Data Particles
@@ -281,103 +326,63 @@ class ADCPA_PD0_PARSED_DataParticle(DataParticle):
         """
         self.final_result = []
 
-        length = unpack("<H", self.raw_data[2:4])[0]
-        data = str(self.raw_data)
-
-        # Calculate the checksum
-        total = int(0)
-        for i in range(0, length):
-            total += int(ord(data[i]))
-
-        checksum = total & 65535    # bitwise and with 65535 or mod vs 65536
-
-        if checksum != unpack("<H", self.raw_data[length: length+2])[0]:
-            log.debug("Checksum mismatch " + str(checksum) + " != "
-                      + str(unpack("<H", self.raw_data[length: length+2])[0]))
-            raise SampleException("Checksum mismatch")
+        ensemble = Pd0Ensemble(self.raw_data)
+        checksum = ensemble.verify_checksum()
 
         # save the checksum and process the remainder of the ensemble
         self.final_result.append({DataParticleKey.VALUE_ID: ADCPA_PD0_PARSED_KEY.CHECKSUM,
                                   DataParticleKey.VALUE: checksum})
 
-        (header_id, data_source_id, num_bytes, spare, num_data_types) = \
-            unpack('<BBHBB', self.raw_data[0:6])
-
+        header = ensemble.header
         self.final_result.append({DataParticleKey.VALUE_ID: ADCPA_PD0_PARSED_KEY.HEADER_ID,
-                                  DataParticleKey.VALUE: header_id})
+                                  DataParticleKey.VALUE: header.header_id})
         self.final_result.append({DataParticleKey.VALUE_ID: ADCPA_PD0_PARSED_KEY.DATA_SOURCE_ID,
-                                  DataParticleKey.VALUE: data_source_id})
+                                  DataParticleKey.VALUE: header.data_source_id})
         self.final_result.append({DataParticleKey.VALUE_ID: ADCPA_PD0_PARSED_KEY.NUM_BYTES,
-                                  DataParticleKey.VALUE: num_bytes})
+                                  DataParticleKey.VALUE: header.num_bytes})
         self.final_result.append({DataParticleKey.VALUE_ID: ADCPA_PD0_PARSED_KEY.NUM_DATA_TYPES,
-                                  DataParticleKey.VALUE: num_data_types})
-
-        offsets = []    # create list for offsets
-        strt = 6        # offsets start at byte 6 (using 0 indexing)
-        nDT = 1         # counter for n data types
-        while nDT <= num_data_types:
-            value = unpack('<H', self.raw_data[strt:strt+2])[0]
-            offsets.append(value)
-            strt += 2
-            nDT += 1
+                                  DataParticleKey.VALUE: header.num_data_types})
 
         self.final_result.append({DataParticleKey.VALUE_ID: ADCPA_PD0_PARSED_KEY.OFFSET_DATA_TYPES,
-                                  DataParticleKey.VALUE: offsets})
+                                  DataParticleKey.VALUE: ensemble.offsets})
 
-        for offset in offsets:
+        for index in range(0, len(ensemble)):
             # for each offset, using the starting byte, determine the data type
             # and then parse accordingly.
-            data_type = unpack('<H', self.raw_data[offset:offset+2])[0]
+            data_type = ensemble.data_type_id(index)
 
             # fixed leader data (x00x00)
-            if data_type == 0:
-                chunk = self.raw_data[offset:offset+58]
-                self.parse_fixed_chunk(chunk)
+            if data_type == Pd0DataTypeId.FIXED_LEADER:
+                self.parse_fixed_chunk(ensemble.chunk(index, ADCPA_FIXED_LEADER.size))
                 iCells = self.num_depth_cells   # grab the # of depth cells
                                                 # obtained from the fixed leader
                                                 # data type
 
             # variable leader data (x80x00)
-            if data_type == 128:
-                chunk = self.raw_data[offset:offset+60]
-                self.parse_variable_chunk(chunk)
+            if data_type == Pd0DataTypeId.VARIABLE_LEADER:
+                self.parse_variable_chunk(ensemble.chunk(index, ADCPA_VARIABLE_LEADER.size))
 
             # velocity data (x00x01)
-            if data_type == 256:
+            if data_type == Pd0DataTypeId.VELOCITY:
                 # number of bytes is a function of the user selectable number of
                 # depth cells (WN command), calculated above
-                nBytes = 2 + 8 * iCells
-                chunk = self.raw_data[offset:offset+nBytes]
-                self.parse_velocity_chunk(chunk)
+                self.parse_velocity_chunk(ensemble.chunk(index, 2 + 8 * iCells))
 
             # correlation magnitude data (x00x02)
-            if data_type == 512:
-                # number of bytes is a function of the user selectable number of
-                # depth cells (WN command), calculated above
-                nBytes = 2 + 4 * iCells
-                chunk = self.raw_data[offset:offset+nBytes]
-                self.parse_corelation_magnitude_chunk(chunk)
+            if data_type == Pd0DataTypeId.CORRELATION_MAGNITUDE:
+                self.parse_corelation_magnitude_chunk(ensemble.chunk(index, 2 + 4 * iCells))
 
             # echo intensity data (x00x03)
-            if data_type == 768:
-                # number of bytes is a function of the user selectable number of
-                # depth cells (WN command), calculated above
-                nBytes = 2 + 4 * iCells
-                chunk = self.raw_data[offset:offset+nBytes]
-                self.parse_echo_intensity_chunk(chunk)
+            if data_type == Pd0DataTypeId.ECHO_INTENSITY:
+                self.parse_echo_intensity_chunk(ensemble.chunk(index, 2 + 4 * iCells))
 
             # percent-good data (x00x04)
-            if data_type == 1024:
-                # number of bytes is a function of the user selectable number of
-                # depth cells (WN command), calculated above
-                nBytes = 2 + 4 * iCells
-                chunk = self.raw_data[offset:offset+nBytes]
-                self.parse_percent_good_chunk(chunk)
+            if data_type == Pd0DataTypeId.PERCENT_GOOD:
+                self.parse_percent_good_chunk(ensemble.chunk(index, 2 + 4 * iCells))
 
             # bottom track data (x00x06)
-            if data_type == 1536:
-                chunk = self.raw_data[offset:offset+81]
-                self.parse_bottom_track_chunk(chunk)
+            if data_type == Pd0DataTypeId.BOTTOM_TRACK:
+                self.parse_bottom_track_chunk(ensemble.chunk(index, ADCPA_BOTTOM_TRACK.size))
 
         return self.final_result
 
@@ -397,8 +402,7 @@ class ADCPA_PD0_PARSED_DataParticle(DataParticle):
          bin_1_distance, transmit_pulse_length, reference_layer_start,
          reference_layer_stop, false_target_threshold, SPARE1,
          transmit_lag_distance, SPARE2, system_bandwidth,
-         SPARE3, SPARE4, serial_number) = \
-            unpack('<HBBHBBBBHHHBBBBHBBBBhhBBHHBBBBHQHBBI', chunk)
+         SPARE3, SPARE4, serial_number) = ADCPA_FIXED_LEADER.unpack(chunk)
 
         if 0 != fixed_leader_id:
             raise SampleException("fixed_leader_id was not equal to 0")
@@ -539,8 +543,7 @@ class ADCPA_PD0_PARSED_DataParticle(DataParticle):
          adc_pressure_plus, adc_pressure_minus, adc_attitude_temp,
          adc_attitiude, adc_contamination_sensor, error_status_word_1,
          error_status_word_2, error_status_word_3, error_status_word_4,
-         SPARE1, pressure, pressure_variance, SPARE2) = \
-            unpack('<HHBBBBBBBBBBHHHhhHhBBBBBBBBBBBBBBBBBBHIII', chunk)
+         SPARE1, pressure, pressure_variance, SPARE2) = ADCPA_VARIABLE_LEADER.unpack(chunk)
 
         if 128 != variable_leader_id:
             raise SampleException("variable_leader_id was not equal to 128")
@@ -667,7 +670,6 @@ class ADCPA_PD0_PARSED_DataParticle(DataParticle):
         @throws SampleException If there is a problem with sample creation
         """
         N = (len(chunk) - 2) / 2 / 4
-        offset = 0
 
         velocity_data_id = unpack("<H", chunk[0:2])[0]
         if 256 != velocity_data_id:
@@ -676,17 +678,8 @@ class ADCPA_PD0_PARSED_DataParticle(DataParticle):
         self.final_result.append({DataParticleKey.VALUE_ID: ADCPA_PD0_PARSED_KEY.VELOCITY_DATA_ID,
                                   DataParticleKey.VALUE: velocity_data_id})
 
-        water_velocity_east = []
-        water_velocity_north = []
-        water_velocity_up = []
-        error_velocity = []
-        for row in range(0, N):
-            (a, b, c, d) = unpack('<hhhh', chunk[offset + 2: offset + 10])
-            water_velocity_east.append(a)
-            water_velocity_north.append(b)
-            water_velocity_up.append(c)
-            error_velocity.append(d)
-            offset += 4 * 2
+        (water_velocity_east, water_velocity_north,
+         water_velocity_up, error_velocity) = decode_cell_array(chunk, '<i2', N)
         self.final_result.append({DataParticleKey.VALUE_ID: ADCPA_PD0_PARSED_KEY.WATER_VELOCITY_EAST,
                                   DataParticleKey.VALUE: water_velocity_east})
         self.final_result.append({DataParticleKey.VALUE_ID: ADCPA_PD0_PARSED_KEY.WATER_VELOCITY_NORTH,
@@ -703,7 +696,6 @@ class ADCPA_PD0_PARSED_DataParticle(DataParticle):
         @throws SampleException If there is a problem with sample creation
         """
         N = (len(chunk) - 2) / 4
-        offset = 0
 
         correlation_magnitude_id = unpack("<H", chunk[0:2])[0]
         if 512 != correlation_magnitude_id:
@@ -712,17 +704,8 @@ class ADCPA_PD0_PARSED_DataParticle(DataParticle):
         self.final_result.append({DataParticleKey.VALUE_ID: ADCPA_PD0_PARSED_KEY.CORRELATION_MAGNITUDE_ID,
                                   DataParticleKey.VALUE: correlation_magnitude_id})
 
-        correlation_magnitude_beam1 = []
-        correlation_magnitude_beam2 = []
-        correlation_magnitude_beam3 = []
-        correlation_magnitude_beam4 = []
-        for row in range(0, N):
-            (a, b, c, d) = unpack('<BBBB', chunk[offset + 2: offset + 6])
-            correlation_magnitude_beam1.append(a)
-            correlation_magnitude_beam2.append(b)
-            correlation_magnitude_beam3.append(c)
-            correlation_magnitude_beam4.append(d)
-            offset += 4
+        (correlation_magnitude_beam1, correlation_magnitude_beam2,
+         correlation_magnitude_beam3, correlation_magnitude_beam4) = decode_cell_array(chunk, 'u1', N)
 
         self.final_result.append({DataParticleKey.VALUE_ID: ADCPA_PD0_PARSED_KEY.CORRELATION_MAGNITUDE_BEAM1,
                                   DataParticleKey.VALUE: correlation_magnitude_beam1})
@@ -740,7 +723,6 @@ class ADCPA_PD0_PARSED_DataParticle(DataParticle):
         @throws SampleException If there is a problem with sample creation
         """
         N = (len(chunk) - 2) / 4
-        offset = 0
 
         echo_intensity_id = unpack("<H", chunk[0:2])[0]
         if 768 != echo_intensity_id:
@@ -748,17 +730,8 @@ class ADCPA_PD0_PARSED_DataParticle(DataParticle):
         self.final_result.append({DataParticleKey.VALUE_ID: ADCPA_PD0_PARSED_KEY.ECHO_INTENSITY_ID,
                                   DataParticleKey.VALUE: echo_intensity_id})
 
-        echo_intesity_beam1 = []
-        echo_intesity_beam2 = []
-        echo_intesity_beam3 = []
-        echo_intesity_beam4 = []
-        for row in range(0, N):
-            (a, b, c, d) = unpack('<BBBB', chunk[offset + 2: offset + 6])
-            echo_intesity_beam1.append(a)
-            echo_intesity_beam2.append(b)
-            echo_intesity_beam3.append(c)
-            echo_intesity_beam4.append(d)
-            offset += 4
+        (echo_intesity_beam1, echo_intesity_beam2,
+         echo_intesity_beam3, echo_intesity_beam4) = decode_cell_array(chunk, 'u1', N)
 
         self.final_result.append({DataParticleKey.VALUE_ID: ADCPA_PD0_PARSED_KEY.ECHO_INTENSITY_BEAM1,
                                   DataParticleKey.VALUE: echo_intesity_beam1})
@@ -776,7 +749,6 @@ class ADCPA_PD0_PARSED_DataParticle(DataParticle):
         @throws SampleException If there is a problem with sample creation
         """
         N = (len(chunk) - 2) / 4
-        offset = 0
 
         percent_good_id = unpack("<H", chunk[0:2])[0]
         if 1024 != percent_good_id:
@@ -785,17 +757,8 @@ class ADCPA_PD0_PARSED_DataParticle(DataParticle):
         self.final_result.append({DataParticleKey.VALUE_ID: ADCPA_PD0_PARSED_KEY.PERCENT_GOOD_ID,
                                   DataParticleKey.VALUE: percent_good_id})
 
-        percent_good_3beam = []
-        percent_transforms_reject = []
-        percent_bad_beams = []
-        percent_good_4beam = []
-        for row in range(0, N):
-            (a, b, c, d) = unpack('<BBBB', chunk[offset + 2: offset + 6])
-            percent_good_3beam.append(a)
-            percent_transforms_reject.append(b)
-            percent_bad_beams.append(c)
-            percent_good_4beam.append(d)
-            offset += 4
+        (percent_good_3beam, percent_transforms_reject,
+         percent_bad_beams, percent_good_4beam) = decode_cell_array(chunk, 'u1', N)
         self.final_result.append({DataParticleKey.VALUE_ID: ADCPA_PD0_PARSED_KEY.PERCENT_GOOD_3BEAM,
                                   DataParticleKey.VALUE: percent_good_3beam})
         self.final_result.append({DataParticleKey.VALUE_ID: ADCPA_PD0_PARSED_KEY.PERCENT_TRANSFORMS_REJECT,
@@ -829,8 +792,7 @@ class ADCPA_PD0_PARSED_DataParticle(DataParticle):
          beam4_ref_percent_good, bt_max_depth, beam1_rssi_amplitude,
          beam2_rssi_amplitude, beam3_rssi_amplitude, beam4_rssi_amplitude,
          bt_gain, beam1_bt_range_msb, beam2_bt_range_msb, beam3_bt_range_msb,
-         beam4_bt_range_msb) = \
-            unpack('<HHHBBBBHLHHHHhhhhBBBBBBBBBBBBHHHhhhhBBBBBBBBBBBBHBBBBBBBBB', chunk)
+         beam4_bt_range_msb) = ADCPA_BOTTOM_TRACK.unpack(chunk)
 
         if 1536 != bottom_track_id:
             raise SampleException("bottom_track_id was not equal to 1536")
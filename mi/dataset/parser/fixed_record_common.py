@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+
+"""
+@package mi.dataset.parser.fixed_record_common
+@file mi/dataset/parser/fixed_record_common.py
+@brief Helpers for sieving binary files made of fixed length records, such
+    as the wire following profiler files. Record boundaries are computed
+    from the record size, and markers are located with one search over the
+    buffer instead of slicing and matching every record.
+"""
+
+__license__ = 'Apache 2.0'
+
+
+def record_indices(start, count, record_size):
+    """
+    Compute the boundaries of consecutive fixed length records
+    @param start The index of the first record
+    @param count The number of records
+    @param record_size The number of bytes in each record
+    @retval A list of (start, end) index tuples, one per record
+    """
+    return [(index, index + record_size) for index in
+            xrange(start, start + count * record_size, record_size)]
+
+
+def find_aligned(raw_data, marker, record_size, start=0):
+    """
+    Find the first record which starts with a marker string
+    @param raw_data The data to search
+    @param marker The string the record starts with, i.e. a run of \xff
+    @param record_size The number of bytes in each record
+    @param start The index of the record to start searching from
+    @retval The index of the record starting with the marker, or -1
+    """
+    index = raw_data.find(marker, start)
+    while index >= 0 and (index - start) % record_size:
+        # this match is inside a record, keep looking
+        index = raw_data.find(marker, index + 1)
+    return index
+
+
+def find_aligned_match(raw_data, matcher, record_size, start=0):
+    """
+    Find the first record which starts with a regex match
+    @param raw_data The data to search
+    @param matcher The compiled regex the record must start with
+    @param record_size The number of bytes in each record
+    @param start The index of the record to start searching from
+    @retval The index of the record starting with the match, or -1
+    """
+    match = matcher.search(raw_data, start)
+    while match and (match.start(0) - start) % record_size:
+        match = matcher.search(raw_data, match.start(0) + 1)
+    if match:
+        return match.start(0)
+    return -1
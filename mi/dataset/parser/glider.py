@@ -17,12 +17,13 @@ from datetime import datetime
 
 from math import copysign
 from functools import partial
+from operator import itemgetter
 
 from mi.core.log import get_logger
 from mi.core.common import BaseEnum
 from mi.core.exceptions import SampleException, DatasetParserException, UnexpectedDataException
 from mi.core.instrument.chunker import StringChunker
-from mi.core.instrument.data_particle import DataParticle, DataParticleKey
+from mi.core.instrument.data_particle import CompactDataParticle, DataParticleKey
 from mi.dataset.dataset_parser import BufferLoadingParser
 
 # start the logger
@@ -72,7 +73,7 @@ class GliderParticleKey(BaseEnum):
 
         return result
 
-class GliderParticle(DataParticle):
+class GliderParticle(CompactDataParticle):
     """
     Base particle for glider data. Glider files are
     publishing as a particle rather than a raw data string. This is in
@@ -80,8 +81,11 @@ class GliderParticle(DataParticle):
     hard code >2000 variables in a regex.
 
     This class should be a parent class to all the data particle classes
-    associated with the glider.
+    associated with the glider. A glider file turns into a great many
+    particles, so they are compact particles; subclasses need to define
+    an empty __slots__ to stay that way.
     """
+    __slots__ = ()
 
     # It is possible that record could be parsed, but they don't
     # contain actual science data for this instrument. This flag
@@ -90,6 +94,9 @@ class GliderParticle(DataParticle):
 
     def _parsed_values(self, key_list):
         log.debug(" # GliderParticle._parsed_values(): Build a particle with keys: %s", key_list)
+        if isinstance(self.raw_data, GliderRecord):
+            return self._record_values(key_list)
+
         if not isinstance(self.raw_data, dict):
             raise SampleException(
                 "%s: Object Instance is not a Glider Parsed Data \
@@ -130,6 +137,24 @@ class GliderParticle(DataParticle):
 
         return result
 
+    def _record_values(self, key_list):
+        """
+        Build the particle values from a converted data row. The columns of
+        the key list are looked up once per particle class for each file.
+        @param key_list The particle keys, which are fixed for each particle class
+        @retval A list of value dictionaries, NaN values are replaced with None
+        """
+        values = self.raw_data.values
+        result = []
+        for (key, index) in self.raw_data.plan.columns(self.__class__, key_list):
+            value = values[index]
+            # NaN is the only value not equal to itself
+            if value != value:
+                value = None
+            result.append({DataParticleKey.VALUE_ID: key,
+                           DataParticleKey.VALUE: value})
+        return result
+
 class CtdgvParticleKey(GliderParticleKey):
     # science data made available via telemetry or Glider recovery
     SCI_CTD41CP_TIMESTAMP = 'sci_ctd41cp_timestamp'
@@ -139,8 +164,10 @@ class CtdgvParticleKey(GliderParticleKey):
 
 
 class CtdgvDataParticle(GliderParticle):
+    __slots__ = ()
     _data_particle_type = DataParticleType.CTDGV_M_GLIDER_INSTRUMENT
     science_parameters = CtdgvParticleKey.science_parameter_list()
+    parameters = CtdgvParticleKey.list()
 
     def _build_parsed_values(self):
         """
@@ -149,7 +176,7 @@ class CtdgvDataParticle(GliderParticle):
 
         @param result A returned list with sub dictionaries of the data
         """
-        return self._parsed_values(CtdgvParticleKey.list())
+        return self._parsed_values(self.parameters)
 
 
 class DostaTelemeteredParticleKey(GliderParticleKey):
@@ -177,8 +204,10 @@ class DostaRecoveredParticleKey(GliderParticleKey):
 
 
 class DostaTelemeteredDataParticle(GliderParticle):
+    __slots__ = ()
     _data_particle_type = DataParticleType.DOSTA_ABCDJM_GLIDER_INSTRUMENT
     science_parameters = DostaTelemeteredParticleKey.science_parameter_list()
+    parameters = DostaTelemeteredParticleKey.list()
 
     def _build_parsed_values(self):
         """
@@ -188,12 +217,14 @@ class DostaTelemeteredDataParticle(GliderParticle):
         @param gpd A GliderParser class instance.
         @param result A returned list with sub dictionaries of the data
         """
-        return self._parsed_values(DostaTelemeteredParticleKey.list())
+        return self._parsed_values(self.parameters)
 
 
 class DostaRecoveredDataParticle(GliderParticle):
+    __slots__ = ()
     _data_particle_type = DataParticleType.DOSTA_ABCDJM_GLIDER_RECOVERED
     science_parameters = DostaRecoveredParticleKey.science_parameter_list()
+    parameters = DostaRecoveredParticleKey.list()
 
     def _build_parsed_values(self):
         """
@@ -203,7 +234,7 @@ class DostaRecoveredDataParticle(GliderParticle):
         @param gpd A GliderParser class instance.
         @param result A returned list with sub dictionaries of the data
         """
-        return self._parsed_values(DostaRecoveredParticleKey.list())
+        return self._parsed_values(self.parameters)
 
 
 class FlordParticleKey(GliderParticleKey):
@@ -219,8 +250,10 @@ class FlordParticleKey(GliderParticleKey):
 
 
 class FlordDataParticle(GliderParticle):
+    __slots__ = ()
     _data_particle_type = DataParticleType.FLORD_M_GLIDER_INSTRUMENT
     science_parameters = FlordParticleKey.science_parameter_list()
+    parameters = FlordParticleKey.list()
 
     def _build_parsed_values(self):
         """
@@ -231,7 +264,7 @@ class FlordDataParticle(GliderParticle):
         @throws SampleException if the data is not a glider data dictionary
             produced by GliderParser._read_data
         """
-        return self._parsed_values(FlordParticleKey.list())
+        return self._parsed_values(self.parameters)
 
 
 class FlortTelemeteredParticleKey(GliderParticleKey):
@@ -254,8 +287,10 @@ class FlortRecoveredParticleKey(GliderParticleKey):
 
 
 class FlortTelemeteredDataParticle(GliderParticle):
+    __slots__ = ()
     _data_particle_type = DataParticleType.FLORT_M_GLIDER_INSTRUMENT
     science_parameters = FlortTelemeteredParticleKey.science_parameter_list()
+    parameters = FlortTelemeteredParticleKey.list()
 
     def _build_parsed_values(self):
         """
@@ -266,12 +301,14 @@ class FlortTelemeteredDataParticle(GliderParticle):
         @throws SampleException if the data is not a glider data dictionary
             produced by GliderParser._read_data
         """
-        return self._parsed_values(FlortTelemeteredParticleKey.list())
+        return self._parsed_values(self.parameters)
 
 
 class FlortRecoveredDataParticle(GliderParticle):
+    __slots__ = ()
     _data_particle_type = DataParticleType.FLORT_M_GLIDER_RECOVERED
     science_parameters = FlortRecoveredParticleKey.science_parameter_list()
+    parameters = FlortRecoveredParticleKey.list()
 
     def _build_parsed_values(self):
         """
@@ -282,7 +319,7 @@ class FlortRecoveredDataParticle(GliderParticle):
         @throws SampleException if the data is not a glider data dictionary
             produced by GliderParser._read_data
         """
-        return self._parsed_values(FlortRecoveredParticleKey.list())
+        return self._parsed_values(self.parameters)
 
 
 class ParadTelemeteredParticleKey(GliderParticleKey):
@@ -299,8 +336,10 @@ class ParadRecoveredParticleKey(GliderParticleKey):
 
 
 class ParadTelemeteredDataParticle(GliderParticle):
+    __slots__ = ()
     _data_particle_type = DataParticleType.PARAD_M_GLIDER_INSTRUMENT
     science_parameters = ParadTelemeteredParticleKey.science_parameter_list()
+    parameters = ParadTelemeteredParticleKey.list()
 
     def _build_parsed_values(self):
         """
@@ -311,12 +350,14 @@ class ParadTelemeteredDataParticle(GliderParticle):
         @throws SampleException if the data is not a glider data dictionary
             produced by GliderParser._read_data
         """
-        return self._parsed_values(ParadTelemeteredParticleKey.list())
+        return self._parsed_values(self.parameters)
 
 
 class ParadRecoveredDataParticle(GliderParticle):
+    __slots__ = ()
     _data_particle_type = DataParticleType.PARAD_M_GLIDER_RECOVERED
     science_parameters = ParadRecoveredParticleKey.science_parameter_list()
+    parameters = ParadRecoveredParticleKey.list()
 
     def _build_parsed_values(self):
         """
@@ -327,7 +368,7 @@ class ParadRecoveredDataParticle(GliderParticle):
         @throws SampleException if the data is not a glider data dictionary
             produced by GliderParser._read_data
         """
-        return self._parsed_values(ParadRecoveredParticleKey.list())
+        return self._parsed_values(self.parameters)
 
 
 class EngineeringRecoveredParticleKey(GliderParticleKey):
@@ -663,6 +704,7 @@ class EngineeringScienceTelemeteredParticleKey(GliderParticleKey):
 
 
 class EngineeringTelemeteredDataParticle(GliderParticle):
+    __slots__ = ()
     _data_particle_type = DataParticleType.GLIDER_ENG_TELEMETERED
     science_parameters = EngineeringTelemeteredParticleKey.science_parameter_list()
     
@@ -683,6 +725,7 @@ class EngineeringTelemeteredDataParticle(GliderParticle):
         return self._parsed_values(EngineeringTelemeteredDataParticle.keys_exclude_sci_times)
 
 class EngineeringMetadataDataParticle(GliderParticle):
+    __slots__ = ()
     _data_particle_type = DataParticleType.GLIDER_ENG_METADATA
 
     def _build_parsed_values(self):
@@ -698,6 +741,7 @@ class EngineeringMetadataDataParticle(GliderParticle):
         return self._parsed_values(EngineeringMetadataParticleKey.list())
 
 class EngineeringScienceTelemeteredDataParticle(GliderParticle):
+    __slots__ = ()
     _data_particle_type = DataParticleType.GLIDER_ENG_SCI_TELEMETERED
     science_parameters = EngineeringScienceTelemeteredParticleKey.science_parameter_list()
     
@@ -718,6 +762,7 @@ class EngineeringScienceTelemeteredDataParticle(GliderParticle):
 
 
 class EngineeringRecoveredDataParticle(GliderParticle):
+    __slots__ = ()
     _data_particle_type = DataParticleType.GLIDER_ENG_RECOVERED
     science_parameters = EngineeringRecoveredParticleKey.science_parameter_list()
     
@@ -738,6 +783,7 @@ class EngineeringRecoveredDataParticle(GliderParticle):
 
 
 class EngineeringScienceRecoveredDataParticle(GliderParticle):
+    __slots__ = ()
     _data_particle_type = DataParticleType.GLIDER_ENG_SCI_RECOVERED
     science_parameters = EngineeringScienceRecoveredParticleKey.science_parameter_list()
     
@@ -756,6 +802,162 @@ class EngineeringScienceRecoveredDataParticle(GliderParticle):
         """
         return self._parsed_values(EngineeringScienceRecoveredDataParticle.keys_exclude_times)
 
+def _int_or_nan(value):
+    """
+    Convert an integer column value, which may also be NaN
+    """
+    try:
+        return int(value)
+    except ValueError:
+        if value == "NaN":
+            return float(value)
+        raise
+
+
+def _column_getter(indexes):
+    """
+    @retval A function returning a tuple of the row items at indexes
+    """
+    if len(indexes) == 1:
+        index = indexes[0]
+        return lambda row: (row[index],)
+    if indexes:
+        return itemgetter(*indexes)
+    return lambda row: ()
+
+
+class GliderColumnPlan(object):
+    """
+    Conversion plan for the data columns of a glider file, compiled once
+    from the column labels and byte sizes in the header. The columns are
+    grouped by converter so a row is converted a group at a time, and the
+    converted values are kept in a tuple ordered by group. The position of
+    each label in that tuple is in the index dictionary.
+    """
+    def __init__(self, labels, num_of_bytes, string_to_ddegrees):
+        """
+        @param labels The column labels
+        @param num_of_bytes The byte size of each column, 1 and 2 byte
+            columns are integers and 4 and 8 byte columns are floats
+        @param string_to_ddegrees The converter for latitude and longitude
+            columns
+        """
+        groups = [(float, []), (_int_or_nan, []), (string_to_ddegrees, [])]
+        (float_columns, int_columns, position_columns) = [columns for (converter, columns) in groups]
+
+        columns = int_columns
+        for (column, label) in enumerate(labels):
+            # an unknown size is converted like the column before it
+            if num_of_bytes[column] in (1, 2):
+                columns = int_columns
+            elif num_of_bytes[column] in (4, 8):
+                columns = float_columns
+
+            if ('_lat' in label) or ('_lon' in label):
+                # latitude/longitude strings are converted to decimal degrees
+                position_columns.append(column)
+            else:
+                columns.append(column)
+
+        self._groups = [(converter, _column_getter(columns)) for (converter, columns) in groups]
+
+        # labels map to their position in the converted values, the last
+        # column wins if a label is repeated
+        self.index = {}
+        position = 0
+        for (converter, columns) in groups:
+            for column in columns:
+                self.index[labels[column]] = position
+                position += 1
+
+        self._columns = {}
+
+    def __getstate__(self):
+        # the converters can not be pickled, a pickled plan keeps only the
+        # index so the records of particles parsed in another process can
+        # still be read by label
+        return {'index': self.index}
+
+    def __setstate__(self, state):
+        self.index = state['index']
+        self._groups = None
+        self._columns = {}
+
+    def convert(self, data):
+        """
+        Convert the split strings of a data row
+        @param data The list of column strings
+        @retval A tuple of the converted values, NaN strings become float NaN
+        @throws ValueError if a value can not be converted
+        """
+        values = []
+        for (converter, getter) in self._groups:
+            values.extend(map(converter, getter(data)))
+        return tuple(values)
+
+    def columns(self, particle_class, key_list):
+        """
+        Look up the positions of a particle class's keys in the converted
+        values. The lookup is done once per particle class.
+        @param particle_class The particle class the keys belong to
+        @param key_list The particle keys in the order they are published
+        @retval A list of (key, position) tuples for the keys in this file
+        """
+        columns = self._columns.get(particle_class)
+        if columns is None:
+            index = self.index
+            columns = [(key, index[key]) for key in key_list if key in index]
+            self._columns[particle_class] = columns
+        return columns
+
+    def science_columns(self, particle_class):
+        """
+        @param particle_class The particle class to look up
+        @retval A list of the positions of the particle's science parameters
+        """
+        key = (particle_class, 'science_parameters')
+        columns = self._columns.get(key)
+        if columns is None:
+            index = self.index
+            columns = [index[key] for key in set(particle_class.science_parameters) if key in index]
+            self._columns[key] = columns
+        return columns
+
+
+class GliderRecord(object):
+    """
+    One converted glider data row, used as the raw data of the glider
+    particles. Values can be read by label like the data dictionary.
+    """
+    __slots__ = ('plan', 'values')
+
+    def __init__(self, plan, values):
+        """
+        @param plan The GliderColumnPlan of the file
+        @param values The values converted by the plan
+        """
+        self.plan = plan
+        self.values = values
+
+    def __contains__(self, label):
+        return label in self.plan.index
+
+    def __getitem__(self, label):
+        return self.values[self.plan.index[label]]
+
+    def has_data(self, particle_class):
+        """
+        @param particle_class The particle class to check
+        @retval True if any science parameter of the particle class is not NaN
+        """
+        values = self.values
+        for index in self.plan.science_columns(particle_class):
+            value = values[index]
+            if value == value:
+                return True
+        return False
+
+
 class GliderParser(BufferLoadingParser):
     """
     GliderParser parses a Slocum Electric Glider data file that has been
@@ -892,6 +1094,10 @@ class GliderParser(BufferLoadingParser):
         num_of_bytes = map(int, num_of_bytes)
         self._header_dict['num_of_bytes'] = num_of_bytes
 
+        # compile the column conversions once for the whole file
+        self._column_plan = GliderColumnPlan(self._header_dict['labels'], num_of_bytes,
+                                             self._string_to_ddegrees)
+
         log.debug("Label count: %d", len(self._header_dict['labels']))
         log.debug("Data units: %s", self._header_dict['data_units'])
         log.debug("Bytes: %s", self._header_dict['num_of_bytes'])
@@ -934,14 +1140,14 @@ class GliderParser(BufferLoadingParser):
 
     def _read_data(self, data_record):
         """
-        Read in the column labels, data type, number of bytes of each
-        data type, and the data from an ASCII glider data file.
+        Convert a row of an ASCII glider data file with the column plan
+        compiled from the header.
+        @param data_record The data row
+        @retval A GliderRecord of the converted row
+        @throws SampleException if the row does not have the number of
+            columns described in the header
         """
-
-        data_dict = {}
         num_columns = self._header_dict['sensors_per_cycle']
-        data_labels = self._header_dict['labels']
-        num_bytes = self._header_dict['num_of_bytes']
 
         data = data_record.strip().split()
 
@@ -958,48 +1164,15 @@ class GliderParser(BufferLoadingParser):
                                   'Described: %d, Actual: %d' %
                                   (num_columns, len(data)))
 
-        # extract record to dictionary
-        for ii in range(num_columns):
-            log.trace("_read_data: index: %d label: %s, value: %s", ii, data_labels[ii], data[ii])
-
-            valuePreConversion = data[ii]
-
-            if valuePreConversion == "NaN":
-                # data is NaN, convert it to a float
-                value = float(valuePreConversion)
-            else:
-
-                # determine what type of data the value is, based on the number of bytes attribute
-                if (num_bytes[ii] == 1) or (num_bytes[ii] == 2):
-                        stringConverter = int
-                elif (num_bytes[ii] == 4) or (num_bytes[ii] == 8):
-                        stringConverter = float
-
-                # check to see if this is a latitude/longitude string
-                if ('_lat' in data_labels[ii]) or ('_lon' in data_labels[ii]):
-                    # convert latitude/longitude strings to decimal degrees
-                    value = self._string_to_ddegrees(data[ii])
-
-                    log.debug("Converted lat/lon %s from %s to %10.5f", data_labels[ii], data[ii], value)
+        return GliderRecord(self._column_plan, self._column_plan.convert(data))
 
-                else:
-                    # convert the string to and int or float
-                    value = stringConverter(data[ii])
-
-            data_dict[data_labels[ii]] = {
-                'Name': data_labels[ii],
-                'Data': value
-            }
-
-        log.trace("Data dict parsed: %s", data_dict)
-
-        return data_dict
-
-    def get_block(self, size=1024):
+    def get_block(self, size=None):
         """
         Need to overload the base class behavior so we can get the last
         record if it doesn't end with a newline it would be ignored.
         """
+        if size is None:
+            size = self._next_block_size()
         len = super(GliderParser, self).get_block(size)
         log.debug("Buffer read bytes: %d", len)
 
@@ -1017,6 +1190,8 @@ class GliderParser(BufferLoadingParser):
         """
         # set defaults
         result_particles = []
+        # one driver timestamp for all the particles parsed from this block
+        driver_timestamp = ntplib.system_to_ntp_time(time.time())
 
         # collect the non-data from the file
         (nd_timestamp, non_data, non_start, non_end) = self._chunker.get_next_non_data_with_index(clean=False)
@@ -1050,8 +1225,8 @@ class GliderParser(BufferLoadingParser):
                 # from the parsed data, m_present_time is the unix timestamp
                 try:
                     if not exception_detected:
-                        record_time = data_dict['m_present_time']['Data']
-                        timestamp = ntplib.system_to_ntp_time(data_dict['m_present_time']['Data'])
+                        record_time = data_dict['m_present_time']
+                        timestamp = ntplib.system_to_ntp_time(record_time)
                         log.debug("Converting record timestamp %f to ntp timestamp %f", record_time, timestamp)
                 except KeyError:
                     exception_detected = True
@@ -1063,7 +1238,8 @@ class GliderParser(BufferLoadingParser):
 
                 elif self._has_science_data(data_dict):
                     # create the particle
-                    particle = self._extract_sample(self._particle_class, None, data_dict, timestamp)
+                    particle = self._extract_sample(self._particle_class, None, data_dict, timestamp,
+                                                    driver_timestamp=driver_timestamp)
                     self._increment_state(end)
                     result_particles.append((particle, copy.copy(self._read_state)))
                 else:
@@ -1100,15 +1276,8 @@ class GliderParser(BufferLoadingParser):
         """
         Examine the data_dict to see if it contains science data.
         """
-        log.debug("Looking for data in science parameters: %s", self._particle_class.science_parameters)
-        for key in data_dict.keys():
-            if key in self._particle_class.science_parameters:
-                value = data_dict[key]['Data']
-                if not np.isnan(value):
-                    log.debug("Found science value for key: %s, value: %s", key, value)
-                    return True
-                else:
-                    log.debug("Science data value is nan: %s %s", key, value)
+        if data_dict.has_data(self._particle_class):
+            return True
 
         log.debug("No science data found!")
         return False
@@ -1210,6 +1379,8 @@ class GliderEngineeringParser(GliderParser):
         """
         # set defaults
         result_particles = []
+        # one driver timestamp for all the particles parsed from this block
+        driver_timestamp = ntplib.system_to_ntp_time(time.time())
 
         # check if we have sent the metadata particle yet
         if not self._read_state[StateKey.SENT_METADATA] and self._header_dict != {}:
@@ -1217,7 +1388,8 @@ class GliderEngineeringParser(GliderParser):
             data_dict = self.get_header_info_dict()
             try:
                 timestamp = self.fileopen_str_to_timestamp(data_dict['glider_eng_fileopen_time']['Data'])
-                particle = self._extract_sample(EngineeringMetadataDataParticle, None, data_dict, timestamp)
+                particle = self._extract_sample(EngineeringMetadataDataParticle, None, data_dict, timestamp,
+                                                driver_timestamp=driver_timestamp)
                 self._read_state[StateKey.SENT_METADATA] = True
                 result_particles.append((particle, copy.copy(self._read_state)))
             except ValueError:
@@ -1256,13 +1428,13 @@ class GliderEngineeringParser(GliderParser):
                     exception_detected = True
                     self._exception_callback(e)
                     log.warn("GliderEngineeringParser.parse_chunks(): Sample Exception %s", e)
-                    data_dict = {}
+                    data_dict = None
 
                 # from the parsed data, m_present_time is the unix timestamp
                 try:
                     if not exception_detected:
-                        record_time = data_dict['m_present_time']['Data']
-                        timestamp = ntplib.system_to_ntp_time(data_dict['m_present_time']['Data'])
+                        record_time = data_dict['m_present_time']
+                        timestamp = ntplib.system_to_ntp_time(record_time)
                         log.debug("Converting record timestamp %f to ntp timestamp %f", record_time, timestamp)
                 except KeyError:
                     exception_detected = True
@@ -1278,7 +1450,8 @@ class GliderEngineeringParser(GliderParser):
                 if self._contains_eng_data(data_dict, EngineeringTelemeteredDataParticle):
                     # create the particle eng telemetered
                     particle = self._extract_sample(EngineeringTelemeteredDataParticle, None,
-                                                    data_dict, timestamp)
+                                                    data_dict, timestamp,
+                                                    driver_timestamp=driver_timestamp)
                     self._increment_state(end)
 
                     incremented = True
@@ -1287,7 +1460,8 @@ class GliderEngineeringParser(GliderParser):
                 if self._contains_eng_data(data_dict, EngineeringScienceTelemeteredDataParticle):
                     # create the particle eng science telemetered
                     particle = self._extract_sample(EngineeringScienceTelemeteredDataParticle, None,
-                                                    data_dict, timestamp)
+                                                    data_dict, timestamp,
+                                                    driver_timestamp=driver_timestamp)
 
                     if not incremented:
                         self._increment_state(end)
@@ -1358,14 +1532,9 @@ class GliderEngineeringParser(GliderParser):
         Examine the data_dict to see if it contains data from the engineering telemetered particle being worked on
         """
 
-        for key in data_dict.keys():
-
-            # only check for particle params that do not include the two m_ time oriented attributes
-            if key in particle_class.science_parameters:
-                # return true as soon as the first particle non-NaN attribute from the data dict
-                value = data_dict[key]['Data']
-                if not np.isnan(value):
-                    return True
+        # only check for particle params that do not include the two m_ time oriented attributes
+        if data_dict is not None and data_dict.has_data(particle_class):
+            return True
 
         log.debug("No engineering attributes in the particle found!")
         return False
\ No newline at end of file
@@ -12,7 +12,9 @@ __author__ = 'Emily Hahn'
 __license__ = 'Apache 2.0'
 
 import re
-import struct
+import mmap
+import array
+import bisect
 import binascii
 import gevent
 import time
@@ -48,6 +50,305 @@ END_IDX = 1
 SAMPLES_PARSED = 2
 SAMPLES_RETURNED = 3
 
+# The SIO checksum is the reflected CRC-16/CCITT with an initial value of
+# 0xFFFF and the result inverted (also known as CRC-16/X-25)
+SIO_CRC_POLYNOMIAL = 33800 # 0x8408
+SIO_CRC_INIT = 65535
+
+def _build_sio_crc_table():
+    """
+    Build the table of the CRC of every byte value
+    """
+    table = []
+    for byte in range(256):
+        crc = byte
+        for i in range(8):
+            if crc & 1:
+                crc = (crc >> 1) ^ SIO_CRC_POLYNOMIAL
+            else:
+                crc >>= 1
+        table.append(crc)
+    return tuple(table)
+
+SIO_CRC_TABLE = _build_sio_crc_table()
+
+try:
+    # crcmod computes the same CRC in C, use it if it is installed
+    import crcmod
+    _sio_crc_update = crcmod.mkCrcFun(0x11021, initCrc=SIO_CRC_INIT, rev=True, xorOut=0)
+except ImportError:
+    _sio_crc_update = None
+
+class SioCrc(object):
+    """
+    Streaming SIO checksum. Feed data in any number of pieces with update()
+    and read the checksum with value() or hexdigest():
+
+        crc = SioCrc()
+        crc.update(header)
+        crc.update(data)
+        crc.hexdigest()
+    """
+    def __init__(self, data=None):
+        """
+        @param data Optional data to start the checksum with
+        """
+        self._crc = SIO_CRC_INIT
+        if data:
+            self.update(data)
+
+    def update(self, data):
+        """
+        Add data to the checksum
+        @param data A string, bytearray or buffer
+        @retval This object, so calls can be chained
+        """
+        if _sio_crc_update is not None:
+            if isinstance(data, bytearray):
+                # the crcmod C extension only accepts read-only buffers
+                data = str(data)
+            self._crc = _sio_crc_update(data, self._crc)
+        else:
+            crc = self._crc
+            table = SIO_CRC_TABLE
+            for byte in bytearray(data):
+                crc = (crc >> 8) ^ table[(crc ^ byte) & 255]
+            self._crc = crc
+        return self
+
+    def value(self):
+        """
+        @retval The checksum of the data so far as an integer
+        """
+        return ~self._crc & 65535
+
+    def hexdigest(self):
+        """
+        @retval The checksum as 4 upper case hex digits, as it appears in
+        the SIO header
+        """
+        return "%04X" % self.value()
+
+# telemetered data escapes \x2b as \x18\x6b and \x18 as \x18\x58
+SIO_ESCAPE_MATCHER = re.compile(b'\x18[\x6b\x58]')
+SIO_UNESCAPED = {b'\x6b': b'\x2b', b'\x58': b'\x18'}
+SIO_READ_BLOCK_SIZE = 1024
+
+class SioMuleSource(object):
+    """
+    Read access to an SIO mule file by position in the unescaped data, which
+    is what the parser state refers to. The file is memory mapped rather
+    than read into a string, and rather than unescaping the whole file up
+    front the positions of the escape sequences are indexed once, so any
+    range can be mapped back to the file and unescaped when it is read.
+
+    Files that can not be mapped (StringIO, empty files) are read into a
+    string once, in blocks.
+    """
+    def __init__(self, stream_handle, recovered_flag=False):
+        """
+        @param stream_handle The open file, read from its current position
+        @param recovered_flag True if the data has no escape sequences
+        """
+        self._mmap = None
+        self._base = 0
+        try:
+            self._base = stream_handle.tell()
+            self._mmap = mmap.mmap(stream_handle.fileno(), 0, access=mmap.ACCESS_READ)
+            self._raw = self._mmap
+        except (AttributeError, ValueError, EnvironmentError):
+            self._base = 0
+            blocks = []
+            next_data = stream_handle.read(SIO_READ_BLOCK_SIZE)
+            while next_data:
+                blocks.append(next_data)
+                gevent.sleep(0)
+                next_data = stream_handle.read(SIO_READ_BLOCK_SIZE)
+            self._raw = ''.join(blocks)
+
+        # file offsets of the escape sequences (relative to the base), and
+        # where each one ends up in the unescaped data
+        self._escape_offsets = array.array('l')
+        self._escape_positions = array.array('l')
+        if not recovered_flag:
+            self._index_escapes()
+
+        self._length = len(self._raw) - self._base - len(self._escape_offsets)
+        log.debug("SIO source length %d, %d escape sequences",
+                  self._length, len(self._escape_offsets))
+
+    def _index_escapes(self):
+        """
+        Find the escape sequences. The data used to be unescaped a 1024 byte
+        read at a time, so a sequence split across two reads was left alone;
+        do the same so positions in existing parser states stay valid.
+        """
+        for match in SIO_ESCAPE_MATCHER.finditer(self._raw, self._base):
+            offset = match.start() - self._base
+            if offset % SIO_READ_BLOCK_SIZE == SIO_READ_BLOCK_SIZE - 1:
+                continue
+            self._escape_positions.append(offset - len(self._escape_offsets))
+            self._escape_offsets.append(offset)
+            if len(self._escape_offsets) % 65536 == 0:
+                gevent.sleep(0)
+
+    def __len__(self):
+        """
+        @retval The length of the unescaped data
+        """
+        return self._length
+
+    def _file_range(self, start, end):
+        """
+        Map an unescaped range onto the file
+        @retval A tuple of the file start, file end and the range of
+        escape sequence indices inside it
+        """
+        first = bisect.bisect_left(self._escape_positions, start)
+        last = bisect.bisect_left(self._escape_positions, end)
+        return (self._base + start + first, self._base + end + last, first, last)
+
+    def read(self, start, end):
+        """
+        Read unescaped data
+        @param start Start position in the unescaped data
+        @param end End position (exclusive) in the unescaped data
+        @retval The unescaped data as a string
+        """
+        end = min(end, self._length)
+        if start >= end:
+            return ''
+        (file_start, file_end, first, last) = self._file_range(start, end)
+        if first == last:
+            return self._raw[file_start:file_end]
+
+        pieces = []
+        position = file_start
+        for index in xrange(first, last):
+            offset = self._base + self._escape_offsets[index]
+            pieces.append(self._raw[position:offset])
+            pieces.append(SIO_UNESCAPED[self._raw[offset + 1]])
+            position = offset + 2
+        pieces.append(self._raw[position:file_end])
+        return ''.join(pieces)
+
+    def close(self):
+        """
+        Release the memory map, which holds its own handle on the file
+        """
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        self._raw = ''
+
+class SioIntervalSet(object):
+    """
+    Sorted set of non overlapping [start, end] file intervals, used to track the
+    unprocessed data.  The intervals are kept in a plain list of [start, end]
+    lists so the list itself can be stored in the parser state and handed to
+    the driver unchanged, with a parallel list of the start indices searched
+    with bisect so finding, splitting and merging an interval does not need a
+    scan and re-sort of the whole list.
+    """
+    def __init__(self, intervals=None):
+        """
+        @param intervals A list of [start, end] lists to manage, which is
+           sorted and has adjacent intervals combined in place
+        """
+        if intervals is None:
+            intervals = []
+        intervals.sort()
+        combined = []
+        for interval in intervals:
+            if combined and interval[START_IDX] <= combined[-1][END_IDX]:
+                combined[-1][END_IDX] = max(combined[-1][END_IDX], interval[END_IDX])
+            else:
+                combined.append(interval)
+        intervals[:] = combined
+        self._intervals = intervals
+        self._starts = [interval[START_IDX] for interval in intervals]
+
+    @property
+    def intervals(self):
+        """
+        @retval The managed list of [start, end] lists
+        """
+        return self._intervals
+
+    def __len__(self):
+        return len(self._intervals)
+
+    def __iter__(self):
+        return iter(self._intervals)
+
+    def find(self, start, end):
+        """
+        Find the interval which completely contains start to end
+        @param start The start index
+        @param end The end index
+        @retval The index of the containing interval, or None if there is none
+        """
+        idx = bisect.bisect_right(self._starts, start) - 1
+        if idx >= 0 and end <= self._intervals[idx][END_IDX]:
+            return idx
+        return None
+
+    def contains(self, start, end):
+        """
+        @param start The start index
+        @param end The end index
+        @retval True if start to end is completely inside one interval
+        """
+        return self.find(start, end) is not None
+
+    def next_index(self, position):
+        """
+        Find the first interval which ends after a position
+        @param position The file position
+        @retval The index of the interval, len(self) if there is none
+        """
+        idx = bisect.bisect_right(self._starts, position) - 1
+        if idx < 0 or self._intervals[idx][END_IDX] <= position:
+            idx += 1
+        return idx
+
+    def add(self, start, end):
+        """
+        Add an interval, merging it with any intervals it overlaps or touches
+        @param start The start index
+        @param end The end index
+        """
+        first = bisect.bisect_left(self._starts, start)
+        if first > 0 and self._intervals[first - 1][END_IDX] >= start:
+            first -= 1
+        last = bisect.bisect_right(self._starts, end)
+        if first < last:
+            start = min(start, self._intervals[first][START_IDX])
+            end = max(end, self._intervals[last - 1][END_IDX])
+        self._intervals[first:last] = [[start, end]]
+        self._starts[first:last] = [start]
+
+    def remove(self, start, end):
+        """
+        Remove an interval, splitting any interval it lies inside of and
+        trimming any it overlaps
+        @param start The start index
+        @param end The end index
+        """
+        first = bisect.bisect_right(self._starts, start) - 1
+        if first < 0 or self._intervals[first][END_IDX] <= start:
+            first += 1
+        last = bisect.bisect_left(self._starts, end)
+        if first >= last:
+            return
+        remain = []
+        if self._intervals[first][START_IDX] < start:
+            remain.append([self._intervals[first][START_IDX], start])
+        if self._intervals[last - 1][END_IDX] > end:
+            remain.append([end, self._intervals[last - 1][END_IDX]])
+        self._intervals[first:last] = remain
+        self._starts[first:last] = [interval[START_IDX] for interval in remain]
+
 class SioMuleParser(Parser):
 
     def __init__(self, config, stream_handle, state, sieve_fn,
@@ -80,10 +381,15 @@ class SioMuleParser(Parser):
         self._position = [0,0] # store both the start and end point for this read of data within the file
         self._record_buffer = [] # holds list of records
         self._recovered_flag = recovered_flag
-        self.all_data = None
+        # the mapped file, opened when there is data to read and closed at
+        # the end of the file
+        self._sio_source = None
+        self._sio_source_start = None
         self._chunk_sample_count = []
         self._samples_to_throw_out = None
         self._mid_sample_packets = 0
+        self._unprocessed = None
+        self._in_process_keys = None
         # use None flag in unprocessed data to initialize this we read the entire file and get the size of the data
         self._read_state = {StateKey.UNPROCESSED_DATA: None,
                             StateKey.IN_PROCESS_DATA:[]}
@@ -120,6 +426,7 @@ class SioMuleParser(Parser):
                             self._read_state[StateKey.IN_PROCESS_DATA].append([match.start(0),
                                                                                end_packet_idx+1,
                                                                                None, 0])
+                            self._in_process_keys.add((match.start(0), end_packet_idx+1))
                         return_list.append((match.start(0), end_packet_idx+1))
                     else:
                         log.debug("Calculated checksum %s != received checksum %s for header %s and packet %d to %d",
@@ -133,32 +440,10 @@ class SioMuleParser(Parser):
     def calc_checksum(data):
         """
         Calculate SIO header checksum of data
+        @param data The packet data
+        @retval The checksum as 4 upper case hex digits
         """
-        crc = 65535
-        if len(data) == 0:
-            return '0000'
-        for iData in range(0,len(data)):
-            short = struct.unpack('H', data[iData] + '\x00')
-            point = 255 & short[0]
-            crc = crc ^ point
-            for i in range(7, -1, -1):
-                if crc & 1:
-                    crc = (crc >> 1) ^ 33800
-                else:
-                    crc >>= 1
-        crc = ~crc
-        # convert to unsigned
-        if crc < 0:
-            crc += 65536
-        # get rid of the '0x' from the hex string
-        crc = "%s" % hex(crc)[2:].upper()
-        # make sure we have the right format for comparing, must be 4 hex digits
-        if len(crc) == 3:
-            crc = '0' + crc
-        elif len(crc) == 2:
-            crc = '00' + crc
-        elif len(crc) == 1:
-            crc = '000' + crc
+        crc = SioCrc(data).hexdigest()
         log.trace("calculated checksum %s", crc)
         return crc
 
@@ -166,13 +451,26 @@ class SioMuleParser(Parser):
         """
         Determine if this packet is already in the in process data
         """
-        for packet in self._read_state[StateKey.IN_PROCESS_DATA]:
-            if packet[START_IDX] == start + self._position[START_IDX] and \
-            packet[END_IDX] == end + self._position[START_IDX]:
-                log.trace('Already added packet %s', packet)
-                return True
+        if self._in_process_keys is None:
+            # (re)build the index of in process packets, it is dropped whenever
+            # the in process packets are adjusted or removed
+            self._in_process_keys = set((packet[START_IDX], packet[END_IDX]) for packet
+                                        in self._read_state[StateKey.IN_PROCESS_DATA])
+        if (start + self._position[START_IDX], end + self._position[START_IDX]) in self._in_process_keys:
+            log.trace('Already added packet %d to %d', start, end)
+            return True
         return False
 
+    def _get_unprocessed(self):
+        """
+        Get the interval set managing the unprocessed data in the current state
+        @retval A SioIntervalSet of the unprocessed data
+        """
+        unprocessed = self._read_state[StateKey.UNPROCESSED_DATA]
+        if self._unprocessed is None or self._unprocessed.intervals is not unprocessed:
+            self._unprocessed = SioIntervalSet(unprocessed)
+        return self._unprocessed
+
     def set_state(self, state_obj):
         """
         Set the value of the state object for this parser
@@ -196,6 +494,8 @@ class SioMuleParser(Parser):
         self._record_buffer = []
         self._state = state_obj
         self._read_state = state_obj
+        self._unprocessed = None
+        self._in_process_keys = None
 
         # it is possible to be in the middle of processing a packet.  Since we have to
         # process a whole packet, which may contain multiple samples, we have to
@@ -225,47 +525,51 @@ class SioMuleParser(Parser):
             # decrease the mid sample number remaining
             self._mid_sample_packets -= 1
 
-        for packet_idx in range (0, len(self._read_state[StateKey.IN_PROCESS_DATA])):
-            if self._read_state[StateKey.IN_PROCESS_DATA][packet_idx][SAMPLES_PARSED] is None and \
-            len(self._chunk_sample_count) > 0:
-                self._read_state[StateKey.IN_PROCESS_DATA][packet_idx][SAMPLES_PARSED] = self._chunk_sample_count.pop(0)
+        in_process = self._read_state[StateKey.IN_PROCESS_DATA]
+        for packet in in_process:
+            if not self._chunk_sample_count:
+                break
+            if packet[SAMPLES_PARSED] is None:
+                packet[SAMPLES_PARSED] = self._chunk_sample_count.pop(0)
                 # adjust for current file position, only do this once when filling in sample count
-                self._read_state[StateKey.IN_PROCESS_DATA][packet_idx][START_IDX] += self._position[START_IDX]
-                self._read_state[StateKey.IN_PROCESS_DATA][packet_idx][END_IDX] += self._position[START_IDX]
+                packet[START_IDX] += self._position[START_IDX]
+                packet[END_IDX] += self._position[START_IDX]
+                self._in_process_keys = None
 
-        n_removed = 0
         if returned_records > 0:
             # need to adjust position to be relative to the entire file, not just the
             # currently read section, so add the initial position to the in process packets
             log.debug('records to be returned %d', returned_records)
             total_remain = returned_records
             adj_packets = []
-            for packet_idx in range(0, len(self._read_state[StateKey.IN_PROCESS_DATA])):
-                adj_packet_idx = packet_idx - n_removed
-                this_packet = self._read_state[StateKey.IN_PROCESS_DATA][adj_packet_idx]
+            still_in_process = []
+            for this_packet in in_process:
                 if this_packet[SAMPLES_PARSED] > 0:
                     # this packet has data samples in it
                     this_packet_remain = this_packet[SAMPLES_PARSED] - this_packet[SAMPLES_RETURNED]
                     # increase the number of samples that have been pulled out
-                    self._read_state[StateKey.IN_PROCESS_DATA][adj_packet_idx][SAMPLES_RETURNED] += total_remain
+                    this_packet[SAMPLES_RETURNED] += total_remain
                     # find out if packet is done, if so remove it
-                    if self._read_state[StateKey.IN_PROCESS_DATA][adj_packet_idx][SAMPLES_RETURNED] >= this_packet[SAMPLES_PARSED]:
+                    if this_packet[SAMPLES_RETURNED] >= this_packet[SAMPLES_PARSED]:
                         # this packet has had all the samples pulled out from it, remove it from in process
                         adj_packets.append([this_packet[START_IDX], this_packet[END_IDX]])
-                        ret = self._read_state[StateKey.IN_PROCESS_DATA].pop(adj_packet_idx)
-                        n_removed += 1
-                    elif self._read_state[StateKey.IN_PROCESS_DATA][adj_packet_idx][SAMPLES_RETURNED] < 0:
-                        self._read_state[StateKey.IN_PROCESS_DATA][adj_packet_idx][SAMPLES_RETURNED] = 0
+                    else:
+                        if this_packet[SAMPLES_RETURNED] < 0:
+                            this_packet[SAMPLES_RETURNED] = 0
+                        still_in_process.append(this_packet)
 
                     total_remain -= this_packet_remain
 
                 else:
                     # this packet has no samples, no need to process further
                     adj_packets.append([this_packet[START_IDX], this_packet[END_IDX]])
-                    ret = self._read_state[StateKey.IN_PROCESS_DATA].pop(adj_packet_idx)
-                    n_removed += 1
 
-            if len(adj_packets) > 0 and self._read_state[StateKey.IN_PROCESS_DATA] == []:
+            if adj_packets:
+                # remove the finished packets in one pass, keeping the same list in the state
+                in_process[:] = still_in_process
+                self._in_process_keys = None
+
+            if len(adj_packets) > 0 and in_process == []:
                 # this is the last of the in process data, now process unprocessed data, so
                 # go back to the beginning of the file
                 log.debug('Resetting position to the start')
@@ -273,28 +577,17 @@ class SioMuleParser(Parser):
                 # clear out the chunker so we don't wrap around data
                 self._chunker.clean_all_chunks()
 
-            log.trace('In process %s', self._read_state[StateKey.IN_PROCESS_DATA])
+            log.trace('In process %s', in_process)
 
             # first combine the in process data packet indicies
             combined_packets = self._combine_adjacent_packets(adj_packets)
             # loop over combined packets and remove them from unprocessed data
+            unprocessed = self._get_unprocessed()
             for packet in combined_packets:
-                # find which unprocessed section this packet is in
-                for unproc in self._read_state[StateKey.UNPROCESSED_DATA]:
-                    if packet[START_IDX] >= unproc[START_IDX] and packet[END_IDX] <= unproc[END_IDX]:
-                        # packet is within this unprocessed data, remove it
-                        self._read_state[StateKey.UNPROCESSED_DATA].remove(unproc)
-                        # add back any data still unprocessed on either side
-                        if packet[START_IDX] > unproc[START_IDX]:
-                            self._read_state[StateKey.UNPROCESSED_DATA].append([unproc[START_IDX], packet[START_IDX]])
-                        if packet[END_IDX] < unproc[END_IDX]:
-                            self._read_state[StateKey.UNPROCESSED_DATA].append([packet[END_IDX], unproc[END_IDX]])
-                        # once we have found which unprocessed section this packet is in,
-                        # move on to next packet
-                        break;
-                self._read_state[StateKey.UNPROCESSED_DATA] = sorted(self._read_state[StateKey.UNPROCESSED_DATA])
-                self._read_state[StateKey.UNPROCESSED_DATA] = self._combine_adjacent_packets(
-                    self._read_state[StateKey.UNPROCESSED_DATA])
+                # only remove packets which are within one unprocessed section, splitting
+                # that section to leave any data still unprocessed on either side
+                if unprocessed.contains(packet[START_IDX], packet[END_IDX]):
+                    unprocessed.remove(packet[START_IDX], packet[END_IDX])
 
     def _combine_adjacent_packets(self, packets):
         """
@@ -323,30 +616,10 @@ class SioMuleParser(Parser):
         """
         Loop through all the in process or unprocessed data until the requested number of records are found
         """
-        if self.all_data == None:
-            # need to read in the entire data file first and store it because escape sequences shift position of
-            # in process and unprocessed blocks
-            log.debug("Reading in all data in smaller blocks")
-            self.all_data = ''
-
-            eof = False
-            while not eof:
-                # read data in small blocks in order to not block processing
-                next_data = self._stream_handle.read(1024)
-                if next_data:
-                    if not self._recovered_flag:
-                        # if this is telemetered, need to replace escape chars, recovered does not
-                        next_data = next_data.replace(b'\x18\x6b', b'\x2b')
-                        next_data = next_data.replace(b'\x18\x58', b'\x18')
-                    self.all_data = self.all_data + next_data
-                    gevent.sleep(0)
-                else:
-                    eof = True
-            log.debug("length of all data %d", len(self.all_data))
-
         # if unprocessed data has not been initialized yet, set it to the entire file
         if self._read_state[StateKey.UNPROCESSED_DATA] == None:
-            self._read_state[StateKey.UNPROCESSED_DATA] = [[0, len(self.all_data)]]
+            self._read_state[StateKey.UNPROCESSED_DATA] = [[0, len(self._get_sio_source())]]
+            self._unprocessed = None
 
         while len(self._record_buffer) < num_records:
             # read unprocessed data packet from the file, starting with in process data
@@ -357,7 +630,7 @@ class SioMuleParser(Parser):
                 data = self._get_next_unprocessed_data(self._read_state[StateKey.IN_PROCESS_DATA])
             else:
                 # there is no in process data, read the unprocessed data
-                data = self._get_next_unprocessed_data(self._read_state[StateKey.UNPROCESSED_DATA])
+                data = self._get_next_unprocessed_data(self._get_unprocessed())
 
             if data and len(self._record_buffer) < num_records:
                 # there is more data, add it to the chunker
@@ -379,11 +652,41 @@ class SioMuleParser(Parser):
                 # add the parsed chunks to the record_buffer
                 self._record_buffer.extend(result)
             else:
-                 # if there is no more data, it is the end of the file, stop looping
+                # if there is no more data, it is the end of the file, stop looping
+                # and let go of the file mapping
+                self._close_sio_source()
                 break
             # sleep in case this is a long loop
             gevent.sleep(0)
 
+    def _get_sio_source(self):
+        """
+        Open the file for reading by position in the unescaped data, if it
+        is not open already.  Positions in the in process and unprocessed
+        blocks are in the unescaped data, so the escape sequences in the
+        whole file are indexed first.
+        @retval The SioMuleSource
+        """
+        if self._sio_source is None:
+            log.debug("Indexing data file")
+            if self._sio_source_start is None:
+                self._sio_source_start = self._stream_handle.tell()
+            else:
+                # reopened after the end of the file, start where we did the first time
+                self._stream_handle.seek(self._sio_source_start)
+            self._sio_source = SioMuleSource(self._stream_handle, self._recovered_flag)
+            log.debug("length of all data %d", len(self._sio_source))
+        return self._sio_source
+
+    def _close_sio_source(self):
+        """
+        Release the file mapping. It is opened again if the parser is asked
+        to read more, for instance after its state is set back.
+        """
+        if self._sio_source is not None:
+            self._sio_source.close()
+            self._sio_source = None
+
     def get_records(self, num_records):
         """
         Go ahead and execute the data parsing loop up to a point. This involves
@@ -442,13 +745,18 @@ class SioMuleParser(Parser):
         """
         Using the UNPROCESSED_DATA state, determine if there are any more unprocessed blocks,
         and if there are read in the next one
+        @param unproc The in process data list, or the unprocessed data SioIntervalSet
         @retval The next unprocessed data packet, or [] if no more unprocessed data
         """
         # see if there is more unprocessed data at a later file position (don't go backwards)
-        next_idx = 0
         log.debug('Getting next unprocessed from %s, last position %d', unproc, self._position[END_IDX])
-        while len(unproc) > next_idx and unproc[next_idx][END_IDX] <= self._position[END_IDX]:
-            next_idx = next_idx + 1
+        if isinstance(unproc, SioIntervalSet):
+            next_idx = unproc.next_index(self._position[END_IDX])
+            unproc = unproc.intervals
+        else:
+            next_idx = 0
+            while len(unproc) > next_idx and unproc[next_idx][END_IDX] <= self._position[END_IDX]:
+                next_idx = next_idx + 1
 
         if len(unproc) > next_idx:
             data_len = unproc[next_idx][END_IDX] - unproc[next_idx][START_IDX]
@@ -456,7 +764,7 @@ class SioMuleParser(Parser):
             # don't go back to the beginning
             if unproc[next_idx][START_IDX] > self._position[END_IDX]:
                 self._position[START_IDX] = unproc[next_idx][START_IDX]
-            data = self.all_data[unproc[next_idx][START_IDX]:unproc[next_idx][END_IDX]]
+            data = self._get_sio_source().read(unproc[next_idx][START_IDX], unproc[next_idx][END_IDX])
             self._position[END_IDX] = self._position[START_IDX] + data_len
             log.debug('got %d bytes starting at %d', len(data), self._position[START_IDX])
         else:
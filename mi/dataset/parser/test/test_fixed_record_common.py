@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+
+"""
+@package mi.dataset.parser.test.test_fixed_record_common
+@file mi/dataset/parser/test/test_fixed_record_common.py
+@brief Unit tests for the fixed length record helpers
+"""
+
+__license__ = 'Apache 2.0'
+
+import re
+from nose.plugins.attrib import attr
+
+from mi.core.unit_test import MiUnitTestCase
+from mi.dataset.parser.fixed_record_common import record_indices, find_aligned, find_aligned_match
+
+@attr('UNIT', group='mi')
+class FixedRecordCommonUnitTestCase(MiUnitTestCase):
+    """
+    Test the fixed length record helpers
+    """
+    def test_record_indices(self):
+        """
+        Test computing record boundaries
+        """
+        self.assertEqual(record_indices(0, 3, 11), [(0, 11), (11, 22), (22, 33)])
+        self.assertEqual(record_indices(5, 2, 8), [(5, 13), (13, 21)])
+        self.assertEqual(record_indices(5, 0, 8), [])
+
+    def test_find_aligned(self):
+        """
+        Test that markers are only found at the start of a record
+        """
+        marker = '\xff' * 4
+        # a run of \xff across a record boundary is not a marker
+        data = 'abc' + '\xff' * 4 + 'd' + '\xff' * 4
+        self.assertEqual(find_aligned(data, marker, 4), 8)
+        self.assertEqual(find_aligned(data, marker, 4, 4), 8)
+        self.assertEqual(find_aligned(data, marker, 8), 8)
+        self.assertEqual(find_aligned(data, marker, 3), 3)
+        self.assertEqual(find_aligned(data, marker, 5), -1)
+        # a longer run contains an aligned marker
+        self.assertEqual(find_aligned('ab' + '\xff' * 8, marker, 4), 4)
+        self.assertEqual(find_aligned('abcd', marker, 4), -1)
+
+    def test_find_aligned_match(self):
+        """
+        Test that regex matches are only found at the start of a record
+        """
+        matcher = re.compile(b'\xff\xff[\xfa-\xff]')
+        data = 'a\xff\xff\xfa' + 'bcde' + '\xff\xff\xfb\x00'
+        self.assertEqual(find_aligned_match(data, matcher, 4), 8)
+        self.assertEqual(find_aligned_match(data, matcher, 3), -1)
+        self.assertEqual(find_aligned_match(data, matcher, 4, 8), 8)
+        self.assertEqual(find_aligned_match(data, matcher, 3, 1), 1)
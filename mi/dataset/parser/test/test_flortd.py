@@ -212,7 +212,10 @@ class FlortdParserUnitTestCase(ParserUnitTestCase):
             [[0,69],[944,1000]])
         result = self.parser.get_records(1)
         self.assertEqual(result, [])
+        # the file mapping is released at the end of the data
+        self.assertIsNone(self.parser._sio_source)
 
+        # and opened again to read the new unprocessed data
         self.parser.set_state(new_state)
         result = self.parser.get_records(1)
         self.stream_handle.close()
@@ -11,6 +11,7 @@ from StringIO import StringIO
 import gevent
 import os
 import numpy as np
+import pickle
 import ntplib
 import unittest
 
@@ -20,6 +21,8 @@ log = get_logger()
 from nose.plugins.attrib import attr
 
 from mi.core.exceptions import SampleException
+from mi.core.unit_test import MiUnitTestCase
+from mi.core.instrument.data_particle import DataParticleKey
 from mi.dataset.test.test_parser import ParserUnitTestCase
 from mi.dataset.dataset_driver import DataSetDriverConfigKeys
 from mi.dataset.parser.glider import GliderParser, GliderEngineeringParser, StateKey
@@ -38,6 +41,7 @@ from mi.dataset.parser.glider import EngineeringTelemeteredDataParticle
 from mi.dataset.parser.glider import EngineeringMetadataDataParticle
 from mi.dataset.parser.glider import EngineeringMetadataParticleKey
 from mi.dataset.parser.glider import DataParticleType, GliderParticle
+from mi.dataset.parser.glider import GliderColumnPlan, GliderRecord
 from mi.dataset.parser.test.glider_test_results import positions, glider_test_data
 
 
@@ -559,3 +563,68 @@ class ENGGliderTest(GliderParserUnitTestCase):
         self.assert_generate_particle(EngineeringTelemeteredDataParticle, record_2, 12479)
         self.assert_generate_particle(EngineeringScienceTelemeteredDataParticle, record_sci_2, 12479)
         self.assert_no_more_data()
+
+
+@attr('UNIT', group='mi')
+class GliderColumnPlanTest(MiUnitTestCase):
+    """
+    Test converting data rows with a column plan compiled from the header
+    """
+    def setUp(self):
+        labels = ['m_present_time', 'm_gps_lat', 'x_status', 'sci_water_temp', 'sci_water_cond', 'x_unknown']
+        num_of_bytes = [8, 8, 1, 4, 4, 3]
+        self.plan = GliderColumnPlan(labels, num_of_bytes, lambda value: ('ddegrees', value))
+
+    def test_convert(self):
+        """
+        Test each column gets its converter, and values can be read by label
+        """
+        record = GliderRecord(self.plan, self.plan.convert(
+            ['1378349241.82', '4421.4105', '2', 'NaN', '4', '5']))
+
+        self.assertEqual(record['m_present_time'], 1378349241.82)
+        self.assertEqual(record['m_gps_lat'], ('ddegrees', '4421.4105'))
+        self.assertEqual(record['x_status'], 2)
+        self.assertTrue(isinstance(record['x_status'], int))
+        self.assertTrue(np.isnan(record['sci_water_temp']))
+        self.assertEqual(record['sci_water_cond'], 4.0)
+        self.assertTrue(isinstance(record['sci_water_cond'], float))
+        # an unknown column size is converted like the previous column
+        self.assertTrue(isinstance(record['x_unknown'], float))
+        self.assertTrue('x_status' in record)
+        self.assertFalse('sci_water_pressure' in record)
+        self.assertRaises(KeyError, record.__getitem__, 'sci_water_pressure')
+
+        # integer columns may be NaN
+        record = GliderRecord(self.plan, self.plan.convert(['1', '2', 'NaN', '3', '4', '5']))
+        self.assertTrue(np.isnan(record['x_status']))
+        self.assertRaises(ValueError, self.plan.convert, ['1', '2', '2.5', '3', '4', '5'])
+
+    def test_columns(self):
+        """
+        Test the particle columns are found in the order of the key list
+        """
+        columns = self.plan.columns(CtdgvDataParticle, CtdgvParticleKey.list())
+        self.assertEqual([key for (key, index) in columns],
+                         [key for key in CtdgvParticleKey.list() if key in self.plan.index])
+        self.assertTrue(self.plan.columns(CtdgvDataParticle, []) is columns)
+
+        record = GliderRecord(self.plan, self.plan.convert(['1', '2', '3', 'NaN', 'NaN', '5']))
+        self.assertFalse(record.has_data(CtdgvDataParticle))
+        record = GliderRecord(self.plan, self.plan.convert(['1', '2', '3', 'NaN', '0.1', '5']))
+        self.assertTrue(record.has_data(CtdgvDataParticle))
+
+        values = dict((value[DataParticleKey.VALUE_ID], value[DataParticleKey.VALUE])
+                      for value in CtdgvDataParticle(record)._build_parsed_values())
+        self.assertEqual(values, {'m_present_time': 1.0, 'sci_water_temp': None, 'sci_water_cond': 0.1})
+
+    def test_pickle(self):
+        """
+        Test particles can be pickled to send them between processes
+        """
+        record = GliderRecord(self.plan, self.plan.convert(['1', '2', '3', 'NaN', '0.1', '5']))
+        particle = CtdgvDataParticle(record, internal_timestamp=2.0, driver_timestamp=3.0)
+        copied = pickle.loads(pickle.dumps(particle, pickle.HIGHEST_PROTOCOL))
+
+        self.assertEqual(copied.raw_data['sci_water_cond'], 0.1)
+        self.assertEqual(copied.generate_dict(), particle.generate_dict())
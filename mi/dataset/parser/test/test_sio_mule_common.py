@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+
+"""
+@package mi.dataset.parser.test.test_sio_mule_common
+@file mi/dataset/parser/test/test_sio_mule_common.py
+@brief Unit tests for the common SIO mule parser pieces
+"""
+
+__license__ = 'Apache 2.0'
+
+import tempfile
+from StringIO import StringIO
+from nose.plugins.attrib import attr
+
+from mi.core.unit_test import MiUnitTestCase
+from mi.dataset.parser.sio_mule_common import SioMuleParser, SioCrc, SioMuleSource, SioIntervalSet
+
+@attr('UNIT', group='mi')
+class SioCrcUnitTestCase(MiUnitTestCase):
+    """
+    Test the SIO checksum
+    """
+    @staticmethod
+    def bitwise_checksum(data):
+        """
+        The original bit by bit SIO checksum, to check the table against
+        """
+        crc = 65535
+        for char in data:
+            crc = crc ^ ord(char)
+            for i in range(8):
+                if crc & 1:
+                    crc = (crc >> 1) ^ 33800
+                else:
+                    crc >>= 1
+        return "%04X" % (~crc & 65535)
+
+    def test_checksum(self):
+        """
+        Test the table driven checksum against known values and the bitwise
+        calculation
+        """
+        self.assertEqual(SioMuleParser.calc_checksum(''), '0000')
+        self.assertEqual(SioMuleParser.calc_checksum('123456789'), '906E')
+
+        data = ''.join([chr((i * 7) % 256) for i in range(1000)])
+        for length in [1, 2, 17, 255, 1000]:
+            self.assertEqual(SioMuleParser.calc_checksum(data[:length]),
+                             self.bitwise_checksum(data[:length]))
+
+    def test_update(self):
+        """
+        Test that the checksum can be calculated in pieces
+        """
+        data = ''.join([chr(i % 256) for i in range(600)])
+        crc = SioCrc()
+        for start in range(0, len(data), 64):
+            crc.update(data[start:start + 64])
+        self.assertEqual(crc.hexdigest(), SioCrc(data).hexdigest())
+        self.assertEqual(crc.value(), int(self.bitwise_checksum(data), 16))
+        self.assertEqual(SioCrc().update(bytearray(data)).hexdigest(), crc.hexdigest())
+
+@attr('UNIT', group='mi')
+class SioMuleSourceUnitTestCase(MiUnitTestCase):
+    """
+    Test reading unescaped ranges of an SIO file
+    """
+    @staticmethod
+    def unescape_blocks(data):
+        """
+        Unescape the data the way the parser originally did, a 1024 byte
+        read at a time
+        """
+        result = ''
+        for start in range(0, len(data), 1024):
+            block = data[start:start + 1024]
+            block = block.replace(b'\x18\x6b', b'\x2b')
+            block = block.replace(b'\x18\x58', b'\x18')
+            result += block
+        return result
+
+    def setUp(self):
+        data = list('abcdefgh' * 400)
+        # escapes inside a block, back to back, and split across two reads
+        data[10:12] = '\x18\x6b'
+        data[12:14] = '\x18\x58'
+        data[500:503] = '\x18\x18\x58'
+        data[1023:1025] = '\x18\x6b'
+        data[2046:2048] = '\x18\x58'
+        self.data = ''.join(data)
+        self.unescaped = self.unescape_blocks(self.data)
+
+    def check_source(self, source):
+        self.assertEqual(len(source), len(self.unescaped))
+        self.assertEqual(source.read(0, len(source)), self.unescaped)
+        for (start, end) in [(0, 11), (10, 13), (11, 12), (499, 502), (1000, 1100),
+                             (2040, 2050), (3000, 9999), (5000, 6000)]:
+            self.assertEqual(source.read(start, end), self.unescaped[start:end])
+
+    def test_mapped_file(self):
+        """
+        Test a memory mapped file
+        """
+        stream_handle = tempfile.TemporaryFile()
+        stream_handle.write(self.data)
+        stream_handle.seek(0)
+        source = SioMuleSource(stream_handle)
+        self.check_source(source)
+        source.close()
+        self.assertIsNone(source._mmap)
+        stream_handle.close()
+
+    def test_stream(self):
+        """
+        Test a stream that can not be memory mapped, and recovered data
+        """
+        self.check_source(SioMuleSource(StringIO(self.data)))
+
+        source = SioMuleSource(StringIO(self.data), recovered_flag=True)
+        self.assertEqual(source.read(0, len(self.data)), self.data)
+
+@attr('UNIT', group='mi')
+class SioIntervalSetUnitTestCase(MiUnitTestCase):
+    """
+    Test the unprocessed data interval set
+    """
+    def test_normalize(self):
+        """
+        Test that the state list is sorted and combined in place
+        """
+        state = [[50, 60], [0, 10], [10, 20], [30, 40]]
+        intervals = SioIntervalSet(state)
+        self.assertIs(intervals.intervals, state)
+        self.assertEqual(state, [[0, 20], [30, 40], [50, 60]])
+        self.assertEqual(len(intervals), 3)
+
+    def test_contains(self):
+        """
+        Test finding the interval containing a range
+        """
+        intervals = SioIntervalSet([[0, 20], [30, 40]])
+        self.assertTrue(intervals.contains(0, 20))
+        self.assertTrue(intervals.contains(5, 10))
+        self.assertTrue(intervals.contains(30, 40))
+        self.assertFalse(intervals.contains(15, 35))
+        self.assertFalse(intervals.contains(20, 30))
+        self.assertFalse(intervals.contains(35, 45))
+        self.assertEqual(intervals.find(32, 33), 1)
+        self.assertEqual(intervals.next_index(0), 0)
+        self.assertEqual(intervals.next_index(20), 1)
+        self.assertEqual(intervals.next_index(35), 1)
+        self.assertEqual(intervals.next_index(40), 2)
+
+    def test_remove(self):
+        """
+        Test removing ranges splits and trims the intervals
+        """
+        state = [[0, 100]]
+        intervals = SioIntervalSet(state)
+        intervals.remove(10, 20)
+        self.assertEqual(state, [[0, 10], [20, 100]])
+        intervals.remove(0, 10)
+        self.assertEqual(state, [[20, 100]])
+        intervals.remove(90, 100)
+        self.assertEqual(state, [[20, 90]])
+        intervals.remove(40, 50)
+        intervals.remove(60, 70)
+        self.assertEqual(state, [[20, 40], [50, 60], [70, 90]])
+        # removing across intervals trims both ends and drops those in between
+        intervals.remove(30, 80)
+        self.assertEqual(state, [[20, 30], [80, 90]])
+        # removing a range that is not there changes nothing
+        intervals.remove(40, 50)
+        self.assertEqual(state, [[20, 30], [80, 90]])
+        self.assertTrue(intervals.contains(80, 90))
+
+    def test_add(self):
+        """
+        Test adding ranges merges them with the intervals they touch
+        """
+        state = [[20, 30], [80, 90]]
+        intervals = SioIntervalSet(state)
+        intervals.add(0, 10)
+        self.assertEqual(state, [[0, 10], [20, 30], [80, 90]])
+        intervals.add(30, 40)
+        self.assertEqual(state, [[0, 10], [20, 40], [80, 90]])
+        intervals.add(50, 80)
+        self.assertEqual(state, [[0, 10], [20, 40], [50, 90]])
+        intervals.add(5, 60)
+        self.assertEqual(state, [[0, 90]])
+        intervals.add(100, 110)
+        self.assertEqual(state, [[0, 90], [100, 110]])
+        self.assertTrue(intervals.contains(100, 105))
@@ -35,6 +35,7 @@ from mi.core.exceptions import SampleException, DatasetParserException
 from mi.core.instrument.data_particle import DataParticle, DataParticleKey
 from mi.core.log import get_logger; log = get_logger()
 from mi.dataset.dataset_parser import BufferLoadingParser
+from mi.dataset.parser.fixed_record_common import record_indices
 
 FLAG_RECORD_SIZE = 26                   # bytes
 FLAG_RECORD_REGEX = b'(\x00|\x01){26}'  # 26 bytes of zeroes or ones
@@ -295,14 +296,16 @@ class Vel3dKWfpStcParser(BufferLoadingParser):
         # Read in data in blocks so as to not tie up the CPU.
         BLOCK_SIZE = 1024
         eof = False
-        data = ''
+        blocks = []
         while not eof:
             next_block = self._stream_handle.read(BLOCK_SIZE)
             if next_block:
-                data = data + next_block
+                blocks.append(next_block)
                 gevent.sleep(0)
             else:
                 eof = True
+        # join the blocks once instead of copying the data read so far for every block
+        data = ''.join(blocks)
 
         if data != '':
             self._chunker.add_chunk(data, self._timestamp)
@@ -680,36 +683,25 @@ class Vel3dKWfpStcParser(BufferLoadingParser):
             start_index += FLAG_RECORD_SIZE
 
         source_length = len(source)   # Total bytes to process
- 
+
         #
         # While there is more data to process and we haven't found the
         # Time record yet, add a start,end pair for each Velocity record
-        # to the return list.
+        # to the return list. Only records with more bytes after them
+        # are Velocity records.
         #
-        while start_index < source_length:
-
-            #
-            # Compute the end index for the next Velocity record.
-            #
-            end_index = start_index + self.velocity_record_size
-
-            #
-            # If there are enough bytes to make a Velocity record,
-            # add this start,end pair to the list.
-            #
-            if end_index < source_length:
-                indices_list.append((start_index, end_index))
-                start_index = end_index
+        velocity_records = max(0, (source_length - start_index - 1) / self.velocity_record_size)
+        indices_list.extend(record_indices(start_index, velocity_records,
+                                           self.velocity_record_size))
+        start_index += velocity_records * self.velocity_record_size
 
-            #
-            # If not big enough to be a Velocity record,
-            # assume it's a Time record and any left-over bytes
-            # will be ignored.
-            #
-            else:
-                end_index = start_index + TIME_RECORD_SIZE
-                indices_list.append((start_index, end_index))
-                start_index = end_index
+        #
+        # Whatever is left is not big enough to be a Velocity record,
+        # assume it's a Time record and any left-over bytes
+        # will be ignored.
+        #
+        time_records = (source_length - start_index + TIME_RECORD_SIZE - 1) / TIME_RECORD_SIZE
+        indices_list.extend(record_indices(start_index, time_records, TIME_RECORD_SIZE))
 
         return indices_list
 
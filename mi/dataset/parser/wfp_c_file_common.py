@@ -25,8 +25,10 @@ from mi.core.instrument.data_particle import DataParticle, DataParticleKey
 from mi.core.exceptions import SampleException, DatasetParserException
 
 from mi.dataset.dataset_parser import BufferLoadingParser
+from mi.dataset.parser.fixed_record_common import record_indices, find_aligned
 
 EOP_ONLY_MATCHER = re.compile(b'\xFF{11}')
+EOP_BYTES = b'\xFF' * 11
 EOP_REGEX = b'\xFF{11}([\x00-\xFF]{8})'
 EOP_MATCHER = re.compile(EOP_REGEX)
 
@@ -84,27 +86,24 @@ class WfpCFileCommonParser(BufferLoadingParser):
         in this binary file.
         @param raw_data The raw data read from the file
         """
-        data_index = 0
-        return_list = []
         raw_data_len = len(raw_data)
+        if raw_data_len == 0:
+            return []
 
-        while data_index < raw_data_len:
-            # check if this is a status or data sample message
-            if EOP_ONLY_MATCHER.match(raw_data[data_index:data_index + DATA_RECORD_BYTES]):
-                if (raw_data_len - (data_index + DATA_RECORD_BYTES)) >= TIME_RECORD_BYTES:
-                    return_list.append((data_index, data_index + DATA_RECORD_BYTES + TIME_RECORD_BYTES))
-                    break;
-                else:
-                    # not enough bytes have been read to get both the end of profile and timestamps, need to wait for more
-                    break
-            else:
-                return_list.append((data_index, data_index + DATA_RECORD_BYTES))
-                data_index += DATA_RECORD_BYTES
-
+        # every record before the end of profile marker is a data record
+        eop_index = find_aligned(raw_data, EOP_BYTES, DATA_RECORD_BYTES)
+        if eop_index < 0:
             # if the remaining bytes are less than the data sample bytes, we will just have the
             # timestamp which is parsed in __init__
-            if (raw_data_len - data_index) < DATA_RECORD_BYTES:
-                break
+            num_records = max(raw_data_len / DATA_RECORD_BYTES, 1)
+        else:
+            num_records = eop_index / DATA_RECORD_BYTES
+        return_list = record_indices(0, num_records, DATA_RECORD_BYTES)
+
+        # not enough bytes may have been read to get both the end of profile and timestamps,
+        # if so need to wait for more
+        if eop_index >= 0 and (raw_data_len - (eop_index + DATA_RECORD_BYTES)) >= TIME_RECORD_BYTES:
+            return_list.append((eop_index, eop_index + DATA_RECORD_BYTES + TIME_RECORD_BYTES))
         return return_list
 
     def extract_metadata_particle(self, raw_data, timestamp):
@@ -7,11 +7,89 @@
 @brief Test code for the dataset driver base classes
 """
 
+import os
+import copy
+import shutil
+import tempfile
+
 from nose.plugins.attrib import attr
 
 from mi.core.unit_test import MiUnitTestCase
 from mi.core.exceptions import DataSourceLocationException
-from mi.dataset.dataset_driver import DataSourceLocation
+from mi.core.exceptions import SampleException, RecoverableSampleException
+from mi.dataset.dataset_driver import DataSourceLocation, SimpleDataSetDriver
+from mi.dataset.dataset_driver import DriverParameter, DriverStateKey
+from mi.dataset.dataset_driver import IngestEvent, _IngestWorker
+from mi.dataset.dataset_parser import BufferLoadingParser
+from mi.dataset.test.test_parser import line_sieve
+
+class UnpicklableLine(str):
+    """
+    A line that can't be sent back from an ingest process
+    """
+    def __reduce__(self):
+        raise TypeError("can't pickle %r" % self)
+
+class LineParser(BufferLoadingParser):
+    """
+    Parser publishing each line of a file, a line starting with 'bad' is a
+    recoverable error, a line starting with 'fail' ends the file and a line
+    starting with 'local' can't be pickled
+    """
+    def __init__(self, config, state, stream_handle, state_callback, publish_callback, exception_callback):
+        self._position = state or 0
+        stream_handle.seek(self._position)
+        super(LineParser, self).__init__(config, stream_handle, state, line_sieve,
+                                         state_callback, publish_callback, exception_callback)
+
+    def parse_chunks(self):
+        result = []
+        (timestamp, chunk) = self._chunker.get_next_data()
+        while chunk is not None:
+            self._position += len(chunk)
+            if chunk.startswith('bad'):
+                self._exception_callback(RecoverableSampleException("bad line %r" % chunk))
+            elif chunk.startswith('fail'):
+                raise SampleException("failed line %r" % chunk)
+            elif chunk.startswith('local'):
+                result.append((UnpicklableLine(chunk), self._position))
+            else:
+                result.append((chunk, self._position))
+            (timestamp, chunk) = self._chunker.get_next_data()
+        return result
+
+class LineDriver(SimpleDataSetDriver):
+    """
+    Driver parsing files with the LineParser
+    """
+    def _build_parser(self, parser_state, infile):
+        self._parser = LineParser(self._parser_config, parser_state, infile, self._save_parser_state,
+                                  self._data_callback, self._sample_exception_callback)
+        return self._parser
+
+class SizedLineDriver(LineDriver):
+    """
+    Driver overriding _got_file to build its parser with the file size, like
+    the WFP drivers
+    """
+    def _build_parser(self, parser_state, infile, filesize):
+        return super(SizedLineDriver, self)._build_parser(parser_state, infile)
+
+    def _got_file(self, file_name):
+        try:
+            self._file_in_process = file_name
+            path = os.path.join(self._harvester_config.get('directory'), file_name)
+            self._raise_new_file_event(path)
+            with open(path) as handle:
+                parser = self._build_parser(self._driver_state[file_name][DriverStateKey.PARSER_STATE],
+                                            handle, os.path.getsize(path))
+                while parser.get_records(7):
+                    pass
+        except SampleException as e:
+            self._save_parser_state_after_error()
+            self._sample_exception_callback(e)
+        finally:
+            self._file_in_process = None
 
 @attr('UNIT', group='mi')
 class DataSourceLocationUnitTestCase(MiUnitTestCase):
@@ -57,4 +135,144 @@ class DataSourceLocationUnitTestCase(MiUnitTestCase):
         self.assertEqual(dsl.parser_position, parser_pos1)
         
         
-                
\ No newline at end of file
+                
+
+@attr('UNIT', group='mi')
+class SimpleDataSetDriverUnitTestCase(MiUnitTestCase):
+    """
+    Test ingesting files in the simple data set driver
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.files = []
+        for i in range(7):
+            lines = ['file %d line %d\n' % (i, j) for j in range(50 * i + 1)]
+            if i == 3:
+                lines.insert(10, 'bad line\n')
+            if i == 5:
+                lines.insert(20, 'fail line\n')
+            self.write_file('file_%d.txt' % i, ''.join(lines))
+
+    def write_file(self, file_name, data):
+        with open(os.path.join(self.directory, file_name), 'w') as handle:
+            handle.write(data)
+        self.files.append(file_name)
+
+    def build_driver(self, ingest_processes, memento, published, driver_class=LineDriver):
+        """
+        @retval A driver appending the published data, states and events to
+            published
+        """
+        config = {
+            'harvester': {'directory': self.directory, 'pattern': '*.txt'},
+            'parser': {},
+            'driver': {DriverParameter.INGEST_PROCESSES: ingest_processes,
+                       DriverParameter.BATCHED_PARTICLE_COUNT: 7,
+                       DriverParameter.RECORDS_PER_SECOND: 1000000}
+        }
+        return driver_class(config, memento,
+                            lambda particles: published.append(('data', particles)),
+                            lambda state: published.append(('state', copy.deepcopy(state))),
+                            lambda **kwargs: published.append(('event', kwargs)),
+                            lambda exception: published.append(('exception', exception)))
+
+    def ingest(self, ingest_processes, memento=None, driver_class=LineDriver):
+        """
+        Queue all the files and poll until they are parsed
+        @retval A list of the published data, states and events in order
+        """
+        published = []
+        driver = self.build_driver(ingest_processes, memento, published, driver_class)
+        for file_name in self.files:
+            driver._new_file_callback(file_name)
+        while driver._new_file_queue:
+            driver._poll()
+        driver._stop_sampling()
+        return published
+
+    def test_parallel_ingest(self):
+        """
+        Test files parsed in ingest processes are published just like files
+        parsed in the driver
+        """
+        serial = self.ingest(1)
+        parallel = self.ingest(3)
+        self.assertEqual(parallel, serial)
+
+        state = serial[-1][1]
+        for file_name in self.files:
+            self.assertTrue(state[file_name][DriverStateKey.INGESTED])
+        self.assertEqual(state['file_6.txt'][DriverStateKey.PARSER_STATE],
+                         os.path.getsize(os.path.join(self.directory, 'file_6.txt')))
+        errors = [item[1]['error_msg'] for item in serial
+                  if item[0] == 'event' and item[1]['event_type'] == 'ResourceAgentErrorEvent']
+        self.assertEqual(len(errors), 2)
+        self.assertIn('bad line', errors[0])
+        self.assertIn('failed line', errors[1])
+
+    def test_parallel_resume(self):
+        """
+        Test ingest processes resume from the parser state in the memento
+        """
+        memento = copy.deepcopy(self.ingest(1)[-1][1])
+        with open(os.path.join(self.directory, 'file_6.txt')) as handle:
+            lines = handle.readlines()
+        memento['file_6.txt'][DriverStateKey.INGESTED] = False
+        memento['file_6.txt'][DriverStateKey.PARSER_STATE] = len(''.join(lines[:100]))
+        self.files = ['file_6.txt']
+        self.write_file('file_7.txt', 'another line\n' * 20)
+
+        published = self.ingest(2, memento)
+        data = [line for (kind, particles) in published if kind == 'data' for line in particles]
+        self.assertEqual(data, lines[100:] + ['another line\n'] * 20)
+        state = published[-1][1]
+        self.assertTrue(state['file_6.txt'][DriverStateKey.INGESTED])
+        self.assertTrue(state['file_7.txt'][DriverStateKey.INGESTED])
+
+    def test_parallel_stream(self):
+        """
+        Test an ingest process sends a file a batch of records at a time
+        """
+        driver = self.build_driver(2, None, [])
+        driver._new_file_callback('file_6.txt')
+        worker = _IngestWorker(driver, 'file_6.txt', 7)
+        driver._ingest_workers.append(worker)
+
+        batches = []
+        while not batches or batches[-1] != [(IngestEvent.END,)]:
+            batches.append(driver._next_ingest_batch(worker))
+        driver._stop_sampling()
+
+        # 301 lines in batches of 7, then the end
+        self.assertEqual(len(batches), 44)
+        self.assertEqual(batches[0][-1], (IngestEvent.BATCH,))
+        data = [event[1] for event in batches[0] if event[0] == IngestEvent.DATA]
+        self.assertEqual(data, [['file 6 line %d\n' % i for i in range(7)]])
+        self.assertFalse(driver._ingest_workers)
+
+    def test_parallel_fallback(self):
+        """
+        Test a file the ingest process can't send back is finished in the
+        driver from the parser state replayed so far
+        """
+        with open(os.path.join(self.directory, 'file_4.txt'), 'a') as handle:
+            handle.write('local line\n' + 'file 4 trailing line\n' * 30)
+        serial = self.ingest(1)
+        parallel = self.ingest(3)
+        self.assertEqual(parallel, serial)
+
+    def test_parallel_got_file_override(self):
+        """
+        Test a driver overriding _got_file ingests its files one at a time
+        """
+        driver = self.build_driver(3, None, [], SizedLineDriver)
+        self.assertFalse(driver._ingests_in_parallel())
+        self.assertTrue(self.build_driver(3, None, [])._ingests_in_parallel())
+
+        serial = self.ingest(1, driver_class=SizedLineDriver)
+        parallel = self.ingest(3, driver_class=SizedLineDriver)
+        self.assertEqual(parallel, serial)
+        state = parallel[-1][1]
+        for file_name in self.files:
+            self.assertTrue(state[file_name][DriverStateKey.INGESTED])
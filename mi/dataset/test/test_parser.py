@@ -7,11 +7,178 @@
 @brief Test code for the dataset parser base classes and common structures for
 testing parsers.
 """
+
+import os
+import tempfile
+from StringIO import StringIO
+
+from nose.plugins.attrib import attr
+
 from mi.core.unit_test import MiUnitTestCase, MiIntTestCase
+from mi.core.exceptions import SampleException
+from mi.dataset.dataset_parser import BufferLoadingParser, auto_block_size
+from mi.dataset.dataset_parser import MIN_BLOCK_SIZE, MAX_BLOCK_SIZE, RECORDS_PER_BLOCK
+from mi.core.instrument.data_particle import CompactDataParticle, DataParticleKey
 
 # Make some stubs if we need to share among parser test suites
 class ParserUnitTestCase(MiUnitTestCase):
     pass
 
 class ParserIntTestCase(MiIntTestCase):
-    pass
\ No newline at end of file
+    pass
+
+def line_sieve(raw_data):
+    """
+    Find the lines in the data
+    """
+    result = []
+    start = 0
+    end = raw_data.find('\n')
+    while end >= 0:
+        result.append((start, end + 1))
+        start = end + 1
+        end = raw_data.find('\n', start)
+    return result
+
+class LineParser(BufferLoadingParser):
+    """
+    Minimal parser returning each line of a file as a record
+    """
+    def __init__(self, config, stream_handle):
+        self.position = 0
+        super(LineParser, self).__init__(config, stream_handle, None, line_sieve,
+                                         lambda state, ingested: None,
+                                         lambda particles: None)
+        self.block_sizes = []
+
+    def get_block(self, size=None):
+        if size is None:
+            size = self._next_block_size()
+        self.block_sizes.append(size)
+        return super(LineParser, self).get_block(size)
+
+    def parse_chunks(self):
+        result = []
+        (timestamp, chunk) = self._chunker.get_next_data()
+        while chunk is not None:
+            self.position += len(chunk)
+            result.append((chunk, self.position))
+            (timestamp, chunk) = self._chunker.get_next_data()
+        return result
+
+class CountingParticle(CompactDataParticle):
+    """
+    Compact particle counting how many times its values are built
+    """
+    __slots__ = ()
+    _data_particle_type = 'counting'
+    builds = 0
+
+    def _build_parsed_values(self):
+        CountingParticle.builds += 1
+        return [{DataParticleKey.VALUE_ID: 'raw', DataParticleKey.VALUE: self.raw_data}]
+
+@attr('UNIT', group='mi')
+class ParserExtractSampleUnitTestCase(ParserUnitTestCase):
+    """
+    Test extracting particles in the parser
+    """
+    def test_extract_sample(self):
+        """
+        Test the values of an extracted compact particle are only built once
+        when it is checked for encoding errors and then published
+        """
+        CountingParticle.builds = 0
+        parser = LineParser({}, StringIO(''))
+        particle = parser._extract_sample(CountingParticle, None, 'line\n', 3600000000.0)
+        self.assertEqual(CountingParticle.builds, 1)
+        self.assertIn('"line\\n"', particle.generate())
+        self.assertEqual(CountingParticle.builds, 1)
+
+@attr('UNIT', group='mi')
+class BufferLoadingParserUnitTestCase(ParserUnitTestCase):
+    """
+    Test reading blocks in the buffer loading parser
+    """
+    def setUp(self):
+        self.data = ''.join('line %d %s\n' % (i, 'x' * (i % 50)) for i in range(5000))
+
+    def test_auto_block_size(self):
+        """
+        Test the block size is tuned to the record size
+        """
+        # no records yet, grow
+        self.assertEqual(auto_block_size(1024, 0, 1024), 2048)
+        self.assertEqual(auto_block_size(1024, 0, MAX_BLOCK_SIZE), MAX_BLOCK_SIZE)
+        # small records stay at the minimum
+        self.assertEqual(auto_block_size(1000, 100, 1024), MIN_BLOCK_SIZE)
+        self.assertEqual(auto_block_size(100000, 10, 1024), 10000 * RECORDS_PER_BLOCK)
+        self.assertEqual(auto_block_size(100000, 10, 1024, 3000), 318000)
+
+    def test_block_sizes(self):
+        """
+        Test the same records are found whatever the block size
+        """
+        expected = self.data.splitlines(True)
+        for config in [{'block_size': 1024}, {'block_size': 100}, {}]:
+            parser = LineParser(config, StringIO(self.data))
+            records = parser.get_records(10000)
+            self.assertEqual(records, expected)
+            self.assertTrue(parser.file_complete)
+
+        # the block grows until records are found, then tracks their size
+        data = 'x' * 100000 + '\n' + 'short\n' * 1000
+        parser = LineParser({}, StringIO(data))
+        self.assertEqual(len(parser.get_records(2000)), 1001)
+        self.assertEqual(parser.block_sizes[:4], [1024, 2048, 4096, 8192])
+        self.assertTrue(max(parser.block_sizes) >= 65536)
+
+    def test_max_buffer_size(self):
+        """
+        Test reads shrink so the chunker never holds more than the maximum
+        buffer size of unparsed data, and stop when it is full
+        """
+        data = ('x' * 5000 + '\n') * 10
+        parser = LineParser({'max_buffer_size': 10000}, StringIO(data))
+        self.assertEqual(parser.get_records(10), data.splitlines(True))
+        # the tuned block would hold 32 records, it is cut to the room left
+        # after the first record
+        self.assertEqual(parser.block_sizes[:4], [1024, 2048, 4096, 10000 - (7168 - 5001)])
+
+        data = 'x' * 100000 + '\n'
+        parser = LineParser({'max_buffer_size': 10000}, StringIO(data))
+        self.assertRaises(SampleException, parser.get_records, 1)
+        self.assertEqual(len(parser._chunker.buffer), 10000)
+        self.assertEqual(sum(parser.block_sizes), 10000)
+
+    def test_mmap(self):
+        """
+        Test reading blocks from a memory map keeps the file position
+        """
+        (handle, path) = tempfile.mkstemp()
+        try:
+            os.write(handle, self.data)
+            os.close(handle)
+            with open(path) as stream_handle:
+                parser = LineParser({'mmap': True}, stream_handle)
+                self.assertEqual(parser.get_records(10000), self.data.splitlines(True))
+                self.assertEqual(stream_handle.tell(), len(self.data))
+                self.assertEqual(parser._mmap, None)
+
+            # data added after the file is mapped is read too
+            with open(path) as stream_handle:
+                parser = LineParser({'mmap': True}, stream_handle)
+                self.assertEqual(len(parser.get_records(1)), 1)
+                with open(path, 'a') as append_handle:
+                    append_handle.write('appended\n')
+                records = parser.get_records(10000)
+                self.assertEqual(len(records), 5000)
+                self.assertEqual(records[-1], 'appended\n')
+
+            # an empty file can not be mapped, it is read instead
+            with open(path, 'w'):
+                pass
+            with open(path) as stream_handle:
+                self.assertEqual(LineParser({'mmap': True}, stream_handle).get_records(1), [])
+        finally:
+            os.remove(path)
@@ -12,11 +12,13 @@ import gevent
 import time
 import shutil
 import hashlib
+import tempfile
 
 from mi.core.log import get_logger ; log = get_logger()
 from nose.plugins.attrib import attr
 from mi.core.unit_test import MiUnitTest
-from mi.dataset.harvester import SingleDirectoryHarvester
+from mi.dataset import harvester
+from mi.dataset.harvester import SingleDirectoryHarvester, SingleDirectoryPoller
 from mi.dataset.dataset_driver import DriverStateKey, DataSetDriverConfigKeys
 
 TESTDIR = '/tmp/dsatest'
@@ -34,6 +36,84 @@ INDICIES = ['363_2013_0245_6_8', '363_2013_0245_6_9', '363_2013_0245_6_10', '363
             '363_2013_0245_7_0', '363_2013_0245_7_1', '363_2013_0245_7_10', '363_2013_0246_0_0',
             '363_2013_0246_7_0', '363_2013_0246_7_1', '363_2014_0012_0_0', '363_2014_0012_0_1', ]
 
+@attr('UNIT', group='mi')
+class TestSingleDirPoller(MiUnitTest):
+    """
+    Test the poller only checks the files which changed
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, True)
+        self.old_time = time.time() - 100
+        for i in [10, 2, 1]:
+            self.write_file('unit_%d.txt' % i, 'file %d' % i)
+
+        self.checksums = []
+        def file_checksum(path):
+            self.checksums.append(os.path.basename(path))
+            return hashlib.md5(open(path, 'rb').read()).hexdigest()
+        self.patch(harvester, 'file_checksum', file_checksum)
+
+    def patch(self, target, name, value):
+        original = getattr(target, name)
+        setattr(target, name, value)
+        self.addCleanup(setattr, target, name, original)
+
+    def write_file(self, file_name, data, mtime=None):
+        path = os.path.join(self.directory, file_name)
+        with open(path, 'w') as handle:
+            handle.write(data)
+        if mtime is None:
+            mtime = self.old_time
+        os.utime(path, (mtime, mtime))
+
+    def ingested_state(self, file_name, **kwargs):
+        path = os.path.join(self.directory, file_name)
+        state = {DriverStateKey.FILE_SIZE: os.path.getsize(path),
+                 DriverStateKey.FILE_MOD_DATE: os.path.getmtime(path),
+                 DriverStateKey.FILE_CHECKSUM: hashlib.md5(open(path, 'rb').read()).hexdigest(),
+                 DriverStateKey.INGESTED: True}
+        state.update(kwargs)
+        return state
+
+    def test_check_for_files(self):
+        """
+        Test new files are found once, in numeric order, and modified
+        ingested files are hashed once per change
+        """
+        memento = {'unit_1.txt': self.ingested_state('unit_1.txt'),
+                   # changed stat but the same contents
+                   'unit_2.txt': self.ingested_state('unit_2.txt', file_size=1)}
+        poller = SingleDirectoryPoller({'directory': self.directory, 'pattern': '*.txt'},
+                                       memento, None, file_mod_wait=10)
+        self.assertEqual(poller._check_for_files(), (['unit_10.txt'], {}))
+        self.assertEqual(self.checksums, ['unit_2.txt'])
+        self.assertEqual(poller._check_for_files(), ([], {}))
+        self.assertEqual(self.checksums, ['unit_2.txt'])
+
+        self.write_file('unit_1.txt', 'changed')
+        self.write_file('unit_3.txt', 'new')
+        (new_files, modified_state) = poller._check_for_files()
+        self.assertEqual(new_files, ['unit_3.txt'])
+        self.assertEqual(modified_state.keys(), ['unit_1.txt'])
+        self.assertEqual(modified_state['unit_1.txt'][DriverStateKey.FILE_SIZE], 7)
+        self.assertEqual(self.checksums, ['unit_2.txt', 'unit_1.txt'])
+
+        # a file is only sent once it has not been modified for the wait time
+        self.write_file('unit_4.txt', 'new', time.time() - 9.5)
+        self.assertEqual(poller._check_for_files(), ([], {}))
+        time.sleep(0.6)
+        self.assertEqual(poller._check_for_files(), (['unit_4.txt'], {}))
+        self.assertEqual(poller._check_for_files(), ([], {}))
+
+    def test_sort_files(self):
+        """
+        Test numbered files are sorted by number
+        """
+        poller = SingleDirectoryPoller({'directory': self.directory, 'pattern': '*.txt'}, {}, None)
+        self.assertEqual(poller.sort_files(['a/unit_10_2.txt', 'a/unit_2_10.txt', 'a/unit_2_9.txt']),
+                         ['a/unit_2_9.txt', 'a/unit_2_10.txt', 'a/unit_10_2.txt'])
+
 @attr('INT', group='eoi')
 class TestSingleDirHarvester(MiUnitTest):
     found_file_count = 0
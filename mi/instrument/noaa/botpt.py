@@ -0,0 +1,112 @@
+"""
+@package mi.instrument.noaa.botpt
+@file marine-integrations/mi/instrument/noaa/botpt.py
+@brief Routing of the BOTPT data stream to the sensor protocols
+
+The LILY, IRIS, NANO and HEAT sensors share one BOTPT serial stream, and
+every line of it starts with the tag of the sensor which sent it.  Instead
+of each protocol running its sieve regexes over the whole stream, the
+stream is split into lines once and each line is routed by its tag, so a
+protocol's chunker only sees the lines meant for it.
+"""
+
+__license__ = 'Apache 2.0'
+
+from mi.core.log import get_logger ; log = get_logger()
+
+from mi.core.common import BaseEnum
+
+# newline.
+NEWLINE = '\x0a'
+
+# a line longer than this without a newline is not BOTPT data
+MAX_LINE_LENGTH = 4096
+
+
+class BotptSensorTag(BaseEnum):
+    """
+    The tags starting the lines of each sensor
+    """
+    LILY = 'LILY,'
+    IRIS = 'IRIS,'
+    NANO = 'NANO,'
+    HEAT = 'HEAT,'
+    SYST = 'SYST,'
+
+
+class BotptDemultiplexer(object):
+    """
+    Split the BOTPT stream into lines and hand each complete line to the
+    callback registered for its sensor tag.  Lines with no registered tag
+    are dropped, and a partial line is held until the rest of it arrives.
+    """
+    def __init__(self, newline=NEWLINE):
+        """
+        @param newline The line terminator
+        """
+        self._newline = newline
+        self._routes = {}
+        self._buffer = ''
+        self._timestamp = None
+
+    def add_route(self, tag, callback):
+        """
+        Route the lines starting with a tag to a callback
+        @param tag The sensor tag, including the comma, i.e. BotptSensorTag.LILY
+        @param callback Called with each line and its port agent timestamp
+        """
+        if not tag.endswith(','):
+            raise ValueError("sensor tag %r must end with a comma" % tag)
+        self._routes[tag] = callback
+
+    def remove_route(self, tag):
+        """
+        Stop routing the lines starting with a tag
+        @param tag The sensor tag
+        """
+        self._routes.pop(tag, None)
+
+    def add_data(self, data, timestamp):
+        """
+        Route the complete lines in the data
+        @param data The data from the port agent
+        @param timestamp The port agent timestamp of the data, a line split
+            across packets gets the timestamp of the packet it started in
+        @retval The number of lines routed
+        """
+        if self._buffer:
+            line_timestamp = self._timestamp
+            data = self._buffer + data
+        else:
+            line_timestamp = timestamp
+
+        newline = self._newline
+        routes = self._routes
+        routed = 0
+        start = 0
+        end = data.find(newline)
+        while end >= 0:
+            end += len(newline)
+            # the tag is everything up to and including the first comma
+            callback = routes.get(data[start:data.find(',', start, end) + 1])
+            if callback is not None:
+                callback(data[start:end], line_timestamp)
+                routed += 1
+            line_timestamp = timestamp
+            start = end
+            end = data.find(newline, start)
+
+        self._buffer = data[start:]
+        self._timestamp = line_timestamp
+        if len(self._buffer) > MAX_LINE_LENGTH:
+            log.warn("Dropping %d bytes of BOTPT data without a newline", len(self._buffer))
+            self._buffer = ''
+
+        return routed
+
+    def clear(self):
+        """
+        Drop any partial line, i.e. after reconnecting
+        """
+        self._buffer = ''
+        self._timestamp = None
@@ -36,6 +36,7 @@ from mi.core.instrument.data_particle import DataParticle
 from mi.core.instrument.data_particle import DataParticleKey
 from mi.core.instrument.data_particle import CommonDataParticleType
 from mi.core.instrument.chunker import StringChunker
+from mi.instrument.noaa.botpt import BotptDemultiplexer, BotptSensorTag
 
 # DHE: Might need this if we use multiline regex
 #from mi.instrument.noaa.driver import BOTPTParticle
@@ -587,6 +588,10 @@ class Protocol(CommandResponseInstrumentProtocol):
         #
         self._chunker = StringChunker(Protocol.sieve_function)
 
+        # only the IRIS lines of the BOTPT stream are passed to the chunker
+        self._demultiplexer = BotptDemultiplexer(NEWLINE)
+        self._demultiplexer.add_route(BotptSensorTag.IRIS, self._got_line)
+
         # set up the regexes now so we don't have to do it repeatedly
         self.data_regex = IRISDataParticle.regex_compiled()
         self.cmd_rsp_regex = IRISCommandResponse.regex_compiled()
@@ -664,6 +669,34 @@ class Protocol(CommandResponseInstrumentProtocol):
         '''
         pass
     
+    def got_data(self, port_agent_packet):
+        """
+        Called by the instrument connection when data is available.
+        Overridden to route the lines of the BOTPT stream by sensor tag, so
+        the chunker only sieves the IRIS lines.
+        """
+        data_length = port_agent_packet.get_data_length()
+        data = port_agent_packet.get_data()
+        timestamp = port_agent_packet.get_timestamp()
+
+        log.debug("IRIS Got Data: %r", data)
+
+        if data_length > 0:
+            if self.get_current_state() == DriverProtocolState.DIRECT_ACCESS:
+                self._driver_event(DriverAsyncEvent.DIRECT_ACCESS, data)
+
+            self._demultiplexer.add_data(data, timestamp)
+
+    def _got_line(self, line, timestamp):
+        """
+        The demultiplexer has routed a IRIS line; pass it to the chunker.
+        """
+        self._chunker.add_chunk(line, timestamp)
+        (timestamp, chunk) = self._chunker.get_next_data()
+        while(chunk):
+            self._got_chunk(chunk, timestamp)
+            (timestamp, chunk) = self._chunker.get_next_data()
+
     def _my_add_to_buffer(self, data):
         """
         Replaces add_to_buffer. Most data coming to this driver isn't meant
@@ -679,9 +712,7 @@ class Protocol(CommandResponseInstrumentProtocol):
         """
         
         # Update the line and prompt buffers.
-        self._linebuf += data
-        self._promptbuf += data
-        self._last_data_timestamp = time.time()
+        CommandResponseInstrumentProtocol.add_to_buffer(self, data)
 
     def _got_chunk(self, chunk, timestamp):
         """
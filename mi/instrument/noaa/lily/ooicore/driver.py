@@ -40,6 +40,7 @@ from mi.core.instrument.data_particle import DataParticle
 from mi.core.instrument.data_particle import DataParticleKey
 from mi.core.instrument.data_particle import CommonDataParticleType
 from mi.core.instrument.chunker import StringChunker
+from mi.instrument.noaa.botpt import BotptDemultiplexer, BotptSensorTag
 from mi.core.driver_scheduler import DriverScheduler
 from mi.core.instrument.instrument_driver import DriverConfigKey
 from mi.core.driver_scheduler import DriverSchedulerConfigKey
@@ -190,37 +191,6 @@ class InstrumentCommand(BaseEnum):
     START_LEVELING  = LILY_STRING + LILY_COMMAND_STRING + LILY_LEVEL_ON + NEWLINE    # starts leveling 
     STOP_LEVELING  = LILY_STRING + LILY_COMMAND_STRING + LILY_LEVEL_OFF + NEWLINE    # stops leveling 
 
-class LILYCoarseChunk():
-
-    def __init__(self, raw_data):
-        """ 
-        Construct a LILYCoarseChunk object 
-        
-        @param raw_data The raw data used in the particle
-        """
-        self.raw_data = raw_data
-
-    @staticmethod
-    def regex():
-        """
-        Regular expression to match a sample pattern
-        @return: regex string
-        """
-        pattern = r'LILY,' # pattern starts with LILY '
-        pattern += r'.*' # group 1: time
-        pattern += NEWLINE
-        return pattern
-
-    @staticmethod
-    def regex_compiled():
-        """
-        get the compiled regex pattern
-        @return: compiled re
-        """
-        return re.compile(LILYCoarseChunk.regex())
-
-        return retValue
-
 class LILYCommandResponse():
 
     def __init__(self, raw_data):
@@ -777,10 +747,11 @@ class Protocol(CommandResponseInstrumentProtocol):
         # commands sent sent to device to be filtered in responses for telnet DA
         self._sent_cmds = []
 
-        # Set up the chunkers: this driver uses the chunker in a hierarchical way.  The coarse
-        # chunker filters the LILY messages from the BOTPT firehose, and the other chunkers
-        # work with what the coarse chunker matches.
-        self._coarse_chunker = StringChunker(Protocol.coarse_sieve_function)
+        # Set up the chunkers: this driver uses the chunker in a hierarchical way.  The
+        # demultiplexer routes the LILY lines from the BOTPT firehose, and the chunkers
+        # work with the lines it routes.
+        self._demultiplexer = BotptDemultiplexer(NEWLINE)
+        self._demultiplexer.add_route(BotptSensorTag.LILY, self._got_coarse_chunk)
         self._command_autosample_chunker = StringChunker(Protocol.command_autosample_sieve_function)
         self._leveling_chunker = StringChunker(Protocol.leveling_sieve_function)
 
@@ -801,27 +772,6 @@ class Protocol(CommandResponseInstrumentProtocol):
         # Initialize the AsyncEventSender object with the protocol_fsm
         AsyncEventSender.__my_init__(self._protocol_fsm)
 
-    @staticmethod
-    def coarse_sieve_function(raw_data):
-        """
-        The method that filters LILY coarse chunks
-        """
-
-        matchers = []
-        return_list = []
-
-        """
-        Not a good idea to be compiling these for every invocation of this
-        method; they don't change.
-        """
-        matchers.append(LILYCoarseChunk.regex_compiled())
-
-        for matcher in matchers:
-            for match in matcher.finditer(raw_data):
-                return_list.append((match.start(), match.end()))
-
-        return return_list
-
     @staticmethod
     def leveling_sieve_function(raw_data):
         """
@@ -955,12 +905,9 @@ class Protocol(CommandResponseInstrumentProtocol):
         
         # Update the line and prompt buffers; first acquire mutex.
         promptbuf_mutex.acquire()
-        self._linebuf += data
-        self._promptbuf += data
+        CommandResponseInstrumentProtocol.add_to_buffer(self, data)
         promptbuf_mutex.release()
 
-        self._last_data_timestamp = time.time()
-
     ########################################################################
     # Incomming data (for parsing) callback.
     ########################################################################            
@@ -970,7 +917,8 @@ class Protocol(CommandResponseInstrumentProtocol):
         This is overridden from the base class because this is where
         we filter the LILY data from the firehose of BOTPT data.
         
-        In this method all we do is call the coarse chunker.
+        In this method all we do is pass the data to the demultiplexer,
+        which calls _got_coarse_chunk with each LILY line.
         """
 
         data_length = port_agent_packet.get_data_length()
@@ -981,11 +929,7 @@ class Protocol(CommandResponseInstrumentProtocol):
         log.debug("LILY Add Port Agent Timestamp: %s" % timestamp)
 
         if data_length > 0:
-            self._coarse_chunker.add_chunk(data, timestamp)
-            (timestamp, chunk) = self._coarse_chunker.get_next_data()
-            while(chunk):
-                self._got_coarse_chunk(chunk, timestamp)
-                (timestamp, chunk) = self._coarse_chunker.get_next_data()
+            self._demultiplexer.add_data(data, timestamp)
 
 
     def _got_coarse_chunk(self, coarse_chunk, timestamp):
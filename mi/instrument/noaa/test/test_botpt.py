@@ -0,0 +1,68 @@
+"""
+@package mi.instrument.noaa.test.test_botpt
+@file marine-integrations/mi/instrument/noaa/test/test_botpt.py
+@brief Unit tests for routing the BOTPT data stream
+"""
+
+__license__ = 'Apache 2.0'
+
+from nose.plugins.attrib import attr
+from mi.core.unit_test import MiUnitTestCase
+
+from mi.instrument.noaa.botpt import BotptDemultiplexer, BotptSensorTag, NEWLINE, MAX_LINE_LENGTH
+
+NANO_SAMPLE = "NANO,P,2013/05/16 17:03:22.000,14.858126,25.243003840" + NEWLINE
+HEAT_SAMPLE = "HEAT,2013/04/19 22:54:11,-001,0001,0025" + NEWLINE
+IRIS_SAMPLE = "IRIS,2013/05/29 00:25:34, -0.0882, -0.7524,28.45,N8642" + NEWLINE
+LILY_SAMPLE = "LILY,2013/06/24 23:36:02,-235.500,  25.930,194.30, 26.04,11.96,N9655" + NEWLINE
+
+BOTPT_FIREHOSE = NANO_SAMPLE + HEAT_SAMPLE + IRIS_SAMPLE + NANO_SAMPLE + LILY_SAMPLE + HEAT_SAMPLE
+
+@attr('UNIT', group='mi')
+class BotptDemultiplexerUnitTestCase(MiUnitTestCase):
+    """
+    Test splitting the BOTPT stream by sensor tag
+    """
+    def setUp(self):
+        self.lines = []
+        self.demultiplexer = BotptDemultiplexer()
+        for tag in [BotptSensorTag.LILY, BotptSensorTag.NANO]:
+            self.demultiplexer.add_route(tag, lambda line, timestamp: self.lines.append((line, timestamp)))
+
+    def test_routing(self):
+        """
+        Test only the lines of the routed sensors are passed on
+        """
+        self.assertEqual(self.demultiplexer.add_data(BOTPT_FIREHOSE, 1.0), 3)
+        self.assertEqual(self.lines, [(NANO_SAMPLE, 1.0), (NANO_SAMPLE, 1.0), (LILY_SAMPLE, 1.0)])
+
+        self.demultiplexer.remove_route(BotptSensorTag.NANO)
+        self.lines = []
+        self.demultiplexer.add_data(BOTPT_FIREHOSE, 2.0)
+        self.assertEqual(self.lines, [(LILY_SAMPLE, 2.0)])
+
+        # lines without a tag, or with the tag later in the line, are dropped
+        self.lines = []
+        self.demultiplexer.add_data("garbage" + NEWLINE + "xx" + LILY_SAMPLE + NEWLINE, 3.0)
+        self.assertEqual(self.lines, [])
+
+        self.assertRaises(ValueError, self.demultiplexer.add_route, 'LILY', None)
+
+    def test_fragments(self):
+        """
+        Test lines split across packets are joined, with the timestamp of
+        the packet they started in
+        """
+        for (index, fragment) in enumerate([LILY_SAMPLE[:5], LILY_SAMPLE[5:20], LILY_SAMPLE[20:] + NANO_SAMPLE[:3],
+                                            NANO_SAMPLE[3:] + HEAT_SAMPLE + NANO_SAMPLE]):
+            self.demultiplexer.add_data(fragment, float(index))
+        self.assertEqual(self.lines, [(LILY_SAMPLE, 0.0), (NANO_SAMPLE, 2.0), (NANO_SAMPLE, 3.0)])
+
+        # a partial line is dropped when cleared or too long
+        self.lines = []
+        self.demultiplexer.add_data(LILY_SAMPLE[:10], 4.0)
+        self.demultiplexer.clear()
+        self.demultiplexer.add_data(NANO_SAMPLE, 5.0)
+        self.demultiplexer.add_data('NANO,' + 'x' * MAX_LINE_LENGTH, 6.0)
+        self.demultiplexer.add_data(LILY_SAMPLE, 7.0)
+        self.assertEqual(self.lines, [(NANO_SAMPLE, 5.0), (LILY_SAMPLE, 7.0)])
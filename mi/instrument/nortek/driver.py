@@ -991,13 +991,12 @@ class NortekProtocolParameterDict(ProtocolParameterDict):
         elif(target_params and isinstance(target_params, list)):
             params = target_params
         elif(target_params == None):
-            params = self._param_dict.keys()
+            params = None
         else:
             raise InstrumentParameterException("invalid target_params, must be name or list")
 
-        for name in params:
+        for (name, val) in self._candidates(input, params):
             log.trace("update param dict name: %s", name)
-            val = self._param_dict[name]
             if val.update(input, **kwargs):
                 found = True
         return found
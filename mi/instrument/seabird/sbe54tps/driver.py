@@ -39,6 +39,7 @@ from mi.core.exceptions import InstrumentParameterExpirationException
 
 from mi.core.instrument.data_particle import DataParticle, DataParticleKey, CommonDataParticleType
 from mi.core.instrument.chunker import StringChunker
+from mi.core.instrument.chunker import RegexSetSieve
 
 from mi.instrument.seabird.driver import SeaBirdInstrumentDriver
 from mi.instrument.seabird.driver import SeaBirdProtocol
@@ -185,6 +186,23 @@ SAMPLE_REF_OSC_MATCHER = re.compile(SAMPLE_REF_OSC_REGEX, re.DOTALL)
 ENGINEERING_DATA_REGEX = "<MainSupplyVoltage>([.\d]+)</MainSupplyVoltage>"
 ENGINEERING_DATA_MATCHER = re.compile(SAMPLE_REF_OSC_REGEX, re.DOTALL)
 
+# Every block we parse, in the order they are tried. One RegexSetSieve pass
+# over these both splits the stream and tells _got_chunk what it has.
+SIEVE_MATCHERS = [SAMPLE_DATA_REGEX_MATCHER,
+                  STATUS_DATA_REGEX_MATCHER,
+                  CONFIGURATION_DATA_REGEX_MATCHER,
+                  EVENT_COUNTER_DATA_REGEX_MATCHER,
+                  HARDWARE_DATA_REGEX_MATCHER,
+                  SAMPLE_REF_OSC_MATCHER]
+
+# Longest block the sieve looks for. The biggest, the configuration data, is
+# under 1k; this leaves room for longer event counter and status blocks.
+MAX_FRAME_SIZE = 4096
+
+# Stateless sieve for sieve_function, built once since combining the
+# matchers compiles a new regex.
+SIEVE = RegexSetSieve(SIEVE_MATCHERS, SIEVE_MATCHERS)
+
 class SBE54tpsStatusDataParticleKey(BaseEnum):
     DEVICE_TYPE = "device_type"
     SERIAL_NUMBER = "serial_number"
@@ -1047,6 +1065,14 @@ class SBE54tpsSampleRefOscDataParticle(DataParticle):
 ######################################### /PARTICLES #############################
 
 
+# Particle class for each of the SIEVE_MATCHERS
+PARTICLE_CLASSES = {SAMPLE_DATA_REGEX_MATCHER: SBE54tpsSampleDataParticle,
+                    STATUS_DATA_REGEX_MATCHER: SBE54tpsStatusDataParticle,
+                    CONFIGURATION_DATA_REGEX_MATCHER: SBE54tpsConfigurationDataParticle,
+                    EVENT_COUNTER_DATA_REGEX_MATCHER: SBE54tpsEventCounterDataParticle,
+                    HARDWARE_DATA_REGEX_MATCHER: SBE54tpsHardwareDataParticle,
+                    SAMPLE_REF_OSC_MATCHER: SBE54tpsSampleRefOscDataParticle}
+
 ###############################################################################
 # Driver
 ###############################################################################
@@ -1193,27 +1219,16 @@ class Protocol(SeaBirdProtocol):
         # commands sent sent to device to be filtered in responses for telnet DA
         self._sent_cmds = []
 
-        self._chunker = StringChunker(Protocol.sieve_function)
+        self._sieve = RegexSetSieve(SIEVE_MATCHERS, SIEVE_MATCHERS, MAX_FRAME_SIZE)
+        self._chunker = StringChunker(self._sieve)
 
     @staticmethod
     def sieve_function(raw_data):
         """
-        The method that splits samples
+        The method that splits samples. The protocol itself feeds a
+        RegexSetSieve over the same matchers to its chunker.
         """
-        return_list = []
-
-        sieve_matchers = [ STATUS_DATA_REGEX_MATCHER,
-                           CONFIGURATION_DATA_REGEX_MATCHER,
-                           EVENT_COUNTER_DATA_REGEX_MATCHER,
-                           HARDWARE_DATA_REGEX_MATCHER,
-                           SAMPLE_DATA_REGEX_MATCHER,
-                           ENGINEERING_DATA_MATCHER ]
-
-        for matcher in sieve_matchers:
-            for match in matcher.finditer(raw_data):
-                return_list.append((match.start(), match.end()))
-
-        return return_list
+        return [(s, e) for (s, e, matcher) in SIEVE(raw_data)]
 
     def _filter_capabilities(self, events):
         """
@@ -1971,19 +1986,17 @@ class Protocol(SeaBirdProtocol):
         # This instrument will automatically put itself back into autosample mode after a couple minutes idle
         # in command mode.  So if we see a sample we need to figure out if we need to raise an event to adjust
         # the state machine.
-        if(self._extract_sample(SBE54tpsSampleDataParticle, SAMPLE_DATA_REGEX_MATCHER, chunk, timestamp)):
+        matcher = self._sieve.identify(chunk)
+        if matcher is None:
+            return
+
+        if(self._extract_sample(PARTICLE_CLASSES[matcher], matcher, chunk, timestamp) and
+           matcher is SAMPLE_DATA_REGEX_MATCHER):
             log.debug("Sample record detected, publish a sample")
             if(self._protocol_fsm.get_current_state() == ProtocolState.COMMAND):
                 log.debug("FSM appears out of date.  Fixing it!")
                 #self._protocol_fsm.on_event(ProtocolEvent.RECOVER_AUTOSAMPLE)
                 self._async_raise_fsm_event(ProtocolEvent.RECOVER_AUTOSAMPLE)
-            return
-
-        if(self._extract_sample(SBE54tpsStatusDataParticle, STATUS_DATA_REGEX_MATCHER, chunk, timestamp)) : return
-        if(self._extract_sample(SBE54tpsConfigurationDataParticle, CONFIGURATION_DATA_REGEX_MATCHER, chunk, timestamp)) : return
-        if(self._extract_sample(SBE54tpsEventCounterDataParticle, EVENT_COUNTER_DATA_REGEX_MATCHER, chunk, timestamp)) : return
-        if(self._extract_sample(SBE54tpsHardwareDataParticle, HARDWARE_DATA_REGEX_MATCHER, chunk, timestamp)) : return
-        if(self._extract_sample(SBE54tpsSampleRefOscDataParticle, SAMPLE_REF_OSC_MATCHER, chunk, timestamp)) : return
 
     def _send_wakeup(self):
         """
@@ -19,6 +19,10 @@ from mi.instrument.teledyne.driver import TIMEOUT
 from mi.core.instrument.data_particle import DataParticle
 from mi.core.instrument.data_particle import DataParticleKey
 from mi.core.instrument.data_particle import CommonDataParticleType
+from mi.core.instrument.pd0 import Pd0Ensemble, Pd0DataTypeId, decode_cell_array
+from mi.instrument.teledyne.particles import WORKHORSE_HEADER
+from mi.instrument.teledyne.particles import WORKHORSE_FIXED_LEADER
+from mi.instrument.teledyne.particles import WORKHORSE_VARIABLE_LEADER
 
 from mi.core.exceptions import SampleException
 
@@ -205,68 +209,48 @@ class ADCP_PD0_PARSED_DataParticle(DataParticle):
 
         self.final_result = []
 
-        length = unpack("H", self.raw_data[2:4])[0]
-        data = str(self.raw_data)
-        #
-        # Calculate Checksum
-        #
-        total = int(0)
-        for i in range(0, length):
-            total += int(ord(data[i]))
-
-        checksum = total & 65535    # bitwise and with 65535 or mod vs 65536
-
-        if checksum != unpack("H", self.raw_data[length: length+2])[0]:
-            log.debug("Checksum mismatch "+ str(checksum) + "!= " + str(unpack("H", self.raw_data[length: length+2])[0]))
-
-            raise SampleException("Checksum mismatch")
+        ensemble = Pd0Ensemble(self.raw_data, WORKHORSE_HEADER)
+        checksum = ensemble.verify_checksum()
 
         self.final_result.append({DataParticleKey.VALUE_ID: ADCP_PD0_PARSED_KEY.CHECKSUM,
                                   DataParticleKey.VALUE: checksum})
 
-        (header_id, data_source_id, num_bytes, filler, num_data_types) = \
-            unpack('!BBHBB', self.raw_data[0:6])
+        header = ensemble.header
 
         self.final_result.append({DataParticleKey.VALUE_ID: ADCP_PD0_PARSED_KEY.HEADER_ID,
-                                  DataParticleKey.VALUE: header_id})
+                                  DataParticleKey.VALUE: header.header_id})
 
         self.final_result.append({DataParticleKey.VALUE_ID: ADCP_PD0_PARSED_KEY.DATA_SOURCE_ID,
-                                  DataParticleKey.VALUE: data_source_id})
+                                  DataParticleKey.VALUE: header.data_source_id})
 
         self.final_result.append({DataParticleKey.VALUE_ID: ADCP_PD0_PARSED_KEY.NUM_BYTES,
-                                  DataParticleKey.VALUE: num_bytes})
+                                  DataParticleKey.VALUE: header.num_bytes})
 
         self.final_result.append({DataParticleKey.VALUE_ID: ADCP_PD0_PARSED_KEY.NUM_DATA_TYPES,
-                                  DataParticleKey.VALUE: num_data_types})
-
-        offsets = []
-        for offset in range(0, num_data_types):
-            value = unpack('<H', self.raw_data[(2 * offset + 6):(2 * offset + 8)])[0]
-            offsets.append(value)
+                                  DataParticleKey.VALUE: header.num_data_types})
 
+        # the published offsets also include the end of the last data type
+        data_end = ensemble.length - 2
         self.final_result.append({DataParticleKey.VALUE_ID: ADCP_PD0_PARSED_KEY.OFFSET_DATA_TYPES,
-                                  DataParticleKey.VALUE: offsets})
-        offsets.append(length - 2)
-
-        chunks = []
-        for offset in range(0, num_data_types):
-            chunks.append(self.raw_data[offsets[offset] : offsets[offset + 1] ])
+                                  DataParticleKey.VALUE: ensemble.offsets + [data_end]})
 
-            variable_leader_id = unpack('!H', chunks[offset][0:2])[0]
+        for index in range(0, len(ensemble)):
+            chunk = ensemble.chunk(index, end=data_end)
 
-            if offset == 0:
-                self.parse_fixed_chunk(chunks[offset])
+            if index == 0:
+                self.parse_fixed_chunk(chunk)
             else:
-                if 32768 == variable_leader_id:
-                    self.parse_variable_chunk(chunks[offset])
-                elif 1 == variable_leader_id:
-                    self.parse_velocity_chunk(chunks[offset])
-                elif 2 == variable_leader_id:
-                    self.parse_corelation_magnitude_chunk(chunks[offset])
-                elif 3 == variable_leader_id:
-                    self.parse_echo_intensity_chunk(chunks[offset])
-                elif 4 == variable_leader_id:
-                    self.parse_percent_good_chunk(chunks[offset])
+                data_type_id = ensemble.data_type_id(index)
+                if Pd0DataTypeId.VARIABLE_LEADER == data_type_id:
+                    self.parse_variable_chunk(chunk)
+                elif Pd0DataTypeId.VELOCITY == data_type_id:
+                    self.parse_velocity_chunk(chunk)
+                elif Pd0DataTypeId.CORRELATION_MAGNITUDE == data_type_id:
+                    self.parse_corelation_magnitude_chunk(chunk)
+                elif Pd0DataTypeId.ECHO_INTENSITY == data_type_id:
+                    self.parse_echo_intensity_chunk(chunk)
+                elif Pd0DataTypeId.PERCENT_GOOD == data_type_id:
+                    self.parse_percent_good_chunk(chunk)
         return self.final_result
 
     def parse_fixed_chunk(self, chunk):
@@ -281,7 +265,7 @@ class ADCP_PD0_PARSED_DataParticle(DataParticle):
          sensor_available, bin_1_distance, transmit_pulse_length, reference_layer_start, reference_layer_stop, false_target_threshold,
          low_latency_trigger, transmit_lag_distance, cpu_board_serial_number, system_bandwidth, system_power,
          spare, serial_number, beam_angle) \
-        = unpack('!HBBHbBBBHHHBBBBHBBBBhhBBHHBBBBHQHBBIB', chunk[0:59])
+        = WORKHORSE_FIXED_LEADER.unpack(chunk)
 
         if 0 != fixed_leader_id:
             raise SampleException("fixed_leader_id was not equal to 0")
@@ -430,7 +414,7 @@ class ADCP_PD0_PARSED_DataParticle(DataParticle):
          error_status_word_1, error_status_word_2, error_status_word_3, error_status_word_4,
          RESERVED1, RESERVED2, pressure, RESERVED3, pressure_variance,
          rtc2k['century'], rtc2k['year'], rtc2k['month'], rtc2k['day'], rtc2k['hour'], rtc2k['minute'], rtc2k['second'], rtc2k['hundredths']) \
-        = unpack('<HHBBBBBBBBBBHHHhhHhBBBBBBBBBBBBBBBBBBBBLBLBBBBBBBB', chunk[0:65])
+        = WORKHORSE_VARIABLE_LEADER.unpack(chunk)
 
         if 128 != variable_leader_id:
             raise SampleException("variable_leader_id was not equal to 128")
@@ -550,8 +534,8 @@ class ADCP_PD0_PARSED_DataParticle(DataParticle):
 
         @throws SampleException If there is a problem with sample creation
         """
+        # the last depth cell is not reported
         N = (len(chunk) - 2) / 2 /4
-        offset = 0
 
         velocity_data_id = unpack("!H", chunk[0:2])[0]
         if 1 != velocity_data_id:
@@ -561,17 +545,8 @@ class ADCP_PD0_PARSED_DataParticle(DataParticle):
 
         if 0 == self.coord_transform_type: # BEAM Coordinates
             self._data_particle_type = DataParticleType.ADCP_PD0_PARSED_BEAM
-            beam_1_velocity = []
-            beam_2_velocity = []
-            beam_3_velocity = []
-            beam_4_velocity = []
-            for row in range (1, N):
-                (a,b,c,d) = unpack('!HHHH', chunk[offset + 2: offset + 10])
-                beam_1_velocity.append(a)
-                beam_2_velocity.append(b)
-                beam_3_velocity.append(c)
-                beam_4_velocity.append(d)
-                offset += 4 * 2
+            (beam_1_velocity, beam_2_velocity,
+             beam_3_velocity, beam_4_velocity) = decode_cell_array(chunk, '>u2', N - 1)
             self.final_result.append({DataParticleKey.VALUE_ID: ADCP_PD0_PARSED_KEY.BEAM_1_VELOCITY,
                                       DataParticleKey.VALUE: beam_1_velocity})
             self.final_result.append({DataParticleKey.VALUE_ID: ADCP_PD0_PARSED_KEY.BEAM_2_VELOCITY,
@@ -582,17 +557,8 @@ class ADCP_PD0_PARSED_DataParticle(DataParticle):
                                       DataParticleKey.VALUE: beam_4_velocity})
         elif 3 == self.coord_transform_type: # Earth Coordinates
             self._data_particle_type = DataParticleType.ADCP_PD0_PARSED_EARTH
-            water_velocity_east = []
-            water_velocity_north = []
-            water_velocity_up = []
-            error_velocity = []
-            for row in range (1, N):
-                (a,b,c,d) = unpack('!HHHH', chunk[offset + 2: offset + 10])
-                water_velocity_east.append(a)
-                water_velocity_north.append(b)
-                water_velocity_up.append(c)
-                error_velocity.append(d)
-                offset += 4 * 2
+            (water_velocity_east, water_velocity_north,
+             water_velocity_up, error_velocity) = decode_cell_array(chunk, '>u2', N - 1)
             self.final_result.append({DataParticleKey.VALUE_ID: ADCP_PD0_PARSED_KEY.WATER_VELOCITY_EAST,
                                       DataParticleKey.VALUE: water_velocity_east})
             self.final_result.append({DataParticleKey.VALUE_ID: ADCP_PD0_PARSED_KEY.WATER_VELOCITY_NORTH,
@@ -611,8 +577,8 @@ class ADCP_PD0_PARSED_DataParticle(DataParticle):
 
         @throws SampleException If there is a problem with sample creation
         """
+        # the last depth cell is not reported
         N = (len(chunk) - 2) / 2 /4
-        offset = 0
 
         correlation_magnitude_id = unpack("!H", chunk[0:2])[0]
         if 2 != correlation_magnitude_id:
@@ -620,17 +586,8 @@ class ADCP_PD0_PARSED_DataParticle(DataParticle):
         self.final_result.append({DataParticleKey.VALUE_ID: ADCP_PD0_PARSED_KEY.CORRELATION_MAGNITUDE_ID,
                                       DataParticleKey.VALUE: correlation_magnitude_id})
 
-        correlation_magnitude_beam1 = []
-        correlation_magnitude_beam2 = []
-        correlation_magnitude_beam3 = []
-        correlation_magnitude_beam4 = []
-        for row in range (1, N):
-            (a, b, c, d) = unpack('!HHHH', chunk[offset + 2: offset + 10])
-            correlation_magnitude_beam1.append(a)
-            correlation_magnitude_beam2.append(b)
-            correlation_magnitude_beam3.append(c)
-            correlation_magnitude_beam4.append(d)
-            offset += 4 * 2
+        (correlation_magnitude_beam1, correlation_magnitude_beam2,
+         correlation_magnitude_beam3, correlation_magnitude_beam4) = decode_cell_array(chunk, '>u2', N - 1)
 
         self.final_result.append({DataParticleKey.VALUE_ID: ADCP_PD0_PARSED_KEY.CORRELATION_MAGNITUDE_BEAM1,
                                   DataParticleKey.VALUE: correlation_magnitude_beam1})
@@ -647,8 +604,8 @@ class ADCP_PD0_PARSED_DataParticle(DataParticle):
 
         @throws SampleException If there is a problem with sample creation
         """
+        # the last depth cell is not reported
         N = (len(chunk) - 2) / 2 /4
-        offset = 0
 
         echo_intensity_id = unpack("!H", chunk[0:2])[0]
         if 3 != echo_intensity_id:
@@ -656,17 +613,8 @@ class ADCP_PD0_PARSED_DataParticle(DataParticle):
         self.final_result.append({DataParticleKey.VALUE_ID: ADCP_PD0_PARSED_KEY.ECHO_INTENSITY_ID,
                                       DataParticleKey.VALUE: echo_intensity_id})
 
-        echo_intesity_beam1 = []
-        echo_intesity_beam2 = []
-        echo_intesity_beam3 = []
-        echo_intesity_beam4 = []
-        for row in range (1, N):
-            (a, b, c, d) = unpack('!HHHH', chunk[offset + 2: offset + 10])
-            echo_intesity_beam1.append(a)
-            echo_intesity_beam2.append(b)
-            echo_intesity_beam3.append(c)
-            echo_intesity_beam4.append(d)
-            offset += 4 * 2
+        (echo_intesity_beam1, echo_intesity_beam2,
+         echo_intesity_beam3, echo_intesity_beam4) = decode_cell_array(chunk, '>u2', N - 1)
 
         self.final_result.append({DataParticleKey.VALUE_ID: ADCP_PD0_PARSED_KEY.ECHO_INTENSITY_BEAM1,
                                   DataParticleKey.VALUE: echo_intesity_beam1})
@@ -684,8 +632,8 @@ class ADCP_PD0_PARSED_DataParticle(DataParticle):
         @throws SampleException If there is a problem with sample creation
         """
 
+        # the last depth cell is not reported
         N = (len(chunk) - 2) / 2 /4
-        offset = 0
 
         # coord_transform_type
         # Coordinate Transformation type:
@@ -700,17 +648,8 @@ class ADCP_PD0_PARSED_DataParticle(DataParticle):
         if 0 == self.coord_transform_type: # BEAM Coordinates
 
             self._data_particle_type = DataParticleType.ADCP_PD0_PARSED_BEAM
-            percent_good_beam1 = []
-            percent_good_beam2 = []
-            percent_good_beam3 = []
-            percent_good_beam4 = []
-            for row in range (1, N):
-                (a,b,c,d) = unpack('!HHHH', chunk[offset + 2: offset + 10])
-                percent_good_beam1.append(a)
-                percent_good_beam2.append(b)
-                percent_good_beam3.append(c)
-                percent_good_beam4.append(d)
-                offset += 4 * 2
+            (percent_good_beam1, percent_good_beam2,
+             percent_good_beam3, percent_good_beam4) = decode_cell_array(chunk, '>u2', N - 1)
             self.final_result.append({DataParticleKey.VALUE_ID: ADCP_PD0_PARSED_KEY.PERCENT_GOOD_BEAM1,
                                       DataParticleKey.VALUE: percent_good_beam1})
             self.final_result.append({DataParticleKey.VALUE_ID: ADCP_PD0_PARSED_KEY.PERCENT_GOOD_BEAM2,
@@ -721,17 +660,8 @@ class ADCP_PD0_PARSED_DataParticle(DataParticle):
                                       DataParticleKey.VALUE: percent_good_beam4})
         elif 3 == self.coord_transform_type: # Earth Coordinates
             self._data_particle_type = DataParticleType.ADCP_PD0_PARSED_EARTH
-            percent_good_3beam = []
-            percent_transforms_reject = []
-            percent_bad_beams = []
-            percent_good_4beam = []
-            for row in range (1, N):
-                (a,b,c,d) = unpack('!HHHH', chunk[offset + 2: offset + 10])
-                percent_good_3beam.append(a)
-                percent_transforms_reject.append(b)
-                percent_bad_beams.append(c)
-                percent_good_4beam.append(d)
-                offset += 4 * 2
+            (percent_good_3beam, percent_transforms_reject,
+             percent_bad_beams, percent_good_4beam) = decode_cell_array(chunk, '>u2', N - 1)
             self.final_result.append({DataParticleKey.VALUE_ID: ADCP_PD0_PARSED_KEY.PERCENT_GOOD_3BEAM,
                                       DataParticleKey.VALUE: percent_good_3beam})
             self.final_result.append({DataParticleKey.VALUE_ID: ADCP_PD0_PARSED_KEY.PERCENT_TRANSFORMS_REJECT,